@@ -1,9 +1,14 @@
 # - Here the mid pre-allocated version using shift
 
+import taichi as ti
+
+from concepts.bonded import Bonded_forces
+from concepts.filaments import Filament_lists
+
 @ti.data_oriented
-class Cortex2D:
+class Cortex2D(Filament_lists):
 
-	def __init__(self, nfil, lfil, nmax, l0, m):
+	def __init__(self, nfil, lfil, nmax, l0, m, seed=0):
 
 		# - Init the python variables
 
@@ -11,6 +16,7 @@ class Cortex2D:
 		self.l0 = l0										# Length of one segment
 		self.nmax = nmax									# Number of available particles
 		self.mass = m										# Mass of the one particle
+		self.seed = seed									# Draws depend only on seed, step and filament
 
 		self.pseq = 1.0      								# - Probability of launching a sequence of polymerisation
 
@@ -18,6 +24,9 @@ class Cortex2D:
 		self.unprate = 0.0									# - depolymerisation rate
 		self.create = 0.0									# - emergence rate 
 
+		self.k_stretch = 10.0								# - Segment stiffness, rest length l0
+		self.k_bend = 1.0									# - Bending stiffness, straight at rest
+
 		# - Init the taichi variables
 
 		self.nfil = ti.field(dtype=ti.i32, shape=())		
@@ -56,111 +65,58 @@ class Cortex2D:
 		S2.place(self.len_stop)
 		S3.place(self.lenshift)
 
-		#S = ti.root.dynamic(ti.i, 1024, chunk_size=32)
-		#x = ti.field(int)
-		#S.place(x)
+		# - Bookkeeping of shift_lists, len_stop is one past the last particle
 
+		self.init_lists(inclusive=False)
 
-	def grow(self):
+		# - Filament mechanics, the topology changes at each grow : atomics rather than a CSR rebuild
 
-		if rd.random() < self.pseq :
+		self.bonds = Bonded_forces(self.nmax, self.nmax, self.nmax, mode="atomic")
+		self.topology_changed = True
 
-			self.rd_polym()
+		self.init_startstop()
+
+		#S = ti.root.dynamic(ti.i, 1024, chunk_size=32)
+		#x = ti.field(int)
+		#S.place(x)
 
-			self.shift_lists()
-	
-	@ti.kernel
-	def reinit_forces(self):
-		for k in range(self.nparticles):
-			self.forces[k] = [0.0 for _ in range(2)]
 
 	@ti.kernel
-	def rd_polym(self):
+	def init_startstop(self):
 
-		self.lenshift.fill(0)
-		self.shift.fill(0)
+		# Compact storage : the initial filaments packed one after the other, len_stop one past the last particle
 
+		ti.loop_config(serialize=True)
 		for k in range(self.nfil[None]):
 
-			if ti.random() < self.prate: 	# Polymerisation at the starting point of the filament
-				
-				self.lenshift[2*k] += 1
-				self.nparticles[None] += 1
-				self.nseg[None] += 1
-
-			if ti.random() < self.prate: 	# Polymerisation at the stopping point of the filament
-				
-				self.lenshift[2*k+1] += 1
-				self.nparticles[None] += 1
-				self.nseg[None] += 1
-
-			if ti.random() < self.unprate: 	# Depolymerisation at the starting point of the filament
+			self.len_start.append( k * self.lfil )
+			self.len_stop.append( (k+1) * self.lfil )
 
-				self.lenshift[2*k] -= 1
-				self.nparticles[None] -= 1
-				self.nseg[None] += 1
+		for k in range(2*self.nfil[None]):
 
-			if ti.random() < self.unprate: 	# Depolymerisation at the stopping point of the filament
+			self.lenshift.append( 0 )
 
-				self.lenshift[2*k+1] -= 1
-				self.nparticles[None] -= 1
-				self.nseg[None] += 1
+		for k in range(self.nseg[None]):							# Segment l - l+1 of filament k
+			f = k // (self.lfil-1)
+			self.link0[k] = f * self.lfil + k % (self.lfil-1)
+			self.link1[k] = self.link0[k] + 1
 
-		if ti.random() < self.create: 		# Polymerisation of a new filament
-	
-			self.nfil[None] += 1
-			self.nparticles[None] += 1
+	def grow(self, t): # Growth step t, launches only : nothing is read back from the device
 
-	@ti.kernel
-	def shift_lists(self):
+		self.topology_changed = True
 
-		for k in range(self.nfil[None]): 			# For each filament independantly
+		self.rd_polym(t)
+		self.shift_lists()
 	
-		# -------------------------------------------------------------------------------------------
-
-			shift = 0						# For the total shifting
-
-			for i in range(2*k):          	# Do the sum of the shifting
-
-				shift += self.lenshift[i] 
+	def mechanics(self): # Stretching and bending of every filament, added to forces. Launches only, nfil is read on device
 
-			shift += self.lenshift[2*k]  	# Take account of the shift of the beginning of the filament
+		if self.topology_changed:
+			self.bonds.from_ranges(self.len_start, self.len_stop, self.nfil, self.k_stretch, self.l0, self.k_bend, inclusive=self.inclusive)
+			self.topology_changed = False
 
-			ti.sync()
+		self.bonds.compute(self.pos, self.forces)
 
-			# -----------------------------------------------
-
-			for i in range(self.len_start[k], self.len_stop[k]): 
-
-				self.shift[k+shift] = self.pos[i] 		# Pickup the filament and apply the shift
-
-			# -----------------------------------------------
-
-			self.len_start[k] = self.len_start[k] + shift - self.lenshift[2*k]		# Adaptation of the new len_start
-			self.len_stop[k] = self.len_stop[k] + shift + self.lenshift[2*k+1]		# Adaptation of the new len_stop
-
-			if(self.lenshift[2*k]==1): self.shift[ self.len_start[k] - 1 ] = self.shift[ self.len_start[k] ] # If adding, copy the first particle
-			if(self.lenshift[2*k+1]==1): self.shift[ self.len_stop[k] + 1 ] = self.shift[ self.len_stop[k] ] # If adding, copy the last particle
-
-			ti.sync()
-
-		ti.sync()
-
-		# -------------------------------------------------------------------------------------------
-
-		for k in range(self.nparticles[None]):
-
-			self.pos[k] = self.shift[k]
-
-		ti.sync()
-
-		for k in range(self.nfil[None]):
-
-			start = self.len_start[k] - k # Taking account of the number of segment, not the number of particles
-
-			for i in range(self.len_start[k], self.len_stop[k]-1):
-
-				self.link0[ self.len_start[k]-k ] = i
-				self.link1[ self.len_start[k]-k ] = i + 1
-
-		ti.sync()
+	@ti.kernel
+	def reinit_forces(self):
+		for k in range(self.nmax):		# Slots left by a shrinking storage too
+			self.forces[k] = [0.0 for _ in range(2)]
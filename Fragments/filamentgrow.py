@@ -1,9 +1,17 @@
 import taichi as ti
 
+from concepts.bonded import Bonded_forces
+from concepts.filaments import Filament_lists
+from concepts.scan import exclusive_scan
+
 @ti.data_oriented
-class Cortex2D_test:
+class Cortex2D_test(Filament_lists):
+
+	def __init__(self, nfil, lfil, nmax, l0, m, storage="compact", slab_cap=None, seed=0):
 
-	def __init__(self, nfil, lfil, nmax, l0, m):
+		# storage "compact" : filaments packed one after the other, shift_lists rebuilds the whole
+		# storage at each grow. storage "slab" : filament k owns the slots [k*slab_cap, (k+1)*slab_cap)
+		# and only its ends are touched, see rd_polym_slab.
 
 		# - Init the python variables
 
@@ -11,6 +19,16 @@ class Cortex2D_test:
 		self.l0 = l0										# Length of one segment
 		self.nmax = nmax									# Number of available particles
 		self.mass = m										# Mass of the one particle
+		self.seed = seed									# Draws depend only on seed, step and filament
+
+		if storage not in ("compact", "slab"):
+			raise ValueError("Unknown filament storage : " + str(storage))
+
+		self.slab = storage == "slab"
+		self.slab_cap = slab_cap or 4 * lfil				# Slots of a slab, room to grow on both sides
+		self.nslabs = nmax // self.slab_cap					# Most filaments alive at once in slab mode
+		if self.slab and nfil > self.nslabs:
+			raise ValueError("Not enough slabs for the filaments : " + str(nfil) + " > " + str(self.nslabs))
 
 		self.pseq = 1.0      								# - Probability of launching a sequence of polymerisation
 
@@ -18,6 +36,9 @@ class Cortex2D_test:
 		self.unprate = 0.1									# - depolymerisation rate
 		self.create = 0.0									# - emergence rate 
 
+		self.k_stretch = 10.0								# - Segment stiffness, rest length l0
+		self.k_bend = 1.0									# - Bending stiffness, straight at rest
+
 		# - Init the taichi variables
 
 		self.nfil = ti.field(dtype=ti.i32, shape=())		
@@ -45,188 +66,242 @@ class Cortex2D_test:
 		S1 = ti.root.dynamic(ti.i, self.nmax, chunk_size=nfil)
 		S2 = ti.root.dynamic(ti.i, self.nmax, chunk_size=nfil)
 		S3 = ti.root.dynamic(ti.i, self.nmax, chunk_size=nfil)
-		S4 = ti.root.dynamic(ti.i, self.nmax, chunk_size=nfil)
 
 		self.len_start = ti.field(dtype=ti.i32)					# - supposed to evolve slowly
 		self.len_stop = ti.field(dtype=ti.i32)					# - supposed to evolve slowly
 		self.lenshift = ti.field(dtype=ti.i32)					# - Same thing for the register
-		self.filshift = ti.field(dtype=ti.i32)					# - In case a filament disappear
 
 		S1.place(self.len_start)
 		S2.place(self.len_stop)
 		S3.place(self.lenshift)
-		S4.place(self.filshift)
+
+		# - Bookkeeping of shift_lists, len_stop is the last particle of a filament
+
+		self.init_lists(inclusive=True)
+
+		# - Filament mechanics, the topology changes at each grow : atomics rather than a CSR rebuild
+
+		self.bonds = Bonded_forces(self.nmax, self.nmax, self.nmax, mode="atomic")
+		self.topology_changed = True
+
+		# - Slab storage : filament k lives in slab k, free slabs are a stack
+
+		if self.slab:
+
+			self.fil_live = ti.field(dtype=ti.i32, shape=(self.nslabs))		# - 1 if slab k holds a filament
+			self.free_slabs = ti.field(dtype=ti.i32, shape=(self.nslabs))
+			self.nfree = ti.field(dtype=ti.i32, shape=())
+			self.nrecenter = ti.field(dtype=ti.i32, shape=())				# - Filaments moved back to the middle of their slab
+			self.nrejected = ti.field(dtype=ti.i32, shape=())				# - Growths refused on a full slab
+
+			self.slab_free = ti.field(dtype=ti.i32, shape=(self.nslabs))		# - 1 - fil_live after the events of a step
+			self.slab_rank = ti.field(dtype=ti.i32, shape=(self.nslabs))		# - Rank of a free slab, exclusive scan of slab_free
+			self.slab_rank_end = ti.field(dtype=ti.i32, shape=(self.nslabs))
+			self.slab_block_sum = ti.field(dtype=ti.i32, shape=((self.nslabs + self.scan_block - 1) // self.scan_block))
 
 		self.init_startstop()
 
 	@ti.kernel
 	def rdplace(self, spacedim: float, cx: float, cy: float):
-		
+
+		self.domain[None] = [spacedim, cx, cy]			# New filaments spawn in the same square
+
 		for k in range(self.nfil[None]):
 			ti.loop_config(serialize=True)
 			alpha = ti.random()*2*3.14
 			pos = [ti.random()*spacedim+cx, ti.random()*spacedim+cy]
+			first = self.len_start[k]
 			for l in range(self.lfil):
 
-				self.pos[k*self.lfil+l] = [ pos[0] + l*ti.math.cos(alpha) , pos[1] + l*ti.math.sin(alpha) ]
+				self.pos[first+l] = [ pos[0] + l*ti.math.cos(alpha) , pos[1] + l*ti.math.sin(alpha) ]
 
-				if l > 0:
-					self.link0[k*(self.lfil-1)+l-1] = k*self.lfil+l-1
-					self.link1[k*(self.lfil-1)+l-1] = k*self.lfil+l
+				if ti.static(not self.slab) and l > 0:	# The links of slabs are fixed by init_startstop
+					self.link0[k*(self.lfil-1)+l-1] = first+l-1
+					self.link1[k*(self.lfil-1)+l-1] = first+l
 
 	@ti.kernel
 	def reinit_forces(self):
-		for k in range(self.nparticles[None]):
+		for k in range(self.nmax):		# Slabs have particles up to nmax
 			self.forces[k] = [0.0 for _ in range(2)]
 
-	def grow(self, t):
+	def mechanics(self): # Stretching and bending of every filament, added to forces
 
-		if rd.random() < self.pseq :
+		if self.topology_changed:
+			self.bonds.from_ranges(self.len_start, self.len_stop, self.nslabs if self.slab else self.nfil, self.k_stretch, self.l0, self.k_bend, inclusive=self.inclusive)
+			self.topology_changed = False
 
-			self.filshift.fill(0)
-			self.lenshift.fill(0)
-			self.shift.fill(0)
+		self.bonds.compute(self.pos, self.forces)
 
-			self.rd_polym(t)
-			ti.sync()
+	def grow(self, t): # Growth step t, launches only : nothing is read back from the device
+
+		self.topology_changed = True
 
+		if self.slab:
+			self.rd_polym_slab(t)
+		else:
+			self.rd_polym(t)
 			self.shift_lists()
-			ti.sync()
 
 	@ti.kernel
 	def init_startstop(self):
 
-		ti.loop_config(serialize=True)
-		for k in range(self.nfil[None]):
-			
-			self.len_start.append( k * self.lfil )
-			self.len_stop.append( (k+1) * self.lfil -1 )
-			self.filshift.append( 0 )
-
-		for k in range(2*self.nfil[None]):
+		if ti.static(self.slab):
 
-			self.lenshift.append( 0 )
+			pad = (self.slab_cap - self.lfil) // 2
 
-	@ti.kernel
-	def rd_polym(self, t: int):
-
-		for k in range(self.nfil[None]):
-
-			if ti.random() < self.prate: 	# Polymerisation at the starting point of the filament
-
-				self.lenshift[2*k] += 1
-				self.nparticles[None] += 1
-				self.nseg[None] += 1
-
-			if ti.random() < self.prate: 	# Polymerisation at the stopping point of the filament
-
-				self.lenshift[2*k+1] += 1
-				self.nparticles[None] += 1
-				self.nseg[None] += 1
-
-			if ti.random() < self.unprate: 	# Depolymerisation at the starting point of the filament
-
-				self.lenshift[2*k] -= 1
-				self.nparticles[None] -= 1
-				self.nseg[None] -= 1
-
-			if ti.random() < self.unprate: 	# Depolymerisation at the stopping point of the filament
+			ti.loop_config(serialize=True)
+			for k in range(self.nslabs):
 
-				self.lenshift[2*k+1] -= 1
-				self.nparticles[None] -= 1
-				self.nseg[None] -= 1
+				base = k * self.slab_cap
+				if k < self.nfil[None]:
+					self.len_start.append( base + pad )
+					self.len_stop.append( base + pad + self.lfil - 1 )
+					self.fil_live[k] = 1
+				else:										# Empty slab, start = stop + 1
+					self.len_start.append( base + self.slab_cap // 2 )
+					self.len_stop.append( base + self.slab_cap // 2 - 1 )
+					self.fil_live[k] = 0
+					self.free_slabs[ self.nslabs - 1 - k ] = k
 
-			# In the case the filament disappear
-			if self.len_start[k] - self.len_stop[k] >= self.lenshift[2*k+1] + self.lenshift[2*k] :
+			self.nfree[None] = self.nslabs - self.nfil[None]
 
-				self.filshift[k] -= 1
-				self.nseg[None] += 1 # We delete a single particle
+			for i in range(self.nmax):						# Segment i - i+1 of a slab, valid for len_start <= i < len_stop
+				self.link0[i] = i
+				self.link1[i] = i + 1
 
-				# just make sure to don't apply -2 on a 1 length filament, we repair the system
-				if self.len_start[k] - self.len_stop[k] == 1 and self.lenshift[2*k+1] + self.lenshift[2*k] == -2: 
+		else:
 
-					self.lenshift[2*k] = -1
-					self.lenshift[2*k+1] = 0
-					self.nparticles[None] += 1
-					self.nseg[None] -= 1
+			ti.loop_config(serialize=True)
+			for k in range(self.nfil[None]):
 
-		if ti.random() < self.create: 		# Polymerisation of a new filament
-	
-			self.nfil[None] += 1
-			self.nparticles[None] += 1
+				self.len_start.append( k * self.lfil )
+				self.len_stop.append( (k+1) * self.lfil -1 )
 
-	@ti.kernel
-	def shift_lists(self):
+		for k in range(2*self.nfil[None]):
 
-		new_nfil = self.nfil[None]
+			self.lenshift.append( 0 )
 
-		for k in range(self.nfil[None]): 			# For each filament independantly
-	
-		# -------------------------------------------------------------------------------------------
+	# - Slab storage : events are applied in place, each thread owns the slab of its filament
 
-			shift = 0									# For the total shifting
-			fshift = 0 									# For the total filament shifting
+	@ti.func
+	def recenter(self, k, at_start: ti.template()): # Move filament k back to the middle of its slab, O(its length)
 
-			for i in range(2*k):          				# Do the sum of the shifting of the previous fils
+		start = self.len_start[k]
+		n = self.len_stop[k] - start + 1
+		new = k * self.slab_cap + (self.slab_cap - n) // 2		# An odd spare slot goes to the growing end
+		if ti.static(at_start):
+			new = k * self.slab_cap + (self.slab_cap - n + 1) // 2
 
-				shift += self.lenshift[i] 
+		if new < start:
+			for i in range(n):
+				self.pos[new + i] = self.pos[start + i]
+		elif new > start:
+			for j in range(n):
+				self.pos[new + n - 1 - j] = self.pos[start + n - 1 - j]
 
-			for i in range(k):
+		for i in range(start, start + n):		# Slots left behind
+			if i < new or i >= new + n:
+				self.pos[i] = [0.0, 0.0]
 
-				fshift += self.filshift[i]
+		self.len_start[k] = new
+		self.len_stop[k] = new + n - 1
+		ti.atomic_add(self.nrecenter[None], 1)
 
-			rstart = self.len_start[k]      					# Start for reading
-			rstop = self.len_stop[k] + 1						# Stop for reading
+	@ti.func
+	def extend(self, k, at_start: ti.template()): # One more particle at an end of filament k
 
-			self.len_start[k] += shift                        							# Start for the writting
-			self.len_stop[k] += shift + self.lenshift[2*k] + self.lenshift[2*k+1] 		# Stop for the writting
+		n = self.len_stop[k] - self.len_start[k] + 1
+		base = k * self.slab_cap
 
-			# Take account of the shift of the beginning of the filament
+		if n >= self.slab_cap:
+			ti.atomic_add(self.nrejected[None], 1)
 
-			if self.lenshift[2*k] == -1 : rstart+=1  			# Reduce the range of reading
-			if self.lenshift[2*k+1] == -1 : rstop-=1 			# Reduce the range of reading
+		else:
 
-			if rstop - rstart < 1: new_nfil -= 1
+			if ti.static(at_start):
+				if self.len_start[k] == base: self.recenter(k, True)
+			else:
+				if self.len_stop[k] == base + self.slab_cap - 1: self.recenter(k, False)
 
-			# -----------------------------------------------
+			end = self.len_start[k] if ti.static(at_start) else self.len_stop[k]
+			inner = end + 1 if ti.static(at_start) else end - 1
 
-			for i in range(rstart, rstop): 
+			new = end - 1 if ti.static(at_start) else end + 1
+			self.pos[new] = self.pos[end] + self.end_step(end, inner, n, at_start)
+			if ti.static(at_start):
+				self.len_start[k] = new
+			else:
+				self.len_stop[k] = new
 
-				self.shift[ i + shift + self.lenshift[2*k] ] = self.pos[i] 		# Pickup the filament and apply the shift
+	@ti.func
+	def retract(self, k, at_start: ti.template()): # One particle less at an end of filament k, it dies at length 0
 
-			ti.sync()
+		if ti.static(at_start):
+			self.pos[ self.len_start[k] ] = [0.0, 0.0]
+			self.len_start[k] += 1
+		else:
+			self.pos[ self.len_stop[k] ] = [0.0, 0.0]
+			self.len_stop[k] -= 1
 
-			# -----------------------------------------------
-			if self.filshift[k] < 0:
+		if self.len_stop[k] < self.len_start[k]:		# Slab freed, empty in its middle
+			self.fil_live[k] = 0
+			self.len_start[k] = k * self.slab_cap + self.slab_cap // 2
+			self.len_stop[k] = self.len_start[k] - 1
 
-				self.len_start[k + fshift] = self.len_start[k] + shift - self.lenshift[2*k]		# Adaptation of the new len_start
-				self.len_stop[k + fshift] = self.len_stop[k] + shift + self.lenshift[2*k+1]		# Adaptation of the new len_stop
+	def rd_polym_slab(self, t):
 
-			if(self.lenshift[2*k]==1):  														# If adding, copy the first particle
-				self.shift[ self.len_start[k] ] = self.shift[ self.len_start[k]+1  ]
-				self.shift[ self.len_start[k] ] += 1 * ( self.shift[ self.len_start[k]+1 ] - self.shift[ self.len_start[k]+2 ] )
-			if(self.lenshift[2*k+1]==1): 														# If adding, copy the last particle
-				self.shift[ self.len_stop[k] ] = self.shift[ self.len_stop[k]-1  ] 
-				self.shift[ self.len_stop[k] ] += 1 * ( self.shift[ self.len_stop[k]-1 ] - self.shift[ self.len_stop[k]-2 ] )
+		# Same draws as rd_polym (Filament_lists), applied at once : O(1) per event and no global rebuild.
+		# The stack of the free slabs is then rebuilt from a parallel scan of the free flags, in slab
+		# order whatever the thread order of the events.
 
-		# -------------------------------------------------------------------------------------------
+		self.slab_events(t)
+		exclusive_scan(self.slab_free, self.slab_rank, self.slab_rank_end, self.slab_block_sum, self.scan_block)
+		self.slab_commit(t)
 
-		for k in range(self.nmax):
+	@ti.kernel
+	def slab_events(self, t: int):
 
-			if k < self.nparticles[None]:
-				self.pos[k] = self.shift[k]
-			else:
-				self.pos[k] = 0
-		
-		for k in range(self.nfil[None]):
+		active = self.draw_active(t)
 
-			start = self.len_start[k] #- k # Taking account of the number of segment, not the number of particles
+		for k in range(self.nslabs):
 
-			for i in range(start, self.len_stop[k]):
+			if active and self.fil_live[k] == 1:
 
-				self.link0[ i-k ] = i
-				self.link1[ i-k ] = i + 1
+				e = self.draw_events(t, k)
+				if e[0] == 1: self.extend(k, True)
+				if e[1] == 1: self.extend(k, False)
+				if e[2] == 1 and self.fil_live[k] == 1: self.retract(k, True)
+				if e[3] == 1 and self.fil_live[k] == 1: self.retract(k, False)
 
-		ti.sync()
+			self.slab_free[k] = 1 - self.fil_live[k]
 
-		self.nfil[None] = new_nfil
+	@ti.kernel
+	def slab_commit(self, t: int):
+
+		nfree = self.slab_rank_end[self.nslabs - 1]
+		for k in range(self.nslabs):		# Stack of the free slabs, the lowest one on top
+			if self.slab_free[k] == 1:
+				self.free_slabs[ nfree - 1 - self.slab_rank[k] ] = k
+		self.nfree[None] = nfree
+
+		active = self.draw_active(t)
+		if self.draw_create(t, active) and self.nfree[None] > 0: 		# Polymerisation of a new filament, at a random point of the domain
+
+			self.nfree[None] -= 1
+			k = self.free_slabs[ self.nfree[None] ]
+			mid = k * self.slab_cap + self.slab_cap // 2
+			self.len_start[k] = mid
+			self.len_stop[k] = mid
+			self.pos[mid] = self.draw_spawn(t)
+			self.fil_live[k] = 1
+
+		nfil = 0
+		npart = 0
+		for k in range(self.nslabs):	# Reductions
+			if self.fil_live[k] == 1:
+				nfil += 1
+				npart += self.len_stop[k] - self.len_start[k] + 1
+
+		self.nfil[None] = nfil
+		self.nparticles[None] = npart
+		self.nseg[None] = npart - nfil
@@ -1,48 +1,170 @@
+import numpy as np
+import taichi as ti
+
+# - We can define the basics of a particle system.
+# - This is an independan model regarding its dynamics and forcesystem, other objects can be added after
+#
+# - Objects to render have a pos field, optionally link0 / link1, and nparticles / nseg counts
+#   (ints or 0-d fields). Slab storages (obj.slab) are compacted on the fly.
+# - GUI mode : the live particles and segments are scaled on device and copied into host
+#   buffers that are reused from frame to frame, only the live count crosses over.
+# - offscreen mode : no GUI, discs and lines are rasterized on device into frame, an RGB field.
+
+def live_count(obj, name):
+    n = getattr(obj, name)
+    return int(n[None]) if isinstance(n, ti.Field) else int(n)
+
+def hex_to_rgb(color):
+    return ((color >> 16) & 0xFF) / 255.0, ((color >> 8) & 0xFF) / 255.0, (color & 0xFF) / 255.0
+
 @ti.data_oriented
 class Renderer_2D:
 
-    def __init__(self, resx, resy, stwr):
+    def __init__(self, resx, resy, stwr, offscreen=False):
 
         self.screen_res = (resx, resy)
-        self.stwr = stwr
-        self.gui = ti.GUI("Particles system", self.screen_res)
+        self.stwr = stwr                # screen to world ratio, pixels per world unit
+        self.offscreen = offscreen
+
+        self.gui = None if offscreen else ti.GUI("Particles system", self.screen_res)
+        self.frame = ti.Vector.field(3, dtype=ti.f32, shape=self.screen_res) if offscreen else None
+
+        # -- Host buffers, grown when needed, never shrunk
+        self.p_host = np.zeros((0, 2), dtype=np.float32)
+        self.l0_host = np.zeros((0, 2), dtype=np.float32)
+        self.l1_host = np.zeros((0, 2), dtype=np.float32)
+
+        self.count = ti.field(dtype=ti.i32, shape=())   # slots written by the compacting gathers
+
+    def host_buffer(self, name, n):
+        buf = getattr(self, name)
+        if buf.shape[0] < n:
+            buf = np.zeros((max(n, 2 * buf.shape[0]), 2), dtype=np.float32)
+            setattr(self, name, buf)
+        return buf[:n]
+
+    # - Live particles and segments, slab storages hold them between len_start and len_stop
+
+    @ti.func
+    def live_slot(self, obj, i):
+        k = i // obj.slab_cap
+        return obj.fil_live[k] == 1 and i >= obj.len_start[k] and i <= obj.len_stop[k]
+
+    @ti.kernel
+    def gather_particles(self, obj: ti.template(), n: int, out: ti.types.ndarray()):
+
+        scale = ti.Vector([self.stwr / self.screen_res[0], self.stwr / self.screen_res[1]])
+
+        if ti.static(getattr(obj, "slab", False)):
+            self.count[None] = 0
+            for i in range(obj.nmax):
+                if self.live_slot(obj, i):
+                    s = ti.atomic_add(self.count[None], 1)
+                    for j in ti.static(range(2)):
+                        out[s, j] = obj.pos[i][j] * scale[j]
+        else:
+            for i in range(n):
+                for j in ti.static(range(2)):
+                    out[i, j] = obj.pos[i][j] * scale[j]
+
+    @ti.kernel
+    def gather_segments(self, obj: ti.template(), n: int, out0: ti.types.ndarray(), out1: ti.types.ndarray()):
+
+        scale = ti.Vector([self.stwr / self.screen_res[0], self.stwr / self.screen_res[1]])
+
+        if ti.static(getattr(obj, "slab", False)):     # segment i - i+1 lives with both ends
+            self.count[None] = 0
+            for i in range(obj.nmax - 1):
+                if self.live_slot(obj, i) and self.live_slot(obj, i + 1):
+                    s = ti.atomic_add(self.count[None], 1)
+                    for j in ti.static(range(2)):
+                        out0[s, j] = obj.pos[i][j] * scale[j]
+                        out1[s, j] = obj.pos[i + 1][j] * scale[j]
+        else:
+            for i in range(n):
+                for j in ti.static(range(2)):
+                    out0[i, j] = obj.pos[ obj.link0[i] ][j] * scale[j]
+                    out1[i, j] = obj.pos[ obj.link1[i] ][j] * scale[j]
+
+    # - Offscreen rasterizer
+
+    @ti.func
+    def stamp(self, c, rad, color): # Disc of radius rad pixels centered on pixel coordinates c
+
+        for dx, dy in ti.ndrange((-rad, rad + 1), (-rad, rad + 1)):
+            if dx * dx + dy * dy <= rad * rad:
+                x = int(c[0]) + dx
+                y = int(c[1]) + dy
+                if x >= 0 and x < self.screen_res[0] and y >= 0 and y < self.screen_res[1]:
+                    self.frame[x, y] = color
+
+    @ti.kernel
+    def raster_clear(self, color: ti.types.vector(3, ti.f32)):
+        for x, y in self.frame:
+            self.frame[x, y] = color
+
+    @ti.kernel
+    def raster_particles(self, obj: ti.template(), n: int, rad: int, color: ti.types.vector(3, ti.f32)):
+
+        if ti.static(getattr(obj, "slab", False)):
+            for i in range(obj.nmax):
+                if self.live_slot(obj, i):
+                    self.stamp(obj.pos[i] * self.stwr, rad, color)
+        else:
+            for i in range(n):
+                self.stamp(obj.pos[i] * self.stwr, rad, color)
+
+    @ti.func
+    def raster_segment(self, a, b, rad, color): # Discs every pixel along a - b
+
+        steps = int(ti.max(ti.abs(b - a).max(), 1.0)) + 1
+        for t in range(steps + 1):
+            self.stamp(a + (b - a) * (t / steps), rad, color)
+
+    @ti.kernel
+    def raster_lines(self, obj: ti.template(), n: int, rad: int, color: ti.types.vector(3, ti.f32)):
+
+        if ti.static(getattr(obj, "slab", False)):
+            for i in range(obj.nmax - 1):
+                if self.live_slot(obj, i) and self.live_slot(obj, i + 1):
+                    self.raster_segment(obj.pos[i] * self.stwr, obj.pos[i + 1] * self.stwr, rad, color)
+        else:
+            for i in range(n):
+                self.raster_segment(obj.pos[ obj.link0[i] ] * self.stwr, obj.pos[ obj.link1[i] ] * self.stwr, rad, color)
+
+    # - Frame
 
     def clear_screen(self):
         bg_color = 0x000000 # Black
-        self.gui.clear(bg_color)
+        if self.offscreen:
+            self.raster_clear(ti.Vector(hex_to_rgb(bg_color)))
+        else:
+            self.gui.clear(bg_color)
 
-    def render_particles(self,obj,prad,pc):
-      
-        p_pos_np = obj.pos.to_numpy()
-      
-        for j in range(2): p_pos_np[:, j] *= self.stwr / self.screen_res[j]
-          
-        self.gui.circles(p_pos_np, radius=prad, color=pc)
+    def render_particles(self, obj, prad, pc):
 
-    @ti.kernel
-    def fill_plinks(self, obj: ti.template(), pos0: ti.template(), pos1: ti.template()):
-      
-        for i in range(obj.nseg):
-          
-            pos0[i] = obj.pos[ obj.link0[i] ]
-            pos1[i] = obj.pos[ obj.link1[i] ]
-		
-    def render_lines(self,obj,rad,sc):
-
-        pos0 = ti.Vector.field(2, shape=obj.nseg, dtype=ti.f32)
-        pos1 = ti.Vector.field(2, shape=obj.nseg, dtype=ti.f32)
-
-        self.fill_plinks(obj, pos0, pos1)
-	
-        link0 = pos0.to_numpy()
-        link1 = pos1.to_numpy()
-
-        for j in range(2):
-        	link0[:, j] *= self.stwr / self.screen_res[j]
-        	link1[:, j] *= self.stwr / self.screen_res[j]
-
-        self.gui.lines(link0,link1, radius=rad, color=sc)
-        #self.gui.circles(link0, radius=rad, color=sc)
-
-    def show(self):
-        self.gui.show()
+        n = live_count(obj, "nparticles")
+        if self.offscreen:
+            self.raster_particles(obj, n, int(prad), ti.Vector(hex_to_rgb(pc)))
+        else:
+            p_pos_np = self.host_buffer("p_host", n)
+            self.gather_particles(obj, n, p_pos_np)
+            self.gui.circles(p_pos_np, radius=prad, color=pc)
+
+    def render_lines(self, obj, rad, sc):
+
+        n = live_count(obj, "nseg")
+        if self.offscreen:
+            self.raster_lines(obj, n, int(rad), ti.Vector(hex_to_rgb(sc)))
+        else:
+            link0 = self.host_buffer("l0_host", n)
+            link1 = self.host_buffer("l1_host", n)
+            self.gather_segments(obj, n, link0, link1)
+            self.gui.lines(link0, link1, radius=rad, color=sc)
+
+    def show(self, path=None): # GUI : next frame. offscreen : write the frame to path if given
+        if self.offscreen:
+            if path is not None:
+                ti.tools.imwrite(self.frame, path)
+        else:
+            self.gui.show(path)
@@ -1,3 +1,7 @@
+import taichi as ti
+
+from concepts.bonded import Bonded_forces
+
 @ti.data_oriented
 class Psystem_2D:
 
@@ -9,10 +13,17 @@ class Psystem_2D:
 		self.pos = ti.Vector.field(2, dtype=ti.f32, shape=(self.nparticles))
 		self.forces = ti.Vector.field(2, dtype=ti.f32, shape=(self.nparticles))
 
+		self.bonds = None
+
+	def add_bonds(self, max_bonds, max_angles=1, mode="csr"): # Bonded_forces on these particles, topology to be set on it
+		self.bonds = Bonded_forces(self.nparticles, max_bonds, max_angles, mode)
+		return self.bonds
+
+	def bonded_forces(self):
+		if self.bonds is not None:
+			self.bonds.compute(self.pos, self.forces)
+
 	@ti.kernel
 	def reinit_forces(self):
 		for k in range(self.nparticles):
 			self.forces[k] = [0.0 for _ in range(2)]
-
-# - We can define the basics of a particle system.
-# - This is an independan model regarding its dynamics and forcesystem, other objects can be added after
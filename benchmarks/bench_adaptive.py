@@ -0,0 +1,100 @@
+# - Adaptive dt against a fixed dt, velocity Verlet with the uncapped LJ of md_base_1
+#
+#   python benchmarks/bench_adaptive.py [--arch cpu] [--n 2000] [--densities 0.005 0.02 0.05]
+#
+# For each density : the adaptive run over --time, the dts it chose, its energy drift, and
+# fixed dt runs at the mean and at the smallest adaptive dt, at the md_base_1 default dt
+# and at twice it, over the same time.
+# drift : max |E(t) - E(0)| / n, inf once the run blew up.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+
+def initial_state(n, side, rmin, kT, seed=0): # Random gas, no pair closer than rmin
+
+    rng = np.random.default_rng(seed)
+    pos = np.zeros((0, 2))
+    for _ in range(100 * n):
+        if len(pos) == n:
+            break
+        p = rng.random(2) * side
+        d = np.abs(pos - p)
+        d = np.minimum(d, side - d)
+        if len(pos) == 0 or (d * d).sum(1).min() > rmin * rmin:
+            pos = np.vstack([pos, p])
+    if len(pos) < n:
+        raise ValueError("Too dense for the minimum distance : " + str(n / side**2))
+    return pos.astype(np.float32), rng.normal(0, np.sqrt(kT), (n, 2)).astype(np.float32)
+
+def run(state, side, args, **kwargs):
+
+    sim = md.Mdsystem_2D(nparticles=args.n, ntriangles=1, boundary=(side, side), periodic=True, k_center=0.0,
+                         integrator="verlet", lj_cap=float("inf"), dt_history=1 << 16, **kwargs)
+    sim.step()      # compilation
+    sim.p_pos.from_numpy(state[0])
+    sim.p_vel.from_numpy(state[1])
+    sim.forces_valid = False
+    if sim.adaptive:
+        sim.dt_count[None] = 0
+
+    e0 = sim.energy()
+    drift = 0.0
+    t = 0.0
+    nsteps = 0
+    wall = 0.0
+    while t < args.time and np.isfinite(drift):
+
+        ti.sync()
+        t0 = time.perf_counter()
+        for _ in range(50):
+            sim.step()
+        ti.sync()
+        wall += time.perf_counter() - t0
+        nsteps += 50
+
+        t = sim.dt_history()[:, 0].sum() if sim.adaptive else nsteps * kwargs["dt"]
+        e = sim.energy()
+        drift = max(drift, abs(e - e0) / args.n) if np.isfinite(e) else np.inf
+
+    dts = sim.dt_history()[:, 0] if sim.adaptive else None
+    return drift, nsteps, wall, dts
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--n", type=int, default=2000)
+    parser.add_argument("--densities", nargs="*", type=float, default=[0.005, 0.02, 0.05])
+    parser.add_argument("--time", type=float, default=5.0, help="simulated time of each run")
+    parser.add_argument("--max-disp", type=float, default=0.05)
+    parser.add_argument("--kT", type=float, default=4.0, help="temperature of the initial velocities")
+    args = parser.parse_args()
+
+    ti.init(arch=getattr(ti, args.arch))
+
+    print("%d particles, verlet, uncapped lj, max_disp %g, %g time units" % (args.n, args.max_disp, args.time))
+    print("%8s  %-14s  %10s  %10s  %8s  %10s  %8s" % ("density", "run", "dt mean", "dt min", "steps", "drift", "wall s"))
+    for density in args.densities:
+
+        side = float(np.sqrt(args.n / density))
+        state = initial_state(args.n, side, -md.rad + md.sigma, args.kT)
+
+        drift, nsteps, wall, dts = run(state, side, args, adaptive=True, max_disp=args.max_disp)
+        print("%8g  %-14s  %10.3g  %10.3g  %8d  %10.3g  %8.2f" % (density, "adaptive", dts.mean(), dts.min(), nsteps, drift, wall))
+
+        for name, dt in (("fixed mean", float(dts.mean())), ("fixed min", float(dts.min())), ("fixed default", md.dt), ("fixed 2x", 2 * md.dt)):
+            drift, nsteps, wall, _ = run(state, side, args, dt=dt)
+            print("%8g  %-14s  %10.3g  %10.3g  %8d  %10.3g  %8.2f" % (density, name, dt, dt, nsteps, drift, wall))
+
+if __name__ == "__main__":
+
+    main()
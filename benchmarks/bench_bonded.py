@@ -0,0 +1,68 @@
+# - Bonded_forces on chains (stretch + bend) against the LJ pair forces of as many particles
+#
+#   python benchmarks/bench_bonded.py [--arch cpu] [--sizes 10000 100000 1000000] [--chain 100]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+from concepts.bonded import Bonded_forces
+
+REPEAT = 10
+
+def timed(f, *args):
+
+    f(*args)    # compilation
+    ti.sync()
+    t0 = time.perf_counter()
+    for _ in range(REPEAT):
+        f(*args)
+    ti.sync()
+    return (time.perf_counter() - t0) / REPEAT
+
+def bench(n, chain, arch):
+
+    side = float(np.sqrt(n * md.boundary[0] * md.boundary[1] / md.nparticles))
+    sim = md.Mdsystem_2D(nparticles=n, boundary=(side, side), arch=arch)
+    sim.init_rdparticles()
+    sim.p_reg.update(sim.p_pos)
+    line = "%9d  %10.1f" % (n, 1e9 * timed(sim.pair_forces, sim.p_pos, sim.p_force, sim.p_reg, sim.pair_mode) / n)
+
+    nchains = n // chain
+    start = ti.field(ti.i32, shape=nchains)
+    stop = ti.field(ti.i32, shape=nchains)
+    start.from_numpy((np.arange(nchains) * chain).astype(np.int32))
+    stop.from_numpy((np.arange(nchains) * chain + chain - 1).astype(np.int32))
+
+    for mode in ("atomic", "csr"):
+        bonds = Bonded_forces(n, n, n, mode=mode)
+        bonds.from_ranges(start, stop, nchains, 10.0, 1.0, 1.0)
+        line += "  %10.1f" % (1e9 * timed(bonds.compute, sim.p_pos, sim.p_force) / n)
+        if mode == "csr":
+            line += "  %10.1f" % (1e9 * timed(bonds.build) / n)
+
+    print(line)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10000, 100000, 1000000])
+    parser.add_argument("--chain", type=int, default=100, help="particles per chain")
+    args = parser.parse_args()
+
+    print("ns per particle, chains of %d" % args.chain)
+    print("%9s  %10s  %10s  %10s  %10s" % ("N", "lj_force", "atomic", "csr", "csr build"))
+    for n in args.sizes:
+        bench(n, args.chain, getattr(ti, args.arch))
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,58 @@
+# - Checkpoint save / restore of a whole Mdsystem_2D, every field of the system and its registers
+#
+#   python benchmarks/bench_checkpoint.py [--arch cpu] [--sizes 10000 100000 1000000] [--path /tmp/md.ckpt]
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+
+REPEAT = 5
+
+def timed(f, *args):
+
+    f(*args)    # compilation of the copy kernels
+    ti.sync()
+    t0 = time.perf_counter()
+    for _ in range(REPEAT):
+        f(*args)
+    ti.sync()
+    return (time.perf_counter() - t0) / REPEAT
+
+def bench(n, arch, path):
+
+    side = float(np.sqrt(n * md.boundary[0] * md.boundary[1] / md.nparticles))
+    sim = md.Mdsystem_2D(nparticles=n, boundary=(side, side), arch=arch)
+    sim.init_rdparticles()
+    sim.step()
+
+    t_save = timed(sim.checkpoint, path)
+    t_load = timed(sim.restore, path)
+    size = os.path.getsize(path) / 1e6
+    os.remove(path)
+
+    print("%9d  %9.1f  %9.1f  %9.1f  %9.0f" % (n, size, 1e3 * t_save, 1e3 * t_load, size / t_save))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10000, 100000, 1000000])
+    parser.add_argument("--path", default="md.ckpt", help="checkpoint file, removed afterwards")
+    args = parser.parse_args()
+
+    print("%9s  %9s  %9s  %9s  %9s" % ("N", "MB", "save ms", "load ms", "save MB/s"))
+    for n in args.sizes:
+        bench(n, getattr(ti, args.arch), args.path)
+
+if __name__ == "__main__":
+
+    main()
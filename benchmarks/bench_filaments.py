@@ -0,0 +1,131 @@
+# - Cost of Cortex2D_test.grow for the compact and slab storages as the polymer mass grows
+#
+#   python benchmarks/bench_filaments.py [--arch cpu] [--nfil 10000] [--lengths 10 40 160]
+#
+# Same number of filaments and of events per step for every length : a storage whose
+# cost follows the events stays flat, one that follows the mass grows with the length.
+#
+# First checks that a growth step can be followed by reinit_forces and mechanics on Cortex2D
+# and on both storages of Cortex2D_test : without events the initial filaments are kept and
+# a stretched one gets its exact bond forces, then with events the forces are cleared, finite
+# and sum to zero.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(root))
+sys.path.insert(0, str(root / "Fragments"))
+
+import numpy as np
+import taichi as ti
+
+from cortex2D import Cortex2D
+from filamentgrow import Cortex2D_test
+
+def check_initial(c, stretch=2.0):
+
+    # Zero rates : grow keeps the initial filaments. Filament 0 is then laid straight along x
+    # with segments of stretch * l0, its bonds pull its ends inward by k_stretch * (stretch - 1) * l0
+    # and nothing else acts on it
+
+    c.prate = c.unprate = c.create = 0.0
+    counts = (c.nfil[None], c.nparticles[None])
+    c.grow(0)
+    if (c.nfil[None], c.nparticles[None]) != counts:
+        raise ValueError("Initial filaments lost by grow : " + str(counts) + " -> " + str((c.nfil[None], c.nparticles[None])))
+
+    first = c.len_start[0]
+    n = c.len_stop[0] - first + c.stop_offset
+    if n != c.lfil:
+        raise ValueError("Filament 0 has " + str(n) + " particles instead of " + str(c.lfil))
+
+    pos = c.pos.to_numpy()
+    pos[first:first + n] = np.stack([stretch * c.l0 * np.arange(n), np.zeros(n)], axis=1)
+    c.pos.from_numpy(pos)
+    c.reinit_forces()
+    c.mechanics()
+
+    expected = np.zeros((n, 2), dtype=np.float32)
+    expected[0, 0] = c.k_stretch * (stretch - 1.0) * c.l0
+    expected[-1, 0] = -expected[0, 0]
+    got = c.forces.to_numpy()[first:first + n]
+    if not np.allclose(got, expected, atol=1e-4):
+        raise ValueError("Bonded forces of filament 0 : " + str(got.tolist()) + " instead of " + str(expected.tolist()))
+
+def check_mechanics(c, nsteps=10):
+
+    check_initial(c)
+
+    c.prate = 0.3
+    c.unprate = 0.1
+    c.create = 0.5
+    for t in range(nsteps):
+
+        c.grow(t)
+        c.reinit_forces()
+        c.mechanics()
+        once = c.forces.to_numpy()
+        c.mechanics()       # adds up without a reinit_forces
+        twice = c.forces.to_numpy()
+        c.reinit_forces()
+        c.mechanics()
+
+        if not (np.isfinite(once).all() and np.allclose(twice, 2 * once, atol=1e-4) and np.array_equal(c.forces.to_numpy(), once)):
+            raise ValueError("Forces not cleared by reinit_forces at step " + str(t))
+        if abs(once.sum(axis=0)).max() > 1e-3 * max(1.0, abs(once).max()):
+            raise ValueError("Bonded forces do not sum to zero at step " + str(t) + " : " + str(once.sum(axis=0)))
+
+    return c.nfil[None]
+
+def time_grow(storage, nfil, lfil, nsteps):
+
+    cap = 2 * lfil
+    c = Cortex2D_test(nfil, lfil, nfil * cap, 1.0, 1.0, storage=storage, slab_cap=cap)
+    c.prate = 0.05
+    c.unprate = 0.05
+    c.rdplace(100.0, 0.0, 0.0)
+    c.grow(0)                   # compilation
+
+    ti.sync()
+    t0 = time.perf_counter()
+    for t in range(nsteps):
+        c.grow(t)
+    ti.sync()
+    return (time.perf_counter() - t0) / nsteps, c.nparticles[None]
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--nfil", type=int, default=10000)
+    parser.add_argument("--lengths", nargs="*", type=int, default=[10, 40, 160])
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    ti.init(arch=getattr(ti, args.arch))
+    checks = []
+    c = Cortex2D(8, 6, 400, 1.0, 1.0)
+    c.set_domain(20.0, 0.0, 0.0)
+    checks.append(("Cortex2D", check_mechanics(c)))
+    for storage in ("compact", "slab"):
+        c = Cortex2D_test(8, 6, 400, 1.0, 1.0, storage=storage, slab_cap=24)
+        c.rdplace(20.0, 0.0, 0.0)
+        checks.append(("Cortex2D_test " + storage, check_mechanics(c)))
+    print("grow, reinit_forces, mechanics : " + ", ".join("%s ok (%d filaments)" % check for check in checks))
+
+    print("%d filaments, %d steps" % (args.nfil, args.steps))
+    print("%6s  %10s  %12s  %12s" % ("lfil", "particles", "compact ms", "slab ms"))
+    for lfil in args.lengths:
+
+        ti.init(arch=getattr(ti, args.arch))
+        compact, npart = time_grow("compact", args.nfil, lfil, args.steps)
+        ti.init(arch=getattr(ti, args.arch))
+        slab, _ = time_grow("slab", args.nfil, lfil, args.steps)
+        print("%6d  %10d  %12.2f  %12.2f" % (lfil, npart, 1e3 * compact, 1e3 * slab))
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,102 @@
+# - Fluid solvers without a window : N steps of the cylinder channel with a synthetic inflow jet
+#
+#   python benchmarks/bench_fluid.py [--arch cpu] [--res 200 400] [--Re 1000] [--solver cip|mac]
+#                                    [--pressure sor|jacobi|multigrid|pcg] [--n-iter 2] [--tol 1e-4]
+#                                    [--preconditioner mic0|jacobi] [--check-every 4] [--adapt]
+#                                    [--steps 200]
+#
+# ms per step, split into advection, pressure solve and boundary conditions, the mean pressure
+# iterations per step and, with a tolerance, the last relative residual. With --tol, sor and
+# jacobi stop early, --n-iter being their maximum.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+from fluid.simulator import FluidSimulator, InflowDataGen
+
+WARMUP = 5  # steps compiling the kernels, not timed
+
+def bench(res, args):
+
+    sim = FluidSimulator.create(1, res, args.dt, 1.0 / res, args.Re, args.vor_eps, 10.0, 10.0,
+                                solver=args.solver, pressure=args.pressure, n_iter=args.n_iter,
+                                tol=args.tol, max_iter=args.max_iter,
+                                preconditioner=args.preconditioner, check_every=args.check_every,
+                                adapt=args.adapt)
+    solver = sim._solver
+    updater = solver.pressure_updater
+    iterations = 0
+    inflow = InflowDataGen(res)
+
+    for step in range(WARMUP):
+        sim.step(inflow(step))
+    ti.sync()
+
+    solver.reset_timings()
+    solver.profile = args.split
+    t0 = time.perf_counter()
+    for step in range(WARMUP, WARMUP + args.steps):
+        sim.step(inflow(step))
+        iterations += updater.iterations
+    ti.sync()
+    total = (time.perf_counter() - t0) / args.steps
+
+    fields = sim.field_to_numpy()
+    v, p = fields["v"], fields["p"]
+    finite = np.isfinite(v).all() and np.isfinite(p).all()
+
+    line = "%6d  %9.3f" % (res, 1e3 * total)
+    if args.split:
+        line += "".join("  %9.3f" % (1e3 * solver.timings[name] / args.steps) for name in ("advection", "pressure", "bc"))
+    line += "  %9.3f" % np.abs(v).max()
+    line += "  %9.1f" % (iterations / args.steps)
+    line += "  %9.1e" % updater.residual if updater.residual is not None else "  %9s" % "-"
+    if args.adapt:
+        line += "  %9.3f" % updater.relaxation_factor
+    print(line + ("" if finite else "  diverged"))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--res", nargs="*", type=int, default=[200, 400])
+    parser.add_argument("--Re", type=float, default=1000.0)
+    parser.add_argument("--dt", type=float, default=0.0005)
+    parser.add_argument("--solver", default="cip", help="cip or mac")
+    parser.add_argument("--pressure", default="sor", help="sor, jacobi, multigrid or pcg")
+    parser.add_argument("--n-iter", type=int, default=2, help="sor and jacobi iterations per step")
+    parser.add_argument("--tol", type=float, default=None,
+                        help="relative residual of the pressure solve, default 1e-4 for multigrid and pcg, none for sor and jacobi")
+    parser.add_argument("--max-iter", type=int, default=None, help="multigrid and pcg iterations per step at most")
+    parser.add_argument("--preconditioner", default="mic0", help="mic0 or jacobi, for pcg")
+    parser.add_argument("--check-every", type=int, default=4, help="sor and jacobi iterations between residual checks")
+    parser.add_argument("--adapt", action="store_true", help="tune the sor relaxation factor, with --tol")
+    parser.add_argument("--vor-eps", type=float, default=50.0, help="vorticity confinement weight")
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--no-split", dest="split", action="store_false",
+                        help="total time only, no synchronisation between the stages")
+    args = parser.parse_args()
+
+    ti.init(arch=getattr(ti, args.arch))
+
+    print("%s solver, %s pressure x %d, Re %g, %d steps, ms per step" % (args.solver, args.pressure, args.n_iter, args.Re, args.steps))
+    header = "%6s  %9s" % ("res", "total")
+    if args.split:
+        header += "  %9s  %9s  %9s" % ("advection", "pressure", "bc")
+    header += "  %9s  %9s  %9s" % ("max |v|", "iters", "residual")
+    if args.adapt:
+        header += "  %9s" % "omega"
+    print(header)
+    for res in args.res:
+        bench(res, args)
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,97 @@
+# - Largest dt under an energy drift bound, and wall time per simulated time unit, for
+# - velocity Verlet and RESPA on particles with soft-core pairs and stiff spring triangles
+#
+#   python benchmarks/bench_integrators.py [--arch cpu] [--n 4000] [--ntri 500] [--tol 1e-3]
+#
+# Every run starts from the same lattice and velocities, periodic box, no center force.
+# drift : max |E(t) - E(0)| / n over the run. RESPA sub-steps the springs, the pair forces
+# are evaluated once per outer step.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+
+def initial_state(n, ntri, side, kT, seed=0):
+
+    rng = np.random.default_rng(seed)
+    m = int(np.ceil(np.sqrt(n)))
+    g = (np.stack(np.meshgrid(np.arange(m), np.arange(m)), -1).reshape(-1, 2)[:n] + 0.5) * side / m
+    p_pos = (g + rng.normal(0, 0.05, g.shape)) % side
+    p_vel = rng.normal(0, np.sqrt(kT), (n, 2))
+
+    corners = np.array([[0.0, 0.0], [2.0, 0.0], [1.0, np.sqrt(3.0)]])
+    t_pos = (rng.random((ntri, 1, 2)) * side + corners[None]).reshape(-1, 2) % side
+    t_vel = rng.normal(0, np.sqrt(kT), (3 * ntri, 2))
+
+    return [a.astype(np.float32) for a in (p_pos, p_vel, t_pos, t_vel)]
+
+def run(state, args, integrator, dt, respa_steps):
+
+    n = args.n
+    side = float(np.sqrt(n * md.boundary[0] * md.boundary[1] / md.nparticles))
+    sim = md.Mdsystem_2D(nparticles=n, ntriangles=args.ntri, boundary=(side, side), potential="softcore", periodic=True,
+                         k_center=0.0, k_spring=args.k_spring, l0_spring=2.0, integrator=integrator, dt=dt, respa_steps=respa_steps)
+    sim.step()      # compilation
+    for f, a in zip((sim.p_pos, sim.p_vel, sim.t_pos, sim.t_vel), state):
+        f.from_numpy(a)
+    sim.forces_valid = False
+
+    nsteps = max(1, int(round(args.time / dt)))
+    every = max(1, nsteps // 20)
+    e0 = sim.energy()
+    drift = 0.0
+    wall = 0.0
+    for s in range(0, nsteps, every):
+        ti.sync()
+        t0 = time.perf_counter()
+        for _ in range(min(every, nsteps - s)):
+            sim.step()
+        ti.sync()
+        wall += time.perf_counter() - t0
+        e = sim.energy()
+        drift = max(drift, abs(e - e0) / n) if np.isfinite(e) else np.inf
+
+    return drift, wall / args.time
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--n", type=int, default=4000)
+    parser.add_argument("--ntri", type=int, default=500)
+    parser.add_argument("--k-spring", type=float, default=2000.0)
+    parser.add_argument("--time", type=float, default=1.0, help="simulated time of each run")
+    parser.add_argument("--tol", type=float, default=1e-3, help="energy drift bound per particle")
+    parser.add_argument("--dts", nargs="*", type=float, default=[0.0025, 0.005, 0.01, 0.02, 0.04])
+    args = parser.parse_args()
+
+    ti.init(arch=getattr(ti, args.arch))
+    state = initial_state(args.n, args.ntri, float(np.sqrt(args.n * md.boundary[0] * md.boundary[1] / md.nparticles)), 0.5)
+
+    print("%d particles, %d triangles, k_spring %g, drift bound %g per particle" % (args.n, args.ntri, args.k_spring, args.tol))
+    print("%-10s  %8s  %12s  %14s" % ("integrator", "dt", "drift", "wall s / time"))
+    for name, integrator, respa_steps in (("verlet", "verlet", 1), ("respa 4", "respa", 4), ("respa 8", "respa", 8)):
+
+        best = None
+        for dt in sorted(args.dts):
+            drift, cost = run(state, args, integrator, dt, respa_steps)
+            print("%-10s  %8g  %12.3g  %14.3f" % (name, dt, drift, cost))
+            if drift <= args.tol:
+                best = (dt, cost)
+
+        if best is not None:
+            print("%-10s  largest dt %g at %.3f s per time unit" % (name, best[0], best[1]))
+        else:
+            print("%-10s  no dt under the bound" % name)
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,68 @@
+# - Headless benchmark of Mdsystem_2D.step() over a range of system sizes
+#
+#   python benchmarks/bench_md.py [--arch cpu] [--sizes 1000 10000 ...] [--steps 50]
+#
+# The box grows with N so that the density stays the one of the default system,
+# every size then has the same work per particle and timings should scale linearly.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+
+SIZES = [1000, 4000, 16000, 64000, 256000, 1000000]
+DENSITY = md.nparticles / (md.boundary[0] * md.boundary[1])
+
+def bench(n, arch, nsteps, warmup, options):
+
+    side = float(np.sqrt(n / DENSITY))
+    sim = md.Mdsystem_2D(nparticles=n, boundary=(side, side), arch=arch, **options)
+
+    sim.init_rdparticles()
+    for _ in range(warmup):     # compilation
+        sim.step()
+
+    sim.profile = True
+    sim.reset_timings()
+    ti.sync()
+    t0 = time.perf_counter()
+    for _ in range(nsteps):
+        sim.step()
+    ti.sync()
+    wall = time.perf_counter() - t0
+
+    stages = "".join("  %9.1f" % (1e9 * t / (nsteps * n)) for t in sim.timings.values())
+    print("%9d  %10.1f  %11.1f%s" % (n, nsteps / wall, 1e9 * wall / (nsteps * n), stages))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--sizes", nargs="*", type=int, default=SIZES)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--pair-mode", default=md.pair_mode)
+    parser.add_argument("--nlist", action="store_true", help="use the Verlet list")
+    parser.add_argument("--reorder", default=None, help="cell or morton")
+    parser.add_argument("--periodic", action="store_true")
+    parser.add_argument("--unfused", action="store_true", help="one kernel per per-particle stage")
+    args = parser.parse_args()
+
+    options = dict(pair_mode=args.pair_mode, use_nlist=args.nlist, reorder=args.reorder, periodic=args.periodic,
+                   fused=not args.unfused)
+
+    print("arch %s, %d steps, density %.3f, %s" % (args.arch, args.steps, DENSITY, options))
+    print("%9s  %10s  %11s" % ("N", "steps/s", "ns/part/step") + "".join("  %9s" % s for s in ("cell_list", "lj_force", "integrate")))
+    for n in args.sizes:
+        bench(n, getattr(ti, args.arch), args.steps, args.warmup, options)
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,64 @@
+# - Full stencil against half stencil traversals of the pair forces (concepts.pairs)
+#
+#   python benchmarks/bench_pair_traversal.py [--arch cpu] [n1 n2 ...]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+
+MODES = ("full", "half", "atomic")
+REPEAT = 10
+
+def bench(n, arch):
+
+    sim = md.Mdsystem_2D(nparticles=n, arch=arch)
+    pos, forces, reg = sim.p_pos, sim.p_force, sim.p_reg
+
+    sim.init_rdparticles()
+    reg.update(pos)
+
+    times = {}
+    results = {}
+
+    for mode in MODES:
+
+        forces.fill(0.0)
+        sim.pair_forces(pos, forces, reg, mode)  # compilation
+        results[mode] = forces.to_numpy()
+
+        ti.sync()
+        t0 = time.perf_counter()
+        for _ in range(REPEAT):
+            sim.pair_forces(pos, forces, reg, mode)
+        ti.sync()
+        times[mode] = (time.perf_counter() - t0) / REPEAT
+
+    scale = np.abs(results["full"]).max()
+    line = "%8d" % n
+    for mode in MODES:
+        err = np.abs(results[mode] - results["full"]).max() / scale
+        line += "  %10.3f ms  x%4.2f  err %.1e" % (1e3 * times[mode], times["full"] / times[mode], err)
+    print(line)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, default=[1000, 2000, 4000, 8000])
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    args = parser.parse_args()
+
+    print("%8s" % "N" + "".join("  %-29s" % mode for mode in MODES))
+    for n in args.sizes:
+        bench(n, getattr(ti, args.arch))
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,93 @@
+# - Tabulated against analytic pair potentials : accuracy of the lookup and lj_force throughput
+#
+#   python benchmarks/bench_potentials.py [--arch cpu] [--n 16000] [--size 2048]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+from concepts.potentials import Pair_table, make_potential
+
+POTENTIALS = {
+    "lj": dict(sigma=md.sigma, e0=md.e0, rad=md.rad),
+    "softcore": dict(),
+    "morse": dict(),
+}
+TABLES = (None, "linear", "cubic")
+NSAMPLES = 100003   # not a multiple of the table spacing
+REPEAT = 10
+
+@ti.kernel
+def sample(pot: ti.template(), r: ti.template(), out: ti.template()):
+    for i in r:
+        out[i] = pot.force(r[i])
+
+def accuracy(name, params, size):
+
+    r = ti.field(float, shape=NSAMPLES)
+    exact = ti.field(float, shape=NSAMPLES)
+    approx = ti.field(float, shape=NSAMPLES)
+    r.from_numpy(np.linspace(0.0, md.rlim_lj, NSAMPLES, endpoint=False).astype(np.float32))
+
+    pot = make_potential(name, **params)
+    sample(pot, r, exact)
+    ref = exact.to_numpy()
+    scale = np.abs(ref).max()
+
+    line = "%-9s" % name
+    for interp in TABLES[1:]:
+        sample(Pair_table(pot, 0.0, md.rlim_lj, size, interp), r, approx)
+        err = np.abs(approx.to_numpy() - ref)
+        line += "  %-7s max %.1e  rms %.1e" % (interp, err.max() / scale, np.sqrt((err**2).mean()) / scale)
+    print(line)
+
+def throughput(name, params, n, size, arch):
+
+    side = float(np.sqrt(n * md.boundary[0] * md.boundary[1] / md.nparticles))
+    line = "%-9s" % name
+
+    for interp in TABLES:
+
+        sim = md.Mdsystem_2D(nparticles=n, boundary=(side, side), arch=arch,
+                             potential=make_potential(name, **params), table=interp, table_size=size)
+        sim.init_rdparticles()
+        sim.p_reg.update(sim.p_pos)
+        sim.pair_forces(sim.p_pos, sim.p_force, sim.p_reg, sim.pair_mode)    # compilation
+
+        ti.sync()
+        t0 = time.perf_counter()
+        for _ in range(REPEAT):
+            sim.pair_forces(sim.p_pos, sim.p_force, sim.p_reg, sim.pair_mode)
+        ti.sync()
+        line += "  %-8s %8.2f ms" % (interp or "analytic", 1e3 * (time.perf_counter() - t0) / REPEAT)
+
+    print(line)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--n", type=int, default=16000)
+    parser.add_argument("--size", type=int, default=2048, help="table intervals on [0, rlim_lj]")
+    args = parser.parse_args()
+
+    arch = getattr(ti, args.arch)
+
+    print("lj_force (%s) at N = %d, table of %d intervals" % (md.pair_mode, args.n, args.size))
+    for name, params in POTENTIALS.items():
+        throughput(name, params, args.n, args.size, arch)
+
+    print("table error relative to max |force| on [0, %g)" % md.rlim_lj)
+    for name, params in POTENTIALS.items():
+        accuracy(name, params, args.size)
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,61 @@
+# - Many small systems : one Mdsystem_2D per replica against a single batched Mdsystem_2D
+#
+#   python benchmarks/bench_replicas.py [--arch cpu] [--n 256] [--replicas 1 4 16 64 256]
+#
+# The loop over separate systems is timed on one of them and scaled by R, building R
+# objects would only add compilation time. Both columns advance the same R * n particles.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+
+DENSITY = md.nparticles / (md.boundary[0] * md.boundary[1])
+
+def time_steps(sim, nsteps, warmup):
+
+    sim.init_rdparticles()
+    for _ in range(warmup):     # compilation
+        sim.step()
+
+    ti.sync()
+    t0 = time.perf_counter()
+    for _ in range(nsteps):
+        sim.step()
+    ti.sync()
+    return (time.perf_counter() - t0) / nsteps
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--n", type=int, default=256, help="particles per replica")
+    parser.add_argument("--replicas", nargs="*", type=int, default=[1, 4, 16, 64, 256])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    args = parser.parse_args()
+
+    arch = getattr(ti, args.arch)
+    side = float(np.sqrt(args.n / DENSITY))
+
+    single = time_steps(md.Mdsystem_2D(nparticles=args.n, boundary=(side, side), arch=arch), args.steps, args.warmup)
+
+    print("arch %s, %d particles per replica, box %.1f" % (args.arch, args.n, side))
+    print("%9s  %16s  %16s  %8s" % ("replicas", "separate steps/s", "batched steps/s", "speedup"))
+    for R in args.replicas:
+
+        T = np.linspace(0.5, 2.0, R)    # one temperature per replica
+        batched = time_steps(md.Mdsystem_2D(nparticles=args.n, boundary=(side, side), arch=arch, nreplicas=R, T=T),
+                             args.steps, args.warmup)
+        print("%9d  %16.1f  %16.1f  %7.1fx" % (R, 1.0 / (R * single), 1.0 / batched, R * single / batched))
+
+if __name__ == "__main__":
+
+    main()
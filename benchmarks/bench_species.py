@@ -0,0 +1,92 @@
+# - Two species : one Cell_reg per species and one pair kernel per species, against a
+# - Particle_set holding both with a single Cell_reg and a single species-aware pair kernel
+#
+#   python benchmarks/bench_species.py [--arch cpu] [--sizes 10000 100000 1000000]
+#
+# The per species column only has the A-A and B-B pairs, the shared ones also have the A-B
+# pairs, twice the pairs in all, that separate registers cannot see without a third,
+# cross-species pass. "shared lj" uses one potential for every pair, the difference with
+# "shared" is the cost of picking the potential of each pair.
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import taichi as ti
+
+import md_base_1 as md
+from concepts.pairs import Pair_forces
+from concepts.potentials import Lj_potential, Softcore_potential, Species_potential
+from datastructs.cell_reg import Cell_reg
+from datastructs.particles import Particle_set
+
+REPEAT = 10
+
+def timed(f):
+
+    f()     # compilation
+    ti.sync()
+    t0 = time.perf_counter()
+    for _ in range(REPEAT):
+        f()
+    ti.sync()
+    return (time.perf_counter() - t0) / REPEAT
+
+def bench(n, arch):
+
+    ti.init(arch=arch)
+
+    side = float(np.sqrt(n * md.boundary[0] * md.boundary[1] / md.nparticles))
+    box = (side, side)
+    pairs = Pair_forces(md.rlim_lj)
+    lj = Lj_potential(md.sigma, md.e0, md.rad)
+
+    rng = np.random.default_rng(0)
+    pos = (rng.random((n, 2)) * side).astype(np.float32)
+    species = (np.arange(n) % 2).astype(np.int32)
+
+    # Per species : fixed fields, a register each
+
+    fields = []
+    for s in range(2):
+        p = ti.Vector.field(2, ti.f32, shape=n // 2)
+        p.from_numpy(pos[species == s])
+        fields.append((p, ti.Vector.field(2, ti.f32, shape=n // 2), Cell_reg(p, md.rlim_lj, box)))
+
+    def separate():
+        for p, f, reg in fields:
+            reg.update(p)
+            pairs.compute(p, f, reg, "half", lj)
+
+    # Shared : one Particle_set, one register
+
+    ps = Particle_set(capacity=n)
+    ps.add(pos, species=species)
+    ps.register(md.rlim_lj, box)
+    pot = Species_potential(2, {(0, 0): lj, (1, 1): lj, (0, 1): Softcore_potential()})
+
+    def shared(pot=pot):
+        ps.update_reg()
+        ps.pair_forces(pot)
+
+    print("%9d  %12.1f  %12.1f  %12.1f" % (n, 1e9 * timed(separate) / n, 1e9 * timed(lambda: shared(lj)) / n, 1e9 * timed(shared) / n))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", default="cpu", help="taichi arch : cpu, gpu, cuda, vulkan...")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print("ns per particle, cell list + pair forces, two species of N / 2")
+    print("%9s  %12s  %12s  %12s" % ("N", "per species", "shared lj", "shared"))
+    for n in args.sizes:
+        bench(n, getattr(ti, args.arch))
+
+if __name__ == "__main__":
+
+    main()
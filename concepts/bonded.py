@@ -0,0 +1,399 @@
+import numpy as np
+import taichi as ti
+
+from concepts.periodic_bound import min_image
+from concepts.scan import exclusive_scan
+
+# - Bonded interactions : harmonic stretching of bonds (i, j) and bending of angles (i, j, k)
+#   centered on j, every bond and angle with its own parameters. Works on any container
+#   with a pos and a forces field, topologies come from link lists, from contiguous ranges
+#   (filaments) or from numpy arrays.
+#
+#   mode "atomic" : one thread per bond / angle, forces added with atomics
+#   mode "csr"    : one thread per particle over its sorted incidences, each particle only
+#                   writes its own force : no atomics and the result is reproducible
+
+@ti.data_oriented
+class Bonded_forces:
+
+    def __init__(self, nparticles, max_bonds, max_angles, mode="csr", box=None):
+
+        if mode not in ("csr", "atomic"):
+            raise ValueError("Unknown bonded mode : " + str(mode))
+
+        self.nparticles = nparticles        # capacity, particles beyond the topology are left alone
+        self.max_bonds = max_bonds
+        self.max_angles = max_angles
+        self.mode = mode
+        self.periodic = box is not None
+        self.box = tuple(box) if self.periodic else (0.0, 0.0)   # periodic box for minimum-image separations
+
+        self.nbonds = ti.field( shape=(), dtype=ti.i32)
+        self.bond_i = ti.field( shape=max_bonds, dtype=ti.i32)
+        self.bond_j = ti.field( shape=max_bonds, dtype=ti.i32)
+        self.bond_k = ti.field( shape=max_bonds, dtype=float)       # stiffness
+        self.bond_l0 = ti.field( shape=max_bonds, dtype=float)      # rest length
+
+        self.nangles = ti.field( shape=(), dtype=ti.i32)
+        self.angle_i = ti.field( shape=max_angles, dtype=ti.i32)
+        self.angle_j = ti.field( shape=max_angles, dtype=ti.i32)    # vertex
+        self.angle_m = ti.field( shape=max_angles, dtype=ti.i32)
+        self.angle_k = ti.field( shape=max_angles, dtype=float)     # stiffness
+        self.angle_t0 = ti.field( shape=max_angles, dtype=float)    # rest angle from (i - j) to (m - j), pi is straight
+
+        # -- Incidences of each particle in CSR form, (bond * 2 + side) and (angle * 3 + role)
+
+        self.scan_block = 64
+        self.block_sum = ti.field( shape=(nparticles + self.scan_block - 1) // self.scan_block, dtype=ti.i32)
+
+        self.bcount = ti.field( shape=nparticles, dtype=ti.i32)
+        self.bstart = ti.field( shape=nparticles, dtype=ti.i32)
+        self.bend = ti.field( shape=nparticles, dtype=ti.i32)
+        self.binc = ti.field( shape=2 * max_bonds, dtype=ti.i32)
+
+        self.acount = ti.field( shape=nparticles, dtype=ti.i32)
+        self.astart = ti.field( shape=nparticles, dtype=ti.i32)
+        self.aend = ti.field( shape=nparticles, dtype=ti.i32)
+        self.ainc = ti.field( shape=3 * max_angles, dtype=ti.i32)
+
+        self.nranges = ti.field( shape=(), dtype=ti.i32)            # ranges of from_ranges, on device
+
+        self.dirty = True       # topology changed since the last CSR build
+
+    # - Topologies
+
+    def set_bonds(self, i, j, k, l0): # From arrays, k and l0 may be scalars
+
+        n = len(i)
+        if n > self.max_bonds:
+            raise ValueError("Too many bonds : " + str(n) + " > " + str(self.max_bonds))
+
+        for f, v, t in ((self.bond_i, i, np.int32), (self.bond_j, j, np.int32), (self.bond_k, k, np.float32), (self.bond_l0, l0, np.float32)):
+            a = np.zeros(self.max_bonds, dtype=t)
+            a[:n] = v
+            f.from_numpy(a)
+        self.nbonds[None] = n
+        self.dirty = True
+
+    def set_angles(self, i, j, m, k, t0=np.pi): # From arrays, k and t0 may be scalars
+
+        n = len(i)
+        if n > self.max_angles:
+            raise ValueError("Too many angles : " + str(n) + " > " + str(self.max_angles))
+
+        for f, v, t in ((self.angle_i, i, np.int32), (self.angle_j, j, np.int32), (self.angle_m, m, np.int32), (self.angle_k, k, np.float32), (self.angle_t0, t0, np.float32)):
+            a = np.zeros(self.max_angles, dtype=t)
+            a[:n] = v
+            f.from_numpy(a)
+        self.nangles[None] = n
+        self.dirty = True
+
+    @ti.kernel
+    def copy_links(self, link0: ti.template(), link1: ti.template(), n: int, k: float, l0: float):
+
+        for b in range(n):
+            self.bond_i[b] = link0[b]
+            self.bond_j[b] = link1[b]
+            self.bond_k[b] = k
+            self.bond_l0[b] = l0
+        self.nbonds[None] = n
+
+    @ti.kernel
+    def count_vertex_angles(self):
+        for p in range(self.nparticles):
+            d = self.bend[p] - self.bstart[p]
+            self.acount[p] = d * (d - 1) // 2
+
+    @ti.kernel
+    def fill_vertex_angles(self, k: float, t0: float):
+
+        for p in range(self.nparticles):
+
+            a = self.astart[p]
+            for u in range(self.bstart[p], self.bend[p]):
+                for v in range(u + 1, self.bend[p]):
+
+                    self.angle_i[a] = self.other(self.binc[u])
+                    self.angle_j[a] = p
+                    self.angle_m[a] = self.other(self.binc[v])
+                    self.angle_k[a] = k
+                    self.angle_t0[a] = t0
+                    a += 1
+
+        self.nangles[None] = self.aend[self.nparticles - 1]
+
+    def from_links(self, link0, link1, n, k, l0, k_bend=0.0, t0=np.pi): # Bonds of a link list, angles at every pair of bonds sharing a particle
+
+        if n > self.max_bonds:
+            raise ValueError("Too many bonds : " + str(n) + " > " + str(self.max_bonds))
+
+        self.copy_links(link0, link1, n, k, l0)
+        self.nangles[None] = 0
+        self.build_bond_incidences()
+
+        if k_bend != 0.0:
+            self.count_vertex_angles()
+            exclusive_scan(self.acount, self.astart, self.aend, self.block_sum, self.scan_block)
+            if self.aend[self.nparticles - 1] > self.max_angles:
+                raise ValueError("Too many angles : " + str(self.aend[self.nparticles - 1]) + " > " + str(self.max_angles))
+            self.fill_vertex_angles(k_bend, t0)
+
+        self.dirty = True
+
+    @ti.kernel
+    def count_ranges(self, start: ti.template(), stop: ti.template(), n: ti.template(), last: int):
+
+        nr = ti.min(n[None], self.nparticles)
+        for r in range(self.nparticles):
+
+            nb = 0
+            na = 0
+            if r < nr:
+                length = stop[r] - start[r] + last
+                nb = ti.max(length - 1, 0)
+                na = ti.max(length - 2, 0)
+            self.bcount[r] = nb
+            self.acount[r] = na
+
+    @ti.kernel
+    def fill_ranges(self, start: ti.template(), n: ti.template(), k: float, l0: float, k_bend: float, t0: float):
+
+        # Bonds and angles past the capacities are dropped, from_ranges reports them when it may read back
+
+        for r in range(ti.min(n[None], self.nparticles)):
+
+            s = start[r]
+            for b in range(self.bstart[r], ti.min(self.bend[r], self.max_bonds)):
+                q = s + b - self.bstart[r]
+                self.bond_i[b] = q
+                self.bond_j[b] = q + 1
+                self.bond_k[b] = k
+                self.bond_l0[b] = l0
+
+            for a in range(self.astart[r], ti.min(self.aend[r], self.max_angles)):
+                q = s + 1 + a - self.astart[r]
+                self.angle_i[a] = q - 1
+                self.angle_j[a] = q
+                self.angle_m[a] = q + 1
+                self.angle_k[a] = k_bend
+                self.angle_t0[a] = t0
+
+        self.nbonds[None] = ti.min(self.bend[self.nparticles - 1], self.max_bonds)
+        self.nangles[None] = ti.min(self.aend[self.nparticles - 1], self.max_angles)
+
+    def from_ranges(self, start, stop, n, k, l0, k_bend=0.0, t0=np.pi, inclusive=True):
+
+        # Chains over the particles start[r] .. stop[r] of the n first ranges (filaments), a
+        # bond between consecutive particles and an angle at every inner particle.
+        # inclusive : stop[r] is the last particle, else one past it. Empty ranges are skipped.
+        # n : an int, or a 0-d field read on device (nfil of a growing cortex) : then nothing is
+        # read back, the capacities are not checked and should bound any topology (nparticles)
+
+        checked = isinstance(n, int)
+        if checked:
+            if n > self.nparticles:
+                raise ValueError("More ranges than particles : " + str(n))
+            self.nranges[None] = n
+            n = self.nranges
+
+        self.count_ranges(start, stop, n, 1 if inclusive else 0)
+        exclusive_scan(self.bcount, self.bstart, self.bend, self.block_sum, self.scan_block)
+        exclusive_scan(self.acount, self.astart, self.aend, self.block_sum, self.scan_block)
+
+        if checked and (self.bend[self.nparticles - 1] > self.max_bonds or self.aend[self.nparticles - 1] > self.max_angles):
+            raise ValueError("Too many bonds or angles : " + str(self.bend[self.nparticles - 1]) + ", " + str(self.aend[self.nparticles - 1]))
+
+        self.fill_ranges(start, n, k, l0, k_bend, t0)
+        self.dirty = True
+
+    # - Incidence lists
+
+    @ti.func
+    def other(self, e): # Partner of the particle in bond incidence e
+        b = e // 2
+        result = self.bond_j[b]
+        if e % 2 == 1:
+            result = self.bond_i[b]
+        return result
+
+    @ti.kernel
+    def count_incidences(self, angles: ti.template()):
+
+        for p in range(self.nparticles):
+            self.bcount[p] = 0
+            if ti.static(angles):
+                self.acount[p] = 0
+
+        for b in range(self.nbonds[None]):
+            ti.atomic_add(self.bcount[ self.bond_i[b] ], 1)
+            ti.atomic_add(self.bcount[ self.bond_j[b] ], 1)
+
+        if ti.static(angles):
+            for a in range(self.nangles[None]):
+                ti.atomic_add(self.acount[ self.angle_i[a] ], 1)
+                ti.atomic_add(self.acount[ self.angle_j[a] ], 1)
+                ti.atomic_add(self.acount[ self.angle_m[a] ], 1)
+
+    @ti.kernel
+    def fill_incidences(self, angles: ti.template()):
+
+        # Ranks from atomics then an insertion sort of each particle's list : the order of
+        # the force sums does not depend on thread scheduling
+
+        for p in range(self.nparticles):
+            self.bcount[p] = 0
+            if ti.static(angles):
+                self.acount[p] = 0
+
+        for b in range(self.nbonds[None]):
+            self.binc[ self.bstart[ self.bond_i[b] ] + ti.atomic_add(self.bcount[ self.bond_i[b] ], 1) ] = 2 * b
+            self.binc[ self.bstart[ self.bond_j[b] ] + ti.atomic_add(self.bcount[ self.bond_j[b] ], 1) ] = 2 * b + 1
+
+        if ti.static(angles):
+            for a in range(self.nangles[None]):
+                self.ainc[ self.astart[ self.angle_i[a] ] + ti.atomic_add(self.acount[ self.angle_i[a] ], 1) ] = 3 * a
+                self.ainc[ self.astart[ self.angle_j[a] ] + ti.atomic_add(self.acount[ self.angle_j[a] ], 1) ] = 3 * a + 1
+                self.ainc[ self.astart[ self.angle_m[a] ] + ti.atomic_add(self.acount[ self.angle_m[a] ], 1) ] = 3 * a + 2
+
+        for p in range(self.nparticles):
+
+            sort_range(self.binc, self.bstart[p], self.bend[p])
+            if ti.static(angles):
+                sort_range(self.ainc, self.astart[p], self.aend[p])
+
+    def build_bond_incidences(self):
+        self.count_incidences(False)
+        exclusive_scan(self.bcount, self.bstart, self.bend, self.block_sum, self.scan_block)
+        self.fill_incidences(False)
+
+    def build(self): # CSR incidences of the current topology
+        self.count_incidences(True)
+        exclusive_scan(self.bcount, self.bstart, self.bend, self.block_sum, self.scan_block)
+        exclusive_scan(self.acount, self.astart, self.aend, self.block_sum, self.scan_block)
+        self.fill_incidences(True)
+        self.dirty = False
+
+    # - Forces
+
+    @ti.func
+    def sep(self, a, b): # a - b, minimum image in a periodic box
+        d = a - b
+        if ti.static(self.periodic):
+            for c in ti.static(range(2)):
+                d[c] = min_image(d[c], self.box[c])
+        return d
+
+    @ti.func
+    def stretching(self, pos, b): # Force on bond_i[b], the opposite one on bond_j[b]
+
+        d = self.sep(pos[ self.bond_i[b] ], pos[ self.bond_j[b] ])
+        r = d.norm()
+        f = ti.Vector.zero(float, 2)
+        if r > 0:
+            f = - self.bond_k[b] * (r - self.bond_l0[b]) / r * d
+        return f
+
+    @ti.func
+    def deviation(self, u, v, a): # t - t0 of angle a, in (-pi, pi]
+
+        t = ti.atan2(u[0]*v[1] - u[1]*v[0], u.dot(v))
+        dt = t - self.angle_t0[a]
+        dt -= 2 * np.pi * ti.floor(dt / (2 * np.pi) + 0.5)
+        return dt
+
+    @ti.func
+    def bending(self, pos, a): # Forces on angle_i[a], angle_m[a], the vertex gets minus their sum
+
+        # Signed 2D angle t from u = i - j to v = m - j, U = k/2 (t - t0)^2 with t - t0 in (-pi, pi] :
+        # smooth through straight and folded configurations, no 1/sin(t)
+
+        u = self.sep(pos[ self.angle_i[a] ], pos[ self.angle_j[a] ])
+        v = self.sep(pos[ self.angle_m[a] ], pos[ self.angle_j[a] ])
+        uu = u.dot(u)
+        vv = v.dot(v)
+
+        fi = ti.Vector.zero(float, 2)
+        fm = ti.Vector.zero(float, 2)
+        if uu > 0 and vv > 0:
+
+            g = self.angle_k[a] * self.deviation(u, v, a)
+
+            fi = g / uu * ti.Vector([-u[1], u[0]])
+            fm = - g / vv * ti.Vector([-v[1], v[0]])
+
+        return fi, fm
+
+    @ti.kernel
+    def forces_atomic(self, pos: ti.template(), forces: ti.template()):
+
+        for b in range(self.nbonds[None]):
+            f = self.stretching(pos, b)
+            ti.atomic_add(forces[ self.bond_i[b] ], f)
+            ti.atomic_sub(forces[ self.bond_j[b] ], f)
+
+        for a in range(self.nangles[None]):
+            fi, fm = self.bending(pos, a)
+            ti.atomic_add(forces[ self.angle_i[a] ], fi)
+            ti.atomic_add(forces[ self.angle_m[a] ], fm)
+            ti.atomic_sub(forces[ self.angle_j[a] ], fi + fm)
+
+    @ti.kernel
+    def forces_csr(self, pos: ti.template(), forces: ti.template()):
+
+        for p in range(self.nparticles):
+
+            f = ti.Vector.zero(float, 2)
+
+            for e in range(self.bstart[p], self.bend[p]):
+                fb = self.stretching(pos, self.binc[e] // 2)
+                if self.binc[e] % 2 == 0:
+                    f += fb
+                else:
+                    f -= fb
+
+            for e in range(self.astart[p], self.aend[p]):
+                fi, fm = self.bending(pos, self.ainc[e] // 3)
+                role = self.ainc[e] % 3
+                if role == 0:
+                    f += fi
+                elif role == 2:
+                    f += fm
+                else:
+                    f -= fi + fm
+
+            forces[p] += f
+
+    @ti.kernel
+    def energy(self, pos: ti.template()) -> float: # Stretching and bending energy of the topology
+
+        e = 0.0
+        for b in range(self.nbonds[None]):
+            r = self.sep(pos[ self.bond_i[b] ], pos[ self.bond_j[b] ]).norm()
+            e += 0.5 * self.bond_k[b] * (r - self.bond_l0[b])**2
+
+        for a in range(self.nangles[None]):
+            u = self.sep(pos[ self.angle_i[a] ], pos[ self.angle_j[a] ])
+            v = self.sep(pos[ self.angle_m[a] ], pos[ self.angle_j[a] ])
+            if u.dot(u) > 0 and v.dot(v) > 0:
+                e += 0.5 * self.angle_k[a] * self.deviation(u, v, a)**2
+
+        return e
+
+    def compute(self, pos, forces): # Adds the bonded forces to forces
+
+        if self.mode == "atomic":
+            self.forces_atomic(pos, forces)
+        else:
+            if self.dirty:
+                self.build()
+            self.forces_csr(pos, forces)
+
+@ti.func
+def sort_range(a, lo, hi): # Insertion sort of a[lo:hi], lists are short
+    for s in range(lo + 1, hi):
+        key = a[s]
+        t = s - 1
+        while t >= lo and a[t] > key:
+            a[t + 1] = a[t]
+            t -= 1
+        a[t + 1] = key
@@ -0,0 +1,221 @@
+import taichi as ti
+
+from concepts.rng import uniform
+from concepts.scan import exclusive_scan
+
+# - Growth of filaments stored as particle ranges, shared by Cortex2D and Cortex2D_test
+#
+# Filament k holds the particles len_start[k] .. len_stop[k] : with inclusive, len_stop[k]
+# is its last particle, else one past it. The host class owns pos, link0 / link1, shift,
+# the dynamic len_start / len_stop / lenshift, nfil / nparticles / nseg and the rates
+# prate, unprate, create, pseq and seed, then calls init_lists.
+#
+# Draws come from the counter based RNG : filament k uses the stream k of step t, the step
+# wide draws the stream nmax.
+#
+# shift_lists : the new layout of every filament comes from exclusive scans of the per
+# filament deltas drawn by rd_polym, then one scatter moves each particle once,
+# O(nparticles). A step that needs more than nmax particles is dropped on device and
+# counted in noverflow.
+
+@ti.data_oriented
+class Filament_lists:
+
+    def init_lists(self, inclusive): # Bookkeeping of shift_lists, there are never more than nmax filaments
+
+        self.inclusive = inclusive
+        self.stop_offset = 1 if inclusive else 0                           # length = len_stop - len_start + stop_offset
+
+        self.fil_len = ti.field(dtype=ti.i32, shape=(self.nmax))          # New length of each filament
+        self.fil_first = ti.field(dtype=ti.i32, shape=(self.nmax))        # Its new first particle, exclusive scan of fil_len
+        self.fil_end = ti.field(dtype=ti.i32, shape=(self.nmax))
+        self.fil_alive = ti.field(dtype=ti.i32, shape=(self.nmax))        # 1 if the filament survives the step
+        self.fil_rank = ti.field(dtype=ti.i32, shape=(self.nmax))         # Its new index, exclusive scan of fil_alive
+        self.fil_rank_end = ti.field(dtype=ti.i32, shape=(self.nmax))
+        self.fil_nseg = ti.field(dtype=ti.i32, shape=(self.nmax))         # Its new number of segments
+        self.seg_first = ti.field(dtype=ti.i32, shape=(self.nmax))        # Its first link, exclusive scan of fil_nseg
+        self.seg_end = ti.field(dtype=ti.i32, shape=(self.nmax))
+
+        self.new_start = ti.field(dtype=ti.i32, shape=(self.nmax))        # len_start / len_stop by new index
+        self.new_stop = ti.field(dtype=ti.i32, shape=(self.nmax))
+
+        self.created = ti.field(dtype=ti.i32, shape=())                    # 1 if the step adds a filament after the nfil ones
+        self.noverflow = ti.field(dtype=ti.i32, shape=())                  # Steps dropped for lack of particles
+
+        self.scan_block = 64
+        self.block_sum = ti.field(dtype=ti.i32, shape=((self.nmax + self.scan_block - 1) // self.scan_block))
+
+        # New filaments start at a random point of the square [cx, cx + spacedim] x [cy, cy + spacedim],
+        # the one the filaments are placed in, by default the extent of one initial filament
+
+        self.domain = ti.Vector.field(3, dtype=ti.f32, shape=())           # spacedim, cx, cy
+        self.spawn = ti.Vector.field(2, dtype=ti.f32, shape=())            # First particle of the filament created this step
+        self.set_domain(self.lfil * self.l0, 0.0, 0.0)
+
+    def set_domain(self, spacedim, cx, cy):
+        self.domain[None] = [spacedim, cx, cy]
+
+    # - Draws
+
+    @ti.func
+    def draw_active(self, t): # A sequence of polymerisation this step
+        return uniform(self.seed, t, self.nmax, 0) < self.pseq
+
+    @ti.func
+    def draw_events(self, t, k): # 1 for each event of filament k : polymerisation at start, at stop, depolymerisation at start, at stop
+
+        return ti.Vector([
+            1 if uniform(self.seed, t, k, 0) < self.prate else 0,
+            1 if uniform(self.seed, t, k, 1) < self.prate else 0,
+            1 if uniform(self.seed, t, k, 2) < self.unprate else 0,
+            1 if uniform(self.seed, t, k, 3) < self.unprate else 0,
+        ])
+
+    @ti.func
+    def draw_create(self, t, active): # A new filament this step
+        return active and uniform(self.seed, t, self.nmax, 1) < self.create
+
+    @ti.func
+    def draw_spawn(self, t): # First particle of a new filament, uniform in the domain
+
+        d = self.domain[None]
+        return ti.Vector([d[1] + uniform(self.seed, t, self.nmax, 2) * d[0], d[2] + uniform(self.seed, t, self.nmax, 3) * d[0]])
+
+    @ti.func
+    def end_step(self, end, inner, n, at_start: ti.template()):
+
+        # Position of a new particle past the particle end, relative to it : one more segment
+        # along the last one (end - inner), along -x / +x when the filament has less than 2 particles
+
+        step = ti.Vector([-self.l0, 0.0]) if ti.static(at_start) else ti.Vector([self.l0, 0.0])
+        if n >= 2:
+            step = self.pos[end] - self.pos[inner]
+        return step
+
+    # - Compact storage
+
+    @ti.kernel
+    def rd_polym(self, t: int):
+
+        # Only draws the length changes at both ends, the counts are rebuilt by shift_lists
+
+        active = self.draw_active(t)
+
+        for k in range(self.nfil[None]):
+
+            e = ti.Vector([0, 0, 0, 0])
+            if active:
+                e = self.draw_events(t, k)
+
+            self.lenshift[2*k] = e[0] - e[2]
+            self.lenshift[2*k+1] = e[1] - e[3]
+
+        self.created[None] = 0
+        if self.draw_create(t, active) and self.nparticles[None] < self.nmax:     # Polymerisation of a new filament
+
+            k = self.nfil[None]                                                   # Counted by shift_lists from created
+            self.len_start[k] = self.nparticles[None]                             # Empty filament at the end of the storage,
+            self.len_stop[k] = self.nparticles[None] - self.stop_offset           # shift_lists gives it its first particle
+            self.lenshift[2*k] = 1
+            self.lenshift[2*k+1] = 0
+            self.spawn[None] = self.draw_spawn(t)
+            self.created[None] = 1
+
+    @ti.kernel
+    def filament_deltas(self):
+
+        for k in range(self.nmax):
+
+            n = 0
+            if k < self.nfil[None] + self.created[None]:       # Filaments of length <= 0 disappear
+                n = ti.max(0, self.len_stop[k] - self.len_start[k] + self.stop_offset + self.lenshift[2*k] + self.lenshift[2*k+1])
+
+            self.fil_len[k] = n
+            self.fil_alive[k] = 1 if n > 0 else 0
+            self.fil_nseg[k] = ti.max(n - 1, 0)
+
+    @ti.kernel
+    def scatter_filaments(self):
+
+        fits = self.fil_end[self.nmax - 1] <= self.nmax
+
+        for k in range(self.nfil[None] + self.created[None]):
+
+            if fits and self.fil_len[k] > 0:
+
+                rstart = self.len_start[k]                          # Kept particles of the old filament
+                rstop = self.len_stop[k] + self.stop_offset
+                if self.lenshift[2*k] < 0 : rstart += 1
+                if self.lenshift[2*k+1] < 0 : rstop -= 1
+
+                first = self.fil_first[k]                           # New storage of the filament
+                last = self.fil_end[k] - 1
+                wstart = first + ti.max(self.lenshift[2*k], 0)
+
+                for i in range(rstart, rstop):
+                    self.shift[ wstart + i - rstart ] = self.pos[i]     # Pickup the filament and apply the shift
+
+                kept = rstop - rstart
+                step_start = self.end_step(rstart, rstart + 1, kept, True)
+                step_stop = self.end_step(rstop - 1, rstop - 2, kept, False)
+
+                if kept > 0:
+
+                    if self.lenshift[2*k] > 0 :         # If adding, extend the first particle
+                        self.shift[first] = self.pos[rstart] + step_start
+                    if self.lenshift[2*k+1] > 0 :       # If adding, extend the last particle
+                        self.shift[last] = self.pos[rstop-1] + step_stop
+
+                else:                                   # Nothing kept : restart from the old first particle, or spawn
+
+                    anchor = self.spawn[None]
+                    if self.len_stop[k] + self.stop_offset > self.len_start[k]:
+                        anchor = self.pos[ self.len_start[k] ]
+                    self.shift[first] = anchor
+                    if last > first:
+                        self.shift[last] = anchor + step_stop
+
+                r = self.fil_rank[k]
+                self.new_start[r] = first
+                self.new_stop[r] = last + 1 - self.stop_offset
+
+                s0 = self.seg_first[k]
+                for i in range(first, last):
+                    self.link0[ s0 + i - first ] = i
+                    self.link1[ s0 + i - first ] = i + 1
+
+    @ti.kernel
+    def commit_lists(self):
+
+        # The counters are the totals of the scans, no thread updates them
+
+        npart = self.fil_end[self.nmax - 1]
+        fits = npart <= self.nmax
+        nfil = self.fil_rank_end[self.nmax - 1] if fits else 0
+
+        for k in range(self.nmax):
+            if fits:
+                if k < npart:
+                    self.pos[k] = self.shift[k]
+                else:
+                    self.pos[k] = [0.0, 0.0]
+
+        for k in range(nfil):
+            self.len_start[k] = self.new_start[k]
+            self.len_stop[k] = self.new_stop[k]
+
+        if fits:
+            self.nfil[None] = nfil
+            self.nparticles[None] = npart
+            self.nseg[None] = self.seg_end[self.nmax - 1]
+        else:
+            self.noverflow[None] += 1
+
+    def shift_lists(self):
+
+        self.filament_deltas()
+        exclusive_scan(self.fil_len, self.fil_first, self.fil_end, self.block_sum, self.scan_block)
+        exclusive_scan(self.fil_alive, self.fil_rank, self.fil_rank_end, self.block_sum, self.scan_block)
+        exclusive_scan(self.fil_nseg, self.seg_first, self.seg_end, self.block_sum, self.scan_block)
+        self.scatter_filaments()
+        self.commit_lists()
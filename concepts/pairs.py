@@ -0,0 +1,187 @@
+import taichi as ti
+
+from datastructs.cell_reg import cellToHash2d_ti, hashToCell2d_ti
+
+# - Pair forces of a radial potential (concepts.potentials) up to a cutoff, over the cells of a
+#   Cell_reg or over a Neighbor_list. Works on any container with a position and a force
+#   field : Mdsystem_2D, Particle_set or bare fields.
+#
+#   mode "full"   : 3x3 stencil, every pair evaluated from both sides, each particle only
+#                   writes its own force
+#   mode "half"   : half stencil, each pair once, cells swept in colors : reproducible
+#   mode "atomic" : half stencil, one thread per particle with atomic adds
+#
+# A potential with by_species picks its force from the species tags of the Cell_reg.
+
+@ti.data_oriented
+class Pair_forces:
+
+    def __init__(self, rcut, pot=None, dim=2):
+
+        self.rcut = rcut        # forces and energies are zero beyond, compiled into the kernels
+        self.pot = pot          # potential of compute when none is given
+        self.dim = dim
+
+    def compute(self, plist, forces, reg, mode="half", pot=None): # Pair forces from a Cell_reg with the chosen traversal, added to forces
+
+        pot = self.pot if pot is None else pot
+        if mode == "full":
+            self.full(plist, forces, reg, pot)
+        elif mode == "half":
+            self.half(plist, forces, reg, pot)
+        elif mode == "atomic":
+            self.atomic(plist, forces, reg, pot)
+        else:
+            raise ValueError("Unknown pair mode : " + str(mode))
+
+    @ti.func
+    def pair(self, plist, k, q, reg, pot): # Pair force on k from q, zero beyond rcut
+
+        r, r2, drx, dry = reg.dist(plist[q], plist[k])
+        f = ti.Vector.zero(float, self.dim)
+
+        if(r<self.rcut):
+
+            intensity = 0.0
+            if ti.static(getattr(pot, "by_species", False)):    # one potential per pair of species
+                intensity = pot.force_species(r, reg.species[k], reg.species[q])
+            else:
+                intensity = pot.force(r)
+
+            f[0] = intensity * (drx/r)
+            f[1] = intensity * (dry/r)
+
+        return f
+
+    @ti.kernel
+    def full(self, plist: ti.template(), forces: ti.template(), reg: ti.template(), pot: ti.template()):
+
+        # Full 3x3 stencil : every pair is evaluated from both sides and each
+        # particle only writes its own force, so there is no write conflict
+
+        for k in range(reg.nlive()):  # Loop for all particles
+
+            xp, yp = hashToCell2d_ti(reg.particle_hash[k], reg.ny)
+            fk = ti.Vector.zero(float, self.dim)
+
+            for i in range(xp-1,xp+2):
+                for j in range(yp-1,yp+2):
+
+                    hash_part = reg.cell_at(i, j)
+                    if hash_part != -1:
+
+                        for pos in range(reg.start_idx[hash_part], reg.end_idx[hash_part]): # slots of the cell
+
+                            if(k!=reg.idx[pos]):
+                                fk += self.pair(plist, k, reg.idx[pos], reg, pot)
+
+            forces[k] += fk
+
+    @ti.func
+    def half_shell(self, pos, plist, forces, reg, pot, atomic: ti.template()):
+
+        # Pairs of the particle in slot pos with the later slots of its own cell and with
+        # every particle of the forward cells (+1,-1) (+1,0) (+1,+1) (0,+1) :
+        # each pair is met exactly once and applied to both particles (Newton's third law)
+
+        k = reg.idx[pos]
+        hashcode = reg.hashlist[pos]
+        xp, yp = hashToCell2d_ti(hashcode, reg.ny)
+        fk = ti.Vector.zero(float, self.dim)
+
+        for other in range(pos + 1, reg.end_idx[hashcode]):
+
+            q = reg.idx[other]
+            f = self.pair(plist, k, q, reg, pot)
+            fk += f
+            if ti.static(atomic):
+                ti.atomic_sub(forces[q], f)
+            else:
+                forces[q] = forces[q] - f
+
+        for off in ti.static([(1, -1), (1, 0), (1, 1), (0, 1)]):
+
+            hash_part = reg.cell_at(xp + off[0], yp + off[1])
+            if hash_part != -1:
+
+                for other in range(reg.start_idx[hash_part], reg.end_idx[hash_part]):
+
+                    q = reg.idx[other]
+                    f = self.pair(plist, k, q, reg, pot)
+                    fk += f
+                    if ti.static(atomic):
+                        ti.atomic_sub(forces[q], f)
+                    else:
+                        forces[q] = forces[q] - f
+
+        if ti.static(atomic):
+            ti.atomic_add(forces[k], fk)
+        else:
+            forces[k] = forces[k] + fk
+
+    @ti.kernel
+    def half(self, plist: ti.template(), forces: ti.template(), reg: ti.template(), pot: ti.template()):
+
+        # Half stencil without atomics : a cell only writes into itself and its forward
+        # cells, so cells are swept in 6 colors (x % 2, y % 3) whose cells never write
+        # to the same particle. Every force is summed in a fixed order, the result is
+        # reproducible run to run.
+
+        for cx in ti.static(range(2)):
+            for cy in ti.static(range(3)):
+
+                for a, b in ti.ndrange((reg.nx - cx + 1) // 2, (reg.ny - cy + 2) // 3):
+
+                    hashcode = cellToHash2d_ti(2 * a + cx, 3 * b + cy, reg.ny)
+
+                    for pos in range(reg.start_idx[hashcode], reg.end_idx[hashcode]):
+                        self.half_shell(pos, plist, forces, reg, pot, False)
+
+    @ti.kernel
+    def atomic(self, plist: ti.template(), forces: ti.template(), reg: ti.template(), pot: ti.template()):
+
+        # Half stencil with one thread per particle and atomic adds on both particles.
+        # Same work as half with more parallelism, but the order of the float
+        # additions depends on thread scheduling : forces differ in the last bits between runs.
+
+        for pos in range(reg.nlive()):
+            self.half_shell(pos, plist, forces, reg, pot, True)
+
+    @ti.kernel
+    def from_list(self, plist: ti.template(), forces: ti.template(), reg: ti.template(), nb_start: ti.template(), nb_end: ti.template(), neighbors: ti.template(), pot: ti.template()):
+
+        # Same forces as full from a Neighbor_list built on reg, each particle only writes its own force
+
+        for k in range(nb_start.shape[0]):
+
+            f = ti.Vector.zero(float, self.dim)
+            for m in range(nb_start[k], nb_end[k]):
+                f += self.pair(plist, k, neighbors[m], reg, pot)
+
+            forces[k] += f
+
+    # - Energy, for the potentials with an energy(r) : pair energies are shifted to 0 at rcut
+
+    @ti.kernel
+    def energy(self, plist: ti.template(), reg: ti.template(), pot: ti.template()) -> float:
+
+        e = 0.0
+        for k in range(reg.nlive()):
+
+            xp, yp = hashToCell2d_ti(reg.particle_hash[k], reg.ny)
+            for i in range(xp-1,xp+2):
+                for j in range(yp-1,yp+2):
+
+                    hash_part = reg.cell_at(i, j)
+                    if hash_part != -1:
+
+                        for pos in range(reg.start_idx[hash_part], reg.end_idx[hash_part]):
+
+                            q = reg.idx[pos]
+                            r, r2, drx, dry = reg.dist(plist[q], plist[k])
+                            if q != k and r < self.rcut:
+                                if ti.static(getattr(pot, "by_species", False)):
+                                    e += 0.5 * (pot.energy_species(r, reg.species[k], reg.species[q]) - pot.energy_species(self.rcut, reg.species[k], reg.species[q]))
+                                else:
+                                    e += 0.5 * (pot.energy(r) - pot.energy(self.rcut))
+        return e
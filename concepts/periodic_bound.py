@@ -1 +1,19 @@
+import taichi as ti
 
+# - Periodic boundaries : positions live in [lo, lo + length) on each axis and
+# - separations are taken between the closest periodic images (minimum image)
+
+@ti.func
+def wrap(x, lo, length): # Bring a coordinate back into [lo, lo + length)
+
+    return x - ti.floor((x - lo) / length) * length
+
+@ti.func
+def min_image(d, length): # Separation to the closest periodic image, in [-length/2, length/2]
+
+    return d - ti.floor(d / length + 0.5) * length
+
+@ti.func
+def wrap_cell(i, n): # Periodic index of an interior cell, interior cells are 1 .. n
+
+    return (i - 1 + n) % n + 1
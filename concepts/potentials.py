@@ -0,0 +1,180 @@
+import taichi as ti
+
+# - Radial pair potentials for the pair kernels of concepts.pairs
+#
+# A potential is a data_oriented object with a ti.func force(r), the intensity of the
+# force on a particle along the unit vector towards its partner at distance r, i.e.
+# dU/dr : negative is repulsive. Pair kernels receive it as a ti.template(), so any
+# object with the same force(r) can be swapped in, Pair_table included. The analytic
+# potentials also have energy(r), the U whose derivative force(r) is, for energy checks.
+# Species_potential picks one of them from the species tags of the two particles.
+
+@ti.data_oriented
+class Lj_potential: # - Lennard-Jones on a core shifted by rad, as md_base_1 always used it
+
+    def __init__(self, sigma=1.0, e0=1.0, rad=0.0, cap=100.0, cap_value=-10.0):
+
+        self.sigma = sigma
+        self.e0 = e0
+        self.rad = rad              # r + rad is the LJ distance, rad < 0 gives a hard core of radius -rad
+        self.cap = cap              # intensities beyond +-cap (and the NaN at r = -rad) become cap_value
+        self.cap_value = cap_value
+
+    @ti.func
+    def force(self, r):
+
+        # Historical form : r * dU/dr of the shifted LJ, kept for the existing dynamics
+
+        r += self.rad
+        intensity = - self.e0 * ( 48*(self.sigma/r)**12 - 24*(self.sigma/r)**6 )
+        if not (intensity >= -self.cap and intensity <= self.cap) :
+            intensity = self.cap_value
+        return intensity
+
+    @ti.func
+    def energy(self, r): # Primitive of the uncapped force
+
+        r += self.rad
+        return self.e0 * ( 48.0/11.0*self.sigma**12/r**11 - 24.0/5.0*self.sigma**6/r**5 )
+
+@ti.data_oriented
+class Softcore_potential: # - Soft-core LJ, U = 4 e0 (1/(alpha + s)^2 - 1/(alpha + s)) with s = (r/sigma)^6
+
+    def __init__(self, sigma=1.0, e0=1.0, alpha=0.5):
+
+        self.sigma = sigma
+        self.e0 = e0
+        self.alpha = alpha          # 0 is plain LJ, > 0 keeps the force finite down to r = 0
+
+    @ti.func
+    def force(self, r):
+
+        s = (r / self.sigma)**6
+        a = 1.0 / (self.alpha + s)
+        dsdr = 6.0 * s / ti.max(r, 1e-12)
+        return 4.0 * self.e0 * (a*a - 2.0*a*a*a) * dsdr
+
+    @ti.func
+    def energy(self, r):
+
+        a = 1.0 / (self.alpha + (r / self.sigma)**6)
+        return 4.0 * self.e0 * (a*a - a)
+
+@ti.data_oriented
+class Morse_potential: # - Morse, U = d0 (1 - exp(-a (r - r0)))^2
+
+    def __init__(self, d0=1.0, a=1.0, r0=1.0):
+
+        self.d0 = d0
+        self.a = a
+        self.r0 = r0
+
+    @ti.func
+    def force(self, r):
+
+        e = ti.exp(-self.a * (r - self.r0))
+        return 2.0 * self.d0 * self.a * (1.0 - e) * e
+
+    @ti.func
+    def energy(self, r):
+
+        e = ti.exp(-self.a * (r - self.r0))
+        return self.d0 * (1.0 - e)**2
+
+@ti.data_oriented
+class Species_potential: # - One potential per pair of species, from the species tags of the Cell_reg
+
+    by_species = True                   # the pair kernels call force_species(r, a, b) instead of force(r)
+
+    def __init__(self, nspecies, pairs):
+
+        # pairs : {(a, b): potential}, (b, a) gets the same one, missing pairs do not interact
+
+        self.nspecies = nspecies
+        self.table = [[None] * nspecies for _ in range(nspecies)]
+        for (a, b), pot in pairs.items():
+            if not (0 <= a < nspecies and 0 <= b < nspecies):
+                raise ValueError("Unknown species pair : " + str((a, b)))
+            self.table[a][b] = pot
+            self.table[b][a] = pot
+        self.active = [[pot is not None for pot in row] for row in self.table]
+
+    @ti.func
+    def force_species(self, r, a, b):
+
+        intensity = 0.0
+        for i in ti.static(range(self.nspecies)):
+            for j in ti.static(range(self.nspecies)):
+                if ti.static(self.active[i][j]):
+                    if a == i and b == j:
+                        intensity = self.table[i][j].force(r)
+        return intensity
+
+    @ti.func
+    def energy_species(self, r, a, b):
+
+        u = 0.0
+        for i in ti.static(range(self.nspecies)):
+            for j in ti.static(range(self.nspecies)):
+                if ti.static(self.active[i][j]):
+                    if a == i and b == j:
+                        u = self.table[i][j].energy(r)
+        return u
+
+POTENTIALS = {"lj": Lj_potential, "softcore": Softcore_potential, "morse": Morse_potential}
+
+def make_potential(name, **params): # Built-in potential by name
+    if name not in POTENTIALS:
+        raise ValueError("Unknown potential : " + str(name))
+    return POTENTIALS[name](**params)
+
+@ti.data_oriented
+class Pair_table: # - force(r) of any potential sampled on [rmin, rmax], linear or cubic lookup
+
+    def __init__(self, potential, rmin, rmax, size=2048, interp="linear"):
+
+        if interp not in ("linear", "cubic"):
+            raise ValueError("Unknown table interpolation : " + str(interp))
+
+        self.potential = potential
+        self.rmin = rmin
+        self.rmax = rmax
+        self.size = size                        # intervals between rmin and rmax
+        self.interp = interp
+        self.dr = (rmax - rmin) / size
+        self.inv_dr = 1.0 / self.dr
+
+        # Sample j at rmin + (j - 1) dr : one extra sample on each side for the cubic stencil
+        self.values = ti.field( shape=size + 3, dtype=float)
+        self.build(potential)
+
+    @ti.kernel
+    def build(self, potential: ti.template()):
+
+        for j in range(1, self.size + 2):
+            self.values[j] = potential.force(self.rmin + (j - 1) * self.dr)
+
+        for _ in range(1):  # The outer samples are extrapolated, the force may not exist past the range
+            self.values[0] = 2.0 * self.values[1] - self.values[2]
+            self.values[self.size + 2] = 2.0 * self.values[self.size + 1] - self.values[self.size]
+
+    @ti.func
+    def force(self, r):
+
+        # Below rmin the first sample is held, beyond rmax the last one : keep the cutoff
+        # of the pair kernel inside [rmin, rmax]
+
+        x = ti.min(ti.max((r - self.rmin) * self.inv_dr, 0.0), self.size - 1e-4)
+        i = int(x)
+        t = x - i
+        v1 = self.values[i + 1]
+        v2 = self.values[i + 2]
+
+        result = v1 + t * (v2 - v1)
+        if ti.static(self.interp == "cubic"):    # Catmull-Rom through samples i-1 .. i+2
+
+            v0 = self.values[i]
+            v3 = self.values[i + 3]
+            result = v1 + 0.5 * t * (v2 - v0 + t * (2.0*v0 - 5.0*v1 + 4.0*v2 - v3 + t * (3.0*(v1 - v2) + v3 - v0)))
+
+        return result
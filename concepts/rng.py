@@ -0,0 +1,30 @@
+import taichi as ti
+
+# - Counter based random numbers : a draw is a pure function of (seed, step, stream, draw),
+# - no generator state, so the result does not depend on which thread computes it or when.
+#
+# A stream is typically a particle or a filament id, draw numbers the draws of one stream
+# within a step.
+
+@ti.func
+def hash_u32(x): # lowbias32 integer hash, full avalanche on 32 bits
+
+    x ^= x >> 16
+    x *= ti.u32(0x7FEB352D)
+    x ^= x >> 15
+    x *= ti.u32(0x846CA68B)
+    x ^= x >> 16
+    return x
+
+@ti.func
+def counter_hash(seed, step, stream, draw):
+
+    h = hash_u32(ti.u32(seed))
+    h = hash_u32(h ^ ti.u32(step))
+    h = hash_u32(h ^ ti.u32(stream))
+    return hash_u32(h ^ ti.u32(draw))
+
+@ti.func
+def uniform(seed, step, stream, draw): # float in [0, 1), 24 random bits
+
+    return ti.f32(counter_hash(seed, step, stream, draw) >> 8) * (1.0 / 16777216.0)
@@ -0,0 +1,34 @@
+import taichi as ti
+
+# - Parallel prefix sums, the backbone of cell lists, neighbor lists and compactions
+
+@ti.kernel
+def exclusive_scan(count: ti.template(), start: ti.template(), end: ti.template(), block_sum: ti.template(), block: int):
+
+    # Exclusive prefix sum of count into start, end = start + count
+    # block_sum needs ceil(count.shape[0] / block) entries
+
+    n = count.shape[0]
+
+    for b in range(block_sum.shape[0]):  # Sum of each block
+
+        s = 0
+        for c in range(b * block, ti.min((b + 1) * block, n)):
+            s += count[c]
+        block_sum[b] = s
+
+    for _ in range(1):  # Scan of the block sums, short enough to stay serial
+
+        acc = 0
+        for b in range(block_sum.shape[0]):
+            s = block_sum[b]
+            block_sum[b] = acc
+            acc += s
+
+    for b in range(block_sum.shape[0]):  # Scan inside each block from its offset
+
+        acc = block_sum[b]
+        for c in range(b * block, ti.min((b + 1) * block, n)):
+            start[c] = acc
+            acc += count[c]
+            end[c] = acc
@@ -0,0 +1,246 @@
+import numpy as np
+import taichi as ti
+
+from concepts.periodic_bound import min_image, wrap_cell
+from concepts.scan import exclusive_scan
+
+# - Cell list of particle positions, the register every neighbor search starts from
+#
+# The box is cut into cells of side >= rcut plus a border of empty cells, particles are
+# binned with atomic counts, an exclusive scan and a scatter : the particles of cell c are
+# idx[start_idx[c] : end_idx[c]]. The pair kernels (concepts.pairs), Neighbor_list,
+# Segment_reg and Spatial_order of md_base_1 and Particle_set all read it.
+
+@ti.data_oriented
+class Cell_reg: # - useful for a particlesystem object
+
+    def __init__(self, parts, rcut, spacedim, periodic=False, method="counting", stable=True, nreplicas=1, count=None, species=None):  # Necessary for cell listing
+
+        self.pos = parts
+        self.nparticles = self.pos.shape[0]
+        self.count = count                  # 0-d field : only its first count slots of parts are listed, None : all
+        self.counted = count is not None
+        self.species = species              # species tag of each particle, for the species potentials
+        self.nreplicas = nreplicas          # independent systems stored one after the other in parts
+        self.nper = self.nparticles // nreplicas
+        self.spacedim = spacedim
+        self.rcut = rcut
+        self.periodic = periodic
+
+        # As many cells as fit with a side >= rcut, so that the 3x3 stencil holds every pair
+        # under rcut. Periodic grids need >= 3 cells per axis for the stencil not to meet
+        # itself, and an even count in x / a multiple of 3 in y for the colored half sweep.
+
+        nx = max(1, int(self.spacedim[0] // rcut))
+        ny = max(1, int(self.spacedim[1] // rcut))
+        if self.periodic:
+            nx -= nx % 2
+            ny -= ny % 3
+            if nx < 3 or ny < 3:
+                raise ValueError("Periodic box too small for the cutoff : " + str(spacedim) + " with rcut " + str(rcut))
+
+        # Replicas get their own grid, the grids are stacked along x. Their border cells stay
+        # empty, so a stencil never reaches into the next replica and the traversals need
+        # no replica index. nx_rep is even when periodic, the colors of the half sweep hold.
+
+        self.nx_rep = nx + 2    # particles should not be in the extremities
+        self.nx = self.nx_rep * nreplicas
+        self.ny = ny + 2
+        self.ncells = self.nx * self.ny
+        self.cell_size = (self.spacedim[0] / nx, self.spacedim[1] / ny)
+        self.method = method  # "counting" : prefix-sum binning, "bitonic" : legacy sort
+        self.stable = stable  # order each cell by particle index, for reproducible traversals
+
+        self.idx = ti.field( shape=self.nparticles, dtype=ti.i32)         # particle indices sorted by cell
+        self.hashlist = ti.field( shape=self.nparticles, dtype=ti.i32)    # cell of each sorted slot
+        self.start_idx = ti.field( shape=self.ncells, dtype=ti.i32)       # first slot of each cell
+        self.end_idx = ti.field( shape=self.ncells, dtype=ti.i32)         # one past the last slot of each cell
+        self.cell_count = ti.field( shape=self.ncells, dtype=ti.i32)      # number of particles in each cell
+
+        self.particle_hash = ti.field( shape=self.nparticles, dtype=ti.i32)   # cell of each particle
+        self.rank = ti.field( shape=self.nparticles, dtype=ti.i32)            # position of the particle inside its cell
+
+        self.scan_block = 64                                                  # cells summed by one thread of the scan
+        self.nblocks = (self.ncells + self.scan_block - 1) // self.scan_block
+        self.block_sum = ti.field( shape=self.nblocks, dtype=ti.i32)
+
+        self.max_hash = self.ncells + 1
+        self.redcell_x = nx / self.spacedim[0]
+        self.redcell_y = ny / self.spacedim[1]
+
+        if self.method == "bitonic":
+
+            self.padded_size = 1 << (self.nparticles - 1).bit_length()  # Prochaine puissance de 2
+            self.logsize = np.log2(self.padded_size)
+
+            self.n2idx = ti.field(dtype=ti.f32, shape=self.padded_size)
+            self.n2hash = ti.field(dtype=ti.f32, shape=self.padded_size)
+
+        elif self.method != "counting":
+            raise ValueError("Unknown cell list method : " + str(method))
+
+        if self.counted and (self.method != "counting" or nreplicas != 1):
+            raise ValueError("A live count needs the counting method and a single replica")
+
+        self.idx.from_numpy(np.arange(self.nparticles, dtype=np.int32))
+
+
+    @ti.kernel
+    def bitonic_sort_hash(self, up: ti.i32, Nl: ti.i32):
+        k = 2
+        while k <= Nl:
+            j = k // 2
+            while j > 0:
+                ti.loop_config(parallelize=int(self.logsize))
+                for i in range(Nl):
+                    ixj = i ^ j
+                    if ixj > i:
+                        if ((i & k) == 0 and up == 1) or ((i & k) != 0 and up == 0):
+                            if (self.n2hash[i] > self.n2hash[ixj]):
+
+                                self.n2hash[i], self.n2hash[ixj] = self.n2hash[ixj], self.n2hash[i]
+                                self.n2idx[i], self.n2idx[ixj] = self.n2idx[ixj], self.n2idx[i]
+
+                        else:
+                            if (self.n2hash[i] < self.n2hash[ixj]):
+
+                                self.n2hash[i], self.n2hash[ixj] = self.n2hash[ixj], self.n2hash[i]
+                                self.n2idx[i], self.n2idx[ixj] = self.n2idx[ixj], self.n2idx[i]
+
+                j = j // 2
+            k = k * 2
+
+    @ti.kernel
+    def copy_to_n2(self):
+
+        for i in range(self.nparticles):
+            self.n2idx[i] = i
+            self.n2hash[i] = self.particle_hash[i]
+
+        for i in range(self.nparticles, self.padded_size):
+            self.n2idx[i] = self.max_hash + 1
+            self.n2hash[i] = self.max_hash + 1
+
+    @ti.kernel
+    def copy_from_n2(self):
+
+        for i in range(self.nparticles):
+            self.idx[i] = int(self.n2idx[i])
+            self.hashlist[i] = int(self.n2hash[i])
+
+    @ti.func
+    def nlive(self): # Particles in the list
+
+        n = self.nparticles
+        if ti.static(self.counted):
+            n = self.count[None]
+        return n
+
+    @ti.func
+    def hash_pos(self, part, replica):
+
+        x0 = replica * self.nx_rep
+        xred = int((part[0] + 0.0) * self.redcell_x) + 1
+        yred = int((part[1] + 0.0) * self.redcell_y) + 1
+
+        xred = x0 + ti.max(1, ti.min(self.nx_rep - 2, xred))   # stray particles go to the border cells
+        yred = ti.max(1, ti.min(self.ny - 2, yred))
+
+        return xred * self.ny + yred
+
+    @ti.func
+    def cell_at(self, i, j): # Hash of the cell (i, j) of a stencil, -1 if outside the grid
+
+        hashcode = -1
+        if ti.static(self.periodic):
+            x0 = (i // self.nx_rep) * self.nx_rep   # stencils stay inside the grid of their replica
+            hashcode = (x0 + wrap_cell(i - x0, self.nx_rep - 2)) * self.ny + wrap_cell(j, self.ny - 2)
+        elif(i>=0 and j>=0 and i<self.nx and j<self.ny):
+            hashcode = cellToHash2d_ti(i, j, self.ny)
+        return hashcode
+
+    @ti.func
+    def dist(self, pos1, pos2): # Separation pos1 - pos2, minimum image in a periodic box
+
+        drx = pos1[0] - pos2[0]
+        dry = pos1[1] - pos2[1]
+
+        if ti.static(self.periodic):
+            drx = min_image(drx, self.spacedim[0])
+            dry = min_image(dry, self.spacedim[1])
+
+        r2 = drx*drx + dry*dry
+        r = ti.sqrt(r2)
+
+        return r, r2, drx, dry
+
+    @ti.kernel
+    def count_cells(self):
+
+        for c in range(self.ncells):
+            self.cell_count[c] = 0
+
+        for k in range(self.nlive()):
+
+            hashcode = self.hash_pos(self.pos[k], k // self.nper)
+            self.particle_hash[k] = hashcode
+            self.rank[k] = ti.atomic_add(self.cell_count[hashcode], 1)
+
+    def scan_cells(self): # Exclusive prefix sum of cell_count into start_idx / end_idx
+        exclusive_scan(self.cell_count, self.start_idx, self.end_idx, self.block_sum, self.scan_block)
+
+    @ti.kernel
+    def scatter_cells(self):
+
+        for k in range(self.nlive()):
+
+            hashcode = self.particle_hash[k]
+            slot = self.start_idx[hashcode] + self.rank[k]
+
+            self.idx[slot] = k
+            self.hashlist[slot] = hashcode
+
+    @ti.kernel
+    def sort_cells(self): # Insertion sort of each cell by particle index, cells are short
+
+        for c in range(self.ncells):
+
+            for a in range(self.start_idx[c] + 1, self.end_idx[c]):
+
+                key = self.idx[a]
+                b = a - 1
+                while b >= self.start_idx[c] and self.idx[b] > key:
+                    self.idx[b + 1] = self.idx[b]
+                    b -= 1
+                self.idx[b + 1] = key
+
+    def update(self, parts): # Main calling for the Register
+        self.pos = parts
+        self.count_cells()
+        if self.method == "counting":
+            self.scan_cells()
+            self.scatter_cells()
+            if self.stable:
+                self.sort_cells()  # the atomic ranks leave each cell in scheduling order
+        else:
+            self.copy_to_n2()
+            self.bitonic_sort_hash( 1 , self.padded_size )  # 1 pour trier en ordre croissant
+            self.copy_from_n2()
+            self.scan_cells()
+
+# - Utility ti functions
+
+@ti.func
+def hashToCell2d_ti(hashcode, dim):
+
+    xpos = hashcode//dim
+    ypos = hashcode%dim
+
+    return xpos, ypos
+
+@ti.func
+def cellToHash2d_ti(xpos, ypos, dim):
+
+    hashcode = xpos*dim + ypos
+
+    return ti.cast(hashcode, int)
@@ -0,0 +1,197 @@
+import json
+import struct
+
+import numpy as np
+import taichi as ti
+
+# - Checkpoints : every field and counter of a ti.data_oriented object in one file
+#
+#   magic (8 bytes) | header length (u64) | JSON header | arrays, each aligned on ALIGN bytes
+#
+# The header lists each array by attribute path ("p_reg.idx", "t_bonds.bond_k"...) with its
+# dtype, shape and offset, and the python scalars (ints, floats, bools) of every object of the
+# tree. Arrays are raw and uncompressed : read_checkpoint maps them without a copy.
+#
+# Discovery walks the attributes of the object, nested data_oriented objects and the fields
+# held in lists, tuples and dicts. A field reached twice (Cell_reg.pos is p_pos) is stored
+# once, under its first path.
+#
+# Restoring writes into the fields of an object built with the same parameters, no kernel is
+# rebuilt. An object whose fields grow (Neighbor_list, Segment_reg, Particle_set) resizes them
+# first in restore_shapes(shapes), {attribute: saved shape} of the fields that differ.
+#
+# Dynamic SNode fields (len_start, len_stop, lenshift of Cortex2D) are stored up to their
+# length and restored with that length. ti.random has no state to save : runs that have to
+# resume bit for bit draw from concepts.rng, whose state is the seed and the step counter.
+
+MAGIC = b"TICKPT\x01\x00"
+ALIGN = 64
+
+# - Dynamic SNodes
+
+def is_dynamic(f):
+    return f.snode.parent().ptr.type == ti._lib.core.SNodeType.dynamic
+
+@ti.kernel
+def dynamic_length(f: ti.template()) -> ti.i32:
+    return ti.length(f.parent(), [])
+
+@ti.kernel
+def read_dynamic(f: ti.template(), out: ti.types.ndarray()):
+
+    for i in range(out.shape[0]):
+        if ti.static(isinstance(f, ti.MatrixField)):
+            for c in ti.static(range(f.n)):
+                out[i, c] = f[i][c]
+        else:
+            out[i] = f[i]
+
+@ti.kernel
+def write_dynamic(f: ti.template(), values: ti.types.ndarray()): # Writes activate the slots, length ends at shape[0]
+
+    ti.loop_config(serialize=True)
+    for i in range(values.shape[0]):
+        if ti.static(isinstance(f, ti.MatrixField)):
+            for c in ti.static(range(f.n)):
+                f[i][c] = values[i, c]
+        else:
+            f[i] = values[i]
+
+def dynamic_to_numpy(f):
+
+    n = dynamic_length(f)
+    shape = (n,) if not isinstance(f, ti.MatrixField) else (n, f.n)
+    out = np.zeros(shape, dtype=ti.lang.util.to_numpy_type(f.dtype))
+    if n > 0:
+        read_dynamic(f, out)
+    return out
+
+# - Discovery
+
+def is_object(v):
+    return getattr(type(v), "_data_oriented", False)
+
+def children(obj): # (path, value) of the attributes worth walking, in definition order
+
+    for name, v in vars(obj).items():
+        if isinstance(v, (list, tuple)):
+            for i, x in enumerate(v):
+                if isinstance(x, ti.Field):
+                    yield name + "." + str(i), x
+        elif isinstance(v, dict):
+            for k, x in v.items():
+                if isinstance(x, ti.Field):
+                    yield name + "." + str(k), x
+        else:
+            yield name, v
+
+def walk(obj, saved=None):
+
+    # (fields, scalars) : {path: field}, {path: python scalar} of obj and its nested objects.
+    # saved : {path: shape} of a checkpoint, objects resize their grown fields to match first
+
+    fields, scalars = {}, {}
+    seen_fields, seen_objects = set(), set()
+
+    def visit(o, prefix):
+
+        seen_objects.add(id(o))
+
+        if saved is not None and hasattr(o, "restore_shapes"):
+            shapes = {}
+            for name, v in vars(o).items():
+                if isinstance(v, ti.Field) and prefix + name in saved and tuple(saved[prefix + name]) != v.shape:
+                    shapes[name] = tuple(saved[prefix + name])
+            if shapes:
+                o.restore_shapes(shapes)
+
+        nested = []
+        for path, v in children(o):     # own fields first, a shared field gets the shortest path
+            if isinstance(v, ti.Field):
+                if id(v) not in seen_fields:
+                    seen_fields.add(id(v))
+                    fields[prefix + path] = v
+            elif isinstance(v, (bool, int, float, np.integer, np.floating)):
+                scalars[prefix + path] = v.item() if isinstance(v, np.generic) else v
+            elif is_object(v):
+                nested.append((path, v))
+
+        for path, v in nested:
+            if id(v) not in seen_objects:
+                visit(v, prefix + path + ".")
+
+    visit(obj, "")
+    return fields, scalars
+
+# - Files
+
+def save_checkpoint(obj, path): # Every field and counter of obj into path, returns the bytes written
+
+    fields, scalars = walk(obj)
+
+    arrays, entries = {}, {}
+    offset = 0
+    for name, f in fields.items():
+        a = dynamic_to_numpy(f) if is_dynamic(f) else f.to_numpy()
+        arrays[name] = a
+        entries[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset,
+                         "dynamic": is_dynamic(f), "field_shape": list(f.shape)}
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({"arrays": entries, "scalars": scalars}).encode()
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+    base = len(MAGIC) + 8 + len(header)
+
+    with open(path, "wb") as file:
+        file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, a in arrays.items():
+            file.seek(base + entries[name]["offset"])
+            file.write(np.ascontiguousarray(a).data)
+        file.truncate(base + offset)
+
+    return base + offset
+
+def read_checkpoint(path): # (arrays, scalars, header) : {path: read-only memmap}, {path: value}, raw header entries
+
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a checkpoint : " + str(path))
+        n, = struct.unpack("<Q", file.read(8))
+        header = json.loads(file.read(n))
+
+    base = len(MAGIC) + 8 + n
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, e in header["arrays"].items():
+        arrays[name] = np.ndarray(e["shape"], dtype=np.dtype(e["dtype"]), buffer=mm, offset=base + e["offset"])
+
+    return arrays, header["scalars"], header["arrays"]
+
+def load_checkpoint(obj, path): # Restores into obj the state saved by save_checkpoint
+
+    arrays, scalars, entries = read_checkpoint(path)
+    fields, _ = walk(obj, {name: e["field_shape"] for name, e in entries.items()})
+
+    missing = set(entries) ^ set(fields)
+    if missing:
+        raise ValueError("Checkpoint does not match the object : " + ", ".join(sorted(missing)))
+    for name, f in fields.items():
+        if tuple(entries[name]["field_shape"]) != f.shape:
+            raise ValueError("Field shape differs from the checkpoint : " + name + " " + str(f.shape))
+
+    dynamic = [name for name in fields if entries[name]["dynamic"]]
+    for name in dynamic:        # every dynamic SNode emptied before any refill, fields may share one
+        fields[name].snode.parent().deactivate_all()
+
+    for name, f in fields.items():
+        if name in dynamic:
+            if arrays[name].shape[0] > 0:
+                write_dynamic(f, np.ascontiguousarray(arrays[name]))
+        else:
+            f.from_numpy(arrays[name])
+
+    for name, v in scalars.items():
+        o = obj
+        for part in name.split(".")[:-1]:
+            o = getattr(o, part)
+        setattr(o, name.split(".")[-1], v)
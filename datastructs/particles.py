@@ -0,0 +1,212 @@
+import numpy as np
+import taichi as ti
+
+from concepts.pairs import Pair_forces
+from concepts.scan import exclusive_scan
+from datastructs.cell_reg import Cell_reg
+
+# - Growable particle storage, one field per attribute (structure of arrays)
+#
+# Every particle has pos, vel, force and a species tag, plus the attributes declared at
+# construction. The fields hold capacity slots, the first size of them are live and size
+# is mirrored on device in the 0-d field count. An add that does not fit doubles the
+# capacity : new fields, one bulk copy per attribute, the old storage is destroyed. A set
+# grown to N particles has been reallocated O(log N) times.
+#
+# A growth replaces the fields : kernels take them as ti.template() arguments read from
+# the set at each call (ps.pos, never a field kept from before), and reg is rebuilt on the
+# new fields. The kernels of this class follow the same rule.
+
+@ti.data_oriented
+class Particle_set:
+
+    def __init__(self, capacity=1024, attributes=None, dim=2):
+
+        # attributes : {name: dtype} for a scalar per particle, {name: (n, dtype)} for a vector
+
+        self.dim = dim
+        self.specs = {"pos": (dim, ti.f32), "vel": (dim, ti.f32), "force": (dim, ti.f32), "species": ti.i32}
+        for name, spec in (attributes or {}).items():
+            if name in self.specs or hasattr(self, name):
+                raise ValueError("Attribute already defined : " + str(name))
+            self.specs[name] = spec
+
+        self.size = 0                                   # live particles
+        self.capacity = 0
+        self.ngrowths = 0                               # reallocations so far
+        self.count = ti.field(dtype=ti.i32, shape=())   # size, for the kernels
+
+        self.scan_block = 64
+        self.tree = None
+        self.reg = None
+        self.reg_args = None
+        self.pairs = None
+
+        self.allocate(max(1, capacity))
+
+    # - Storage
+
+    def allocate(self, capacity): # Fields of capacity slots, the live particles are copied over
+
+        fb = ti.FieldsBuilder()
+        fields = {}
+        for name, spec in self.specs.items():
+            fields[name] = ti.Vector.field(spec[0], dtype=spec[1]) if isinstance(spec, tuple) else ti.field(dtype=spec)
+            fb.dense(ti.i, capacity).place(fields[name])
+
+        for name in ("keep", "rank", "rank_end", "hole"):  # Bookkeeping of compact
+            fields[name] = ti.field(dtype=ti.i32)
+            fb.dense(ti.i, capacity).place(fields[name])
+        fields["block_sum"] = ti.field(dtype=ti.i32)
+        fb.dense(ti.i, (capacity + self.scan_block - 1) // self.scan_block).place(fields["block_sum"])
+
+        tree = fb.finalize()
+
+        if self.tree is not None:
+            for name in self.specs:
+                self.copy(getattr(self, name), fields[name], self.size)
+            self.tree.destroy()
+
+        for name, f in fields.items():
+            setattr(self, name, f)
+        self.tree = tree
+        self.capacity = capacity
+        self.reset_keep(self.keep)
+
+        if self.reg_args is not None:
+            self.reg = self.make_reg()
+
+    def reserve(self, n): # Room for n particles, doubling the capacity if needed
+
+        if n > self.capacity:
+            self.allocate(max(n, 2 * self.capacity))
+            self.ngrowths += 1
+
+    def restore_shapes(self, shapes): # Checkpoint of a set with another capacity, the live slots are overwritten
+        if "pos" in shapes:
+            self.size = 0
+            self.allocate(shapes["pos"][0])
+
+    @ti.kernel
+    def copy(self, src: ti.template(), dst: ti.template(), n: int):
+        for k in range(n):
+            dst[k] = src[k]
+
+    @ti.kernel
+    def clear(self, f: ti.template(), n: int):
+
+        for k in range(n):
+            if ti.static(isinstance(f, ti.MatrixField)):
+                f[k] = ti.Vector.zero(f.dtype, f.n)
+            else:
+                f[k] = 0
+
+    @ti.kernel
+    def write_slots(self, f: ti.template(), start: int, values: ti.types.ndarray()):
+
+        for i in range(values.shape[0]):
+            if ti.static(isinstance(f, ti.MatrixField)):
+                for c in ti.static(range(f.n)):
+                    f[start + i][c] = values[i, c]
+            else:
+                f[start + i] = values[i]
+
+    # - Particles
+
+    def add(self, pos, species=0, **values): # Append particles, missing attributes are zero. Returns their slots
+
+        pos = np.asarray(pos, dtype=np.float32).reshape(-1, self.dim)
+        m = pos.shape[0]
+        values = dict(values, pos=pos, species=species)
+        for name in values:
+            if name not in self.specs:
+                raise ValueError("Unknown attribute : " + str(name))
+
+        start = self.size
+        self.reserve(start + m)
+
+        for name, spec in self.specs.items():
+
+            shape, dtype = ((m, spec[0]), spec[1]) if isinstance(spec, tuple) else ((m,), spec)
+            v = values.get(name, 0)
+            v = np.broadcast_to(np.asarray(v, dtype=ti.lang.util.to_numpy_type(dtype)), shape)
+            self.write_slots(getattr(self, name), start, np.ascontiguousarray(v))
+
+        self.size += m
+        self.count[None] = self.size
+        return slice(start, start + m)
+
+    def remove(self, dead): # Remove the live particles flagged in dead, a bool array of size
+
+        keep = 1 - np.asarray(dead, dtype=np.int32).reshape(self.size)
+        self.write_slots(self.keep, 0, keep)
+        self.compact()
+
+    def compact(self):
+
+        # Drops the live slots whose keep is 0, which may also be set on device. The last
+        # kept particles move into the holes : O(removed) moves, the order is not kept.
+
+        self.clip_keep(self.keep)
+        exclusive_scan(self.keep, self.rank, self.rank_end, self.block_sum, self.scan_block)
+        self.find_holes(self.keep, self.rank, self.rank_end, self.hole)
+        for name in self.specs:
+            self.fill_holes(getattr(self, name), self.keep, self.rank, self.rank_end, self.hole)
+        self.commit(self.keep, self.rank_end)
+        self.reset_keep(self.keep)
+
+        self.size = self.count[None]
+
+    @ti.kernel
+    def clip_keep(self, keep: ti.template()): # Slots past size are not kept
+        for k in keep:
+            if k >= self.count[None]:
+                keep[k] = 0
+
+    @ti.kernel
+    def find_holes(self, keep: ti.template(), rank: ti.template(), rank_end: ti.template(), hole: ti.template()):
+
+        newsize = rank_end[keep.shape[0] - 1]
+        for k in range(newsize):            # j-th removed slot below the new size
+            if keep[k] == 0:
+                hole[k - rank[k]] = k
+
+    @ti.kernel
+    def fill_holes(self, f: ti.template(), keep: ti.template(), rank: ti.template(), rank_end: ti.template(), hole: ti.template()):
+
+        newsize = rank_end[keep.shape[0] - 1]
+        for k in range(newsize, self.count[None]):      # j-th kept slot past the new size
+            if keep[k] == 1:
+                f[ hole[rank[k] - rank[newsize]] ] = f[k]
+
+    @ti.kernel
+    def commit(self, keep: ti.template(), rank_end: ti.template()):
+
+        self.count[None] = rank_end[keep.shape[0] - 1]
+
+    @ti.kernel
+    def reset_keep(self, keep: ti.template()):
+        for k in keep:
+            keep[k] = 1
+
+    # - Forces and neighbors, the same Cell_reg for every species
+
+    def reinit_forces(self):
+        self.clear(self.force, self.size)
+
+    def register(self, rcut, spacedim, periodic=False, **kwargs): # Cell_reg over the live particles, kept in reg through growths
+
+        self.reg_args = (rcut, spacedim, periodic, kwargs)
+        self.reg = self.make_reg()
+        self.pairs = Pair_forces(rcut, dim=self.dim)
+        return self.reg
+
+    def make_reg(self):
+        rcut, spacedim, periodic, kwargs = self.reg_args
+        return Cell_reg(self.pos, rcut, spacedim, periodic, count=self.count, species=self.species, **kwargs)
+
+    def update_reg(self):
+        self.reg.update(self.pos)
+
+    def pair_forces(self, pot, mode="half"): # Pair forces of pot up to the rcut of register, added to force. reg must be up to date
+        self.pairs.compute(self.pos, self.force, self.reg, mode, pot)
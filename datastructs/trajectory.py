@@ -0,0 +1,122 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+# - Trajectories as a directory of .npy stacks, one per field, frames along axis 0
+#
+#   traj/steps.npy  (nframes,)                 step of each frame
+#   traj/pos.npy    (nframes,) + field.shape   ...
+#
+# Files are plain .npy whose header is rewritten as frames are appended, so
+# np.load(..., mmap_mode="r") reads any frame range without loading the rest.
+
+HEADER_LEN = 256    # fixed, room for any shape, the data offset never moves
+
+def npy_header(dtype, shape): # .npy v1.0 header padded to HEADER_LEN bytes
+
+    d = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    d = d.ljust(HEADER_LEN - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(d)) + d.encode("latin1")
+
+class Npy_stack: # - Appendable .npy file of fixed-shape frames
+
+    def __init__(self, path, dtype, frame_shape):
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.frame_shape = tuple(frame_shape)
+        self.nframes = 0
+
+        self.file = open(path, "wb")
+        self.file.write(npy_header(self.dtype, (0,) + self.frame_shape))
+
+    def append(self, frame):
+        self.file.write(np.ascontiguousarray(frame, dtype=self.dtype).tobytes())
+        self.nframes += 1
+
+    def flush(self): # Make the frames written so far visible to readers
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, (self.nframes,) + self.frame_shape))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class Trajectory_writer: # - Frames of taichi fields written by a background thread
+
+    def __init__(self, path, fields, order=None, maxsize=8, flush_every=16):
+
+        # fields : {name: taichi field}, every frame holds a copy of each of them
+        # order : optional slot_of field of a Spatial_order, frames are then stored by particle id
+        # maxsize : frames waiting for the disk, write() only waits once they are all pending
+
+        self.path = path
+        self.fields = dict(fields)
+        self.order = order
+        self.flush_every = flush_every
+        self.nframes = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.stacks = {"steps": Npy_stack(os.path.join(path, "steps.npy"), np.int64, ())}
+        for name, f in self.fields.items():
+            a = f.to_numpy()    # numpy dtype and shape of a frame
+            self.stacks[name] = Npy_stack(os.path.join(path, name + ".npy"), a.dtype, a.shape)
+
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self): # Writer thread : gather by id, serialize, append
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                step, order, arrays = item
+                self.stacks["steps"].append(step)
+                for name, a in arrays.items():
+                    self.stacks[name].append(a if order is None else a[order])
+                if self.stacks["steps"].nframes % self.flush_every == 0:
+                    for s in self.stacks.values():
+                        s.flush()
+            except Exception as e:
+                self.error = e
+
+    def write(self, step): # Snapshot the fields, the disk write happens later
+
+        if self.error is not None:
+            raise self.error
+
+        order = None if self.order is None else self.order.to_numpy()
+        arrays = {name: f.to_numpy() for name, f in self.fields.items()}
+        self.queue.put((step, order, arrays))
+        self.nframes += 1
+
+    def close(self): # Wait for the pending frames and finalize the files
+
+        self.queue.put(None)
+        self.thread.join()
+        for s in self.stacks.values():
+            s.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_trajectory(path): # {name: read-only memmap of shape (nframes,) + frame shape}
+
+    return {name[:-4]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in sorted(os.listdir(path)) if name.endswith(".npy")}
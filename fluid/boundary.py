@@ -0,0 +1,406 @@
+import time
+
+import numpy as np
+import taichi as ti
+
+POISSON_FLUID = 0
+POISSON_NEUMANN = 1
+POISSON_DIRICHLET = 2
+
+# Boundary cell lists of BoundaryCondition, in their packed order
+PRESSURE_NEUMANN = 0    # walls and inflow, mean of two source cells
+PRESSURE_DIRICHLET = 1  # outflow, zero
+VELOCITY_WALL = 2       # reflection, the target past the wall takes minus the source
+VELOCITY_INFLOW = 3     # constant velocity
+VELOCITY_OUTFLOW = 4    # x velocity of the source, at least 0.05
+N_CELL_LISTS = 5
+
+# - Setup of the walls
+#
+# - 1 Class holding the walls, inflow and outflow cells on device, with the lists of the
+#   boundary cells its kernels loop over.
+# - Functions to build them as numpy arrays.
+#
+# Mask values:
+#     0: Fluid
+#     1: Wall
+#     2: Inflow
+#     3: Outflow
+#
+# The pressure Poisson solvers see three kinds of cells (poisson_mask) :
+#     POISSON_FLUID: unknown
+#     POISSON_NEUMANN: walls, inflow and the outside of the grid, copies of their fluid neighbor
+#     POISSON_DIRICHLET: outflow, pressure 0
+
+@ti.data_oriented
+class BoundaryCondition:
+    def __init__(self, bc_const, bc_mask, inflow, outflow):
+        # Initialize boundary condition by converting numpy arrays to Taichi fields
+        self._bc_const, self._bc_mask = BoundaryCondition.to_field(bc_const, bc_mask)
+        self.inflow = inflow
+        self.outflow = outflow
+
+        # Boundary cells the kernels loop over, instead of the whole grid. The lists are packed
+        # one after the other in a flat field : entry k holds the target, source a and source b
+        # cells at 3k, 3k + 1, 3k + 2, list l spans the entries [offsets[l], offsets[l + 1]).
+        # The field is sized to the entries and only reallocated when a mask needs more
+        self._cells = None
+        self._cells_tree = None
+        self._capacity = 0      # entries _cells can hold
+        self._offsets = ti.field(ti.i32, shape=N_CELL_LISTS + 1)
+        self.build_cell_lists(bc_mask)
+
+        self.profile = False    # time the boundary kernels into elapsed, set by the solver
+        self.elapsed = 0.0
+
+    def set_mask(self, bc_const, bc_mask):
+        """Replace the walls, inflow and outflow, at the same resolution
+
+        The pressure updaters keeping Poisson masks must then rebuild them (build_masks).
+        """
+        self._bc_const.from_numpy(bc_const)
+        self._bc_mask.from_numpy(bc_mask)
+        self.build_cell_lists(bc_mask)
+
+    def build_cell_lists(self, bc_mask):
+        """Rebuild the boundary cell lists from the numpy mask"""
+        lists = BoundaryCondition.cell_lists(bc_mask)
+        offsets = np.zeros(N_CELL_LISTS + 1, dtype=np.int32)
+        for l, entries in enumerate(lists):
+            offsets[l + 1] = offsets[l] + len(entries)
+
+        if self._cells is None or offsets[-1] > self._capacity:
+            self.allocate_cells(offsets[-1])
+        self._write_cells(self._cells, np.concatenate(lists).reshape(-1, 2))
+        self._offsets.from_numpy(offsets)
+
+    def allocate_cells(self, n):
+        """Room for n entries, the previous storage is destroyed"""
+        fb = ti.FieldsBuilder()
+        cells = ti.Vector.field(2, ti.i32)
+        fb.dense(ti.i, 3 * max(n, 1)).place(cells)
+        tree = fb.finalize()
+        if self._cells_tree is not None:
+            self._cells_tree.destroy()
+        self._cells, self._cells_tree, self._capacity = cells, tree, max(n, 1)
+
+    @ti.kernel
+    def _write_cells(self, cells: ti.template(), values: ti.types.ndarray()):
+        for k in range(values.shape[0]):
+            cells[k] = [values[k, 0], values[k, 1]]
+
+    def count_cells(self):
+        """Return the number of cells of every boundary list"""
+        offsets = self._offsets.to_numpy()
+        return offsets[1:] - offsets[:-1]
+
+    def set_velocity_boundary_condition(self, vc):
+        t0 = self._start()
+        self._set_velocity_boundary_condition(vc, self._cells)
+        self._stop(t0)
+
+    def set_pressure_boundary_condition(self, pc):
+        t0 = self._start()
+        self._set_pressure_boundary_condition(pc, self._cells)
+        self._stop(t0)
+
+    def _start(self):
+        if self.profile:
+            ti.sync()
+            return time.perf_counter()
+        return 0.0
+
+    def _stop(self, t0):
+        if self.profile:
+            ti.sync()
+            self.elapsed += time.perf_counter() - t0
+
+    # The cells are a template argument : a kernel compiled before a reallocation would keep
+    # the destroyed field
+
+    @ti.kernel
+    def _set_velocity_boundary_condition(self, vc: ti.template(), cells: ti.template()):
+        # Walls, Karman-Kozeny (KK) scheme : the cell past the wall takes the opposite velocity
+        # of the fluid side
+        for k in range(self._offsets[VELOCITY_WALL], self._offsets[VELOCITY_WALL + 1]):
+            vc[cells[3 * k]] = -vc[cells[3 * k + 1]]
+        # Inflow, predefined constant value
+        for k in range(self._offsets[VELOCITY_INFLOW], self._offsets[VELOCITY_INFLOW + 1]):
+            vc[cells[3 * k]] = self._bc_const[cells[3 * k]]
+        # Outflow, moving outward at 0.05 at least, which prevents backflow at the outlet
+        for k in range(self._offsets[VELOCITY_OUTFLOW], self._offsets[VELOCITY_OUTFLOW + 1]):
+            vc[cells[3 * k]].x = ti.max(vc[cells[3 * k + 1]].x, 0.05)
+
+    @ti.kernel
+    def _set_pressure_boundary_condition(self, pc: ti.template(), cells: ti.template()):
+        # Walls and inflow, mean of two fluid cells (the same one but at the corners)
+        for k in range(self._offsets[PRESSURE_NEUMANN], self._offsets[PRESSURE_NEUMANN + 1]):
+            pc[cells[3 * k]] = (pc[cells[3 * k + 1]] + pc[cells[3 * k + 2]]) / 2.0
+        # Outflow, pressure zero
+        for k in range(self._offsets[PRESSURE_DIRICHLET], self._offsets[PRESSURE_DIRICHLET + 1]):
+            pc[cells[3 * k]] = 0.0
+
+    @ti.func
+    def is_wall(self, i, j):
+        """Check if the cell at position (i,j) is a wall cell"""
+        return self._bc_mask[i, j] == 1
+
+    @ti.func
+    def is_fluid_domain(self, i, j):
+        """Check if the cell at position (i,j) is part of the fluid domain"""
+        return self._bc_mask[i, j] == 0
+
+    @ti.kernel
+    def poisson_mask(self, out: ti.template()):
+        """Fill out with the Poisson cell type of every cell"""
+        for i, j in out:
+            m = self._bc_mask[i, j]
+            if m == 0:
+                out[i, j] = POISSON_FLUID
+            elif m == 3:
+                out[i, j] = POISSON_DIRICHLET
+            else:
+                out[i, j] = POISSON_NEUMANN
+
+    def get_resolution(self):
+        """Return the grid resolution"""
+        return self._bc_const.shape[:2]
+
+    @staticmethod
+    def to_field(bc, bc_mask):
+        """
+        Convert NumPy arrays to Taichi fields
+
+        Args:
+            bc: NumPy array containing boundary condition values
+            bc_mask: NumPy array containing boundary condition types
+
+        Returns:
+            bc_field: Taichi vector field for boundary conditions
+            bc_mask_field: Taichi field for boundary condition types
+        """
+        bc_field = ti.Vector.field(2, ti.f32, shape=bc.shape[:2])
+        bc_field.from_numpy(bc)
+        bc_mask_field = ti.field(ti.u8, shape=bc_mask.shape[:2])
+        bc_mask_field.from_numpy(bc_mask)
+
+        return bc_field, bc_mask_field
+
+    @staticmethod
+    def cell_lists(bc_mask):
+        """
+        Classify the boundary cells of a mask into the lists of the boundary condition kernels
+
+        Outside of the grid a cell sees itself as neighbor, as sample clamps the indices.
+
+        Args:
+            bc_mask: NumPy array containing boundary condition types
+
+        Returns:
+            List of N_CELL_LISTS int32 arrays of shape (n, 3, 2), the (target, source a,
+            source b) cells of every entry, grouped by wall case
+        """
+        nx, ny = bc_mask.shape[:2]
+        i, j = np.indices((nx, ny))
+        il, ir = np.maximum(i - 1, 0), np.minimum(i + 1, nx - 1)
+        jd, ju = np.maximum(j - 1, 0), np.minimum(j + 1, ny - 1)
+        left, right, below, above = bc_mask[il, j], bc_mask[ir, j], bc_mask[i, jd], bc_mask[i, ju]
+        wall = bc_mask == 1
+        interior = (1 <= i) & (i < nx - 1) & (1 <= j) & (j < ny - 1)
+
+        def past_inflow(i, j):
+            # First column right of the inflow which is not inflow : the inflow is several cells
+            # wide, each of its cells copies the pressure of the domain instead of its neighbor
+            k = i + 1
+            more = (k < nx - 1) & (bc_mask[np.minimum(k, nx - 1), j] == 2)
+            while more.any():
+                k = k + more
+                more = (k < nx - 1) & (bc_mask[np.minimum(k, nx - 1), j] == 2)
+            return np.minimum(k, nx - 1), j
+
+        def entries(cases):
+            # Cases in priority order : (cells, target, source a, source b), a cell goes to
+            # the first case it matches
+            out = []
+            todo = np.ones((nx, ny), dtype=bool)
+            for where, target, a, b in cases:
+                where = where & todo
+                todo &= ~where
+                out.append(np.stack([np.stack((c[0][where], c[1][where]), axis=-1) for c in (target, a, b)], axis=1))
+            return np.concatenate(out).astype(np.int32)
+
+        sides_x = (below == 1) & (above == 1)   # walls above and below
+        sides_y = (left == 1) & (right == 1)    # walls to the left and right
+        inflow_above, inflow_below, inflow = past_inflow(i, ju), past_inflow(i, jd), past_inflow(i, j)
+
+        pressure_neumann = entries([
+            (wall & (left == 0) & sides_x, (i, j), (il, j), (il, j)),       # 1 fluid to the left
+            (wall & (right == 0) & sides_x, (i, j), (ir, j), (ir, j)),      # 2 fluid to the right
+            (wall & (below == 0) & sides_y, (i, j), (i, jd), (i, jd)),      # 3 fluid below
+            (wall & (above == 0) & sides_y, (i, j), (i, ju), (i, ju)),      # 4 fluid above
+            (wall & (left == 0) & (above == 0), (i, j), (il, j), (i, ju)),  # 5 corner left and above
+            (wall & (right == 0) & (above == 0), (i, j), (ir, j), (i, ju)), # 6 corner right and above
+            (wall & (left == 0) & (below == 0), (i, j), (il, j), (i, jd)),  # 7 corner left and below
+            (wall & (right == 0) & (below == 0), (i, j), (ir, j), (i, jd)), # 8 corner right and below
+            (wall & (above == 2), (i, j), inflow_above, inflow_above),      # 9 wall below the inflow
+            (wall & (below == 2), (i, j), inflow_below, inflow_below),      #   and above it
+            (bc_mask == 2, (i, j), inflow, inflow),                         # inflow
+        ])
+        pressure_dirichlet = entries([(bc_mask == 3, (i, j), (i, j), (i, j))])
+
+        wall = wall & interior
+        velocity_wall = entries([
+            (wall & (left == 0) & sides_x, (ir, j), (il, j), (il, j)),
+            (wall & (right == 0) & sides_x, (il, j), (ir, j), (ir, j)),
+            (wall & (below == 0) & sides_y, (i, ju), (i, jd), (i, jd)),
+            (wall & (above == 0) & sides_y, (i, jd), (i, ju), (i, ju)),
+        ])
+        velocity_inflow = entries([(bc_mask == 2, (i, j), (i, j), (i, j))])
+        velocity_outflow = entries([(bc_mask == 3, (i, j), (il, j), (il, j))])
+
+        return [pressure_neumann, pressure_dirichlet, velocity_wall, velocity_inflow, velocity_outflow]
+
+def create_bc_array(x_resolution, y_resolution):
+    """
+    Create arrays for boundary conditions
+
+    Args:
+        x_resolution: Width of the grid
+        y_resolution: Height of the grid
+
+    Returns:
+        bc: Array for velocity boundary conditions
+        bc_mask: Array for boundary type masks
+        bc_dye: Array for dye colors at boundaries
+    """
+    bc = np.zeros((x_resolution, y_resolution, 2), dtype=np.float32)
+    bc_mask = np.zeros((x_resolution, y_resolution), dtype=np.uint8)
+    bc_dye = np.zeros((x_resolution, y_resolution, 3), dtype=np.float32)
+
+    return bc, bc_mask, bc_dye
+
+
+def create_color_map(color_list, n_samples):
+    """
+    Create a smooth color gradient from a list of colors
+
+    Args:
+        color_list: List of RGB color values
+        n_samples: Number of samples in the output color map
+
+    Returns:
+        Interpolated color map array of shape (n_samples, 3)
+    """
+    color_arr = np.vstack(color_list)
+    x = np.linspace(0.0, 1.0, color_arr.shape[0], endpoint=True)
+
+    # Interpolate each color channel separately
+    x_ = np.linspace(0.0, 1.0, n_samples, endpoint=True)
+    r_arr = np.interp(x_, x, color_arr[:, 0])
+    g_arr = np.interp(x_, x, color_arr[:, 1])
+    b_arr = np.interp(x_, x, color_arr[:, 2])
+
+    return np.vstack((r_arr, g_arr, b_arr)).T
+
+def set_plane(bc, bc_mask, bc_dye, lower_left, upper_right):
+    """
+    Sets a rectangular plane as a boundary condition.
+
+    Args:
+        bc: Boundary condition velocity array
+        bc_mask: Boundary condition type mask
+        bc_dye: Boundary condition dye color array
+        lower_left: Tuple (x,y) of lower left corner of the plane
+        upper_right: Tuple (x,y) of upper right corner of the plane
+    """
+    bc[lower_left[0] : upper_right[0], lower_left[1] : upper_right[1]] = np.array([0.0, 0.0])
+    bc_mask[lower_left[0] : upper_right[0], lower_left[1] : upper_right[1]] = 1
+    bc_dye[lower_left[0] : upper_right[0], lower_left[1] : upper_right[1]] = np.array(
+        [0.0, 0.0, 0.0]
+    )
+
+def set_circle(bc, bc_mask, bc_dye, center, radius):
+    """
+    Sets a circular boundary condition.
+
+    Args:
+        bc: Boundary condition velocity array
+        bc_mask: Boundary condition type mask
+        bc_dye: Boundary condition dye color array
+        center: Tuple (x,y) of circle center
+        radius: Radius of the circle
+    """
+    center = np.asarray(center)
+    # Calculate the lower bound, ensuring it's not negative
+    l_ = np.round(np.maximum(center - radius, 0)).astype(np.int32)
+    # Calculate the upper bounds, ensuring they don't exceed array dimensions
+    u0 = round(min(center[0] + radius, bc.shape[0]))
+    u1 = round(min(center[1] + radius, bc.shape[1]))
+    # Iterate through the bounding box of the circle
+    for i in range(l_[0], u0):
+        for j in range(l_[1], u1):
+            # Add 0.5 to get the center of the cell
+            x = np.array([i, j]) + 0.5
+            # Check if the point is inside the circle
+            if np.linalg.norm(x - center) < radius:
+                bc[i, j] = np.array([0.0, 0.0])
+                bc_mask[i, j] = 1
+                bc_dye[i, j] = np.array([0.0, 0.0, 0.0])
+
+
+def create_boundary_condition(resolution, inflow, outflow, no_dye=True):
+    """
+    Creates boundary conditions for fluid simulation.
+
+    Args:
+        resolution: Grid resolution (square grid)
+        no_dye: Flag to control dye behavior (unused in this function)
+
+    Returns:
+        boundary_condition: BoundaryCondition object with configured boundaries
+    """
+    # Set up grid dimensions
+    x_res, y_res = resolution, resolution
+    bc, bc_mask, bc_dye = create_bc_array(x_res, y_res)
+
+    # Define inflow boundary condition
+    def set_inflow():
+        # Set horizontal flow at the left edge
+        bc[:2, :] = np.array([1.0, 0.0])
+        bc_mask[:2, :] = 2
+
+        # Define colors for dye visualization
+        y = np.array([1.1, 1.1, 0.2])  # Yellow
+        b = np.array([0.2, 0.2, 1.1])  # Blue
+        r = np.array([1.1, 0.2, 0.2])  # Red
+        c = np.array([0.2, 1.1, 1.1])  # Cyan
+        # Create repeating color pattern for inflow
+        color_map = create_color_map([c, r, b, y] * 3, bc_dye.shape[1])
+        bc_dye[:2, :] = np.stack((color_map, color_map), axis=0)
+
+    # Define outflow boundary condition
+    def set_outflow():
+        # Set right edge as outflow
+        bc[-1, :] = np.array([0.0, 0.0])
+        bc_mask[-1, :] = 3
+
+    # Define wall boundary conditions
+    def set_wall():
+        # Set top and bottom walls
+        set_plane(bc, bc_mask, bc_dye, (0, 0), (x_res, 2))  # Bottom wall
+        set_plane(bc, bc_mask, bc_dye, (0, y_res - 2), (x_res, y_res))  # Top wall
+
+        # Add a circular obstacle (cylinder) in the flow
+        r = y_res // 18  # Radius of cylinder
+        c = (x_res // 4, y_res // 2)  # Position of cylinder (1/4 from left, middle height)
+        set_circle(bc, bc_mask, bc_dye, c, r)
+
+    # Apply all boundary conditions
+    set_inflow()
+    set_outflow()
+    set_wall()
+
+    # Create and return the boundary condition object
+    boundary_condition = BoundaryCondition(bc, bc_mask, inflow, outflow)
+
+    return boundary_condition
@@ -0,0 +1,244 @@
+import math
+
+import taichi as ti
+
+from fluid.boundary import POISSON_DIRICHLET, POISSON_FLUID, POISSON_NEUMANN
+from fluid.pcg import ConjugateGradientPressureUpdater
+from fluid.pressure import masked_laplacian
+
+# - Geometric multigrid for the pressure Poisson equation
+#
+# Level 0 is the simulation grid, each next level halves it until its smaller side is at
+# most coarsest cells. A coarse cell is Dirichlet if one of its 2x2 children is, else fluid
+# if one of them is, else Neumann. Every level uses the same masked 5-point operator
+# (masked_laplacian), the restriction is the transpose of the bilinear prolongation.
+#
+# On the channel the only Dirichlet cells are the outflow column, which moves by up to half
+# a coarse cell on every level : alone, a V-cycle then reduces the residual by 0.3 to 0.6
+# only, worse as the grid grows. The V-cycle being symmetric (mirrored red-black sweeps,
+# symmetric Gauss-Seidel on the coarsest level), it is used by default as the preconditioner
+# of the conjugate gradient, which converges in a few iterations at any resolution.
+
+@ti.data_oriented
+class MultigridPressureUpdater(ConjugateGradientPressureUpdater):
+    """Multigrid V-cycles with red-black Gauss-Seidel smoothing
+
+    Solves to a relative residual tolerance, starting from the pressure of the previous
+    step, either with V-cycles preconditioning a conjugate gradient (cg=True) or with
+    V-cycles alone.
+    """
+
+    def __init__(self, boundary_condition, dt, dx, tol=1e-4, max_iter=20, cg=True, n_pre=2, n_post=2,
+                 n_coarse=20, coarsest=8):
+        """Initialize the multigrid pressure solver
+
+        Args:
+            boundary_condition: Object handling boundary conditions
+            dt: Time step size
+            dx: Grid cell size
+            tol: Relative residual |b - Ap| / |b| ending the solve
+            max_iter: Conjugate gradient iterations or V-cycles per solve at most
+            cg: Precondition a conjugate gradient with the V-cycle, else iterate V-cycles
+            n_pre, n_post: Red-black sweeps before and after the coarse correction
+            n_coarse: Symmetric Gauss-Seidel sweeps on the coarsest level
+            coarsest: Largest smaller side of the coarsest level
+        """
+        super().__init__(boundary_condition, dt, dx, tol, max_iter)
+
+        self.cg = cg
+        self.n_pre = n_pre
+        self.n_post = n_post
+        self.n_coarse = n_coarse
+
+        # Per level fields : cell types, solution, right-hand side, residual. Level 0 shares the
+        # fields of the conjugate gradient, the V-cycle turns the residual r into z, or alone
+        # improves the pressure p with the right-hand side b
+        self.masks = [self.mask]
+        self.xs = [self._z] if cg else [self._p]
+        self.bs = [self._r] if cg else [self._b]
+        self.rs = [self._q]
+        shape = self.mask.shape
+        while min(shape) > coarsest:
+            shape = ((shape[0] + 1) // 2, (shape[1] + 1) // 2)
+            self.masks.append(ti.field(ti.i32, shape=shape))
+            self.xs.append(ti.field(ti.f32, shape=shape))
+            self.bs.append(ti.field(ti.f32, shape=shape))
+            self.rs.append(ti.field(ti.f32, shape=shape))
+
+        self.build_masks()
+
+    def build_masks(self):
+        """Rebuild the cell types of every level, after a change of the boundary condition mask"""
+        super().build_masks()
+        for l in range(1, len(self.masks)):
+            self._coarsen_mask(self.masks[l - 1], self.masks[l])
+
+    def _solve(self, pc, vc):
+        if self.cg:
+            super()._solve(pc, vc)
+            return
+
+        self._rhs(vc, self._b)
+        self._load(pc, self._p)
+
+        bnorm = math.sqrt(self._dot(self._b, self._b))
+        self.iterations = 0
+        while True:
+            self._residual(self._p, self._b, self.mask, self._r)
+            self.residual = math.sqrt(self._dot(self._r, self._r)) / bnorm if bnorm > 0.0 else 0.0
+            if self.residual < self.tol or self.iterations == self.max_iter:
+                break
+            self.v_cycle(0)
+            self.iterations += 1
+
+        self._store(self._p, pc)
+
+    def _precondition(self):
+        # z = V-cycle approximation of A^-1 r, from 0
+        self._z.fill(0)
+        self.v_cycle(0)
+
+    def v_cycle(self, l):
+        x, b, mask = self.xs[l], self.bs[l], self.masks[l]
+
+        if l == len(self.xs) - 1:
+            self._coarse_solve(x, b, mask, self.n_coarse)
+            return
+
+        for _ in range(self.n_pre):
+            self._smooth(x, b, mask, 0)
+            self._smooth(x, b, mask, 1)
+
+        self._residual(x, b, mask, self.rs[l])
+        self._restrict(self.rs[l], mask, self.masks[l + 1], self.bs[l + 1])
+        self.xs[l + 1].fill(0)
+        self.v_cycle(l + 1)
+        self._prolong(self.xs[l + 1], self.masks[l + 1], mask, x)
+
+        for _ in range(self.n_post):
+            self._smooth(x, b, mask, 1)
+            self._smooth(x, b, mask, 0)
+
+    # - Kernels, every level is passed as template arguments
+
+    @ti.kernel
+    def _coarsen_mask(self, mf: ti.template(), mc: ti.template()):
+        for I, J in mc:
+            has_dirichlet = False
+            has_fluid = False
+            for a, c in ti.static(ti.ndrange(2, 2)):
+                i = 2 * I + a
+                j = 2 * J + c
+                if i < mf.shape[0] and j < mf.shape[1]:
+                    if mf[i, j] == POISSON_DIRICHLET:
+                        has_dirichlet = True
+                    elif mf[i, j] == POISSON_FLUID:
+                        has_fluid = True
+            if has_dirichlet:
+                mc[I, J] = POISSON_DIRICHLET
+            elif has_fluid:
+                mc[I, J] = POISSON_FLUID
+            else:
+                mc[I, J] = POISSON_NEUMANN
+
+    @ti.kernel
+    def _smooth(self, x: ti.template(), b: ti.template(), mask: ti.template(), color: int):
+        for i, j in x:
+            if (i + j) % 2 == color and mask[i, j] == POISSON_FLUID:
+                diag, nsum = masked_laplacian(x, mask, i, j)
+                if diag > 0.0:
+                    x[i, j] = (b[i, j] + nsum) / diag
+
+    @ti.func
+    def _gauss_seidel(self, x, b, mask, i, j):
+        if mask[i, j] == POISSON_FLUID:
+            diag, nsum = masked_laplacian(x, mask, i, j)
+            if diag > 0.0:
+                x[i, j] = (b[i, j] + nsum) / diag
+
+    @ti.kernel
+    def _coarse_solve(self, x: ti.template(), b: ti.template(), mask: ti.template(), sweeps: int):
+        # Forward then backward lexicographic sweeps : symmetric, as the preconditioner must be
+        ti.loop_config(serialize=True)
+        for _ in range(sweeps):
+            for i in range(x.shape[0]):
+                for j in range(x.shape[1]):
+                    self._gauss_seidel(x, b, mask, i, j)
+            for i in range(x.shape[0]):
+                for j in range(x.shape[1]):
+                    self._gauss_seidel(x, b, mask, x.shape[0] - 1 - i, x.shape[1] - 1 - j)
+
+    @ti.func
+    def _coarse_cell(self, mc, I, J, I0, J0):
+        # Coarse cell whose value (I, J) takes, seen from the fluid cell (I0, J0) : out of the
+        # grid or Neumann copies (I0, J0), Dirichlet is 0 and has no cell (-1)
+        K = ti.Vector([I0, J0])
+        if 0 <= I < mc.shape[0] and 0 <= J < mc.shape[1]:
+            if mc[I, J] == POISSON_FLUID:
+                K = ti.Vector([I, J])
+            elif mc[I, J] == POISSON_DIRICHLET:
+                K = ti.Vector([-1, -1])
+        return K
+
+    @ti.func
+    def _coarse_value(self, xc, mc, I, J, I0, J0):
+        K = self._coarse_cell(mc, I, J, I0, J0)
+        v = 0.0
+        if K[0] >= 0:
+            v = xc[K[0], K[1]]
+        return v
+
+    @ti.func
+    def _redirected(self, mc, i, j):
+        # Weight of the bilinear neighbors of fine cell (i, j) which read its parent coarse cell
+        I = i // 2
+        J = j // 2
+        I2 = I + (1 if i % 2 == 1 else -1)
+        J2 = J + (1 if j % 2 == 1 else -1)
+        w = 0.0
+        if self._coarse_cell(mc, I2, J, I, J)[0] == I:
+            w += 0.1875
+        if self._coarse_cell(mc, I, J2, I, J)[1] == J:
+            w += 0.1875
+        K = self._coarse_cell(mc, I2, J2, I, J)
+        if K[0] == I and K[1] == J:
+            w += 0.0625
+        return w
+
+    @ti.kernel
+    def _restrict(self, rf: ti.template(), mf: ti.template(), mc: ti.template(), bc: ti.template()):
+        # Transpose of _prolong : fine cell 2I + a, a in [-1, 2], weighs 3/4 on I for a in {0, 1},
+        # 1/4 otherwise, plus the weights redirected to its parent when a in {0, 1}
+        for I, J in bc:
+            s = 0.0
+            if mc[I, J] == POISSON_FLUID:
+                for a, c in ti.static(ti.ndrange(4, 4)):
+                    i = 2 * I - 1 + a
+                    j = 2 * J - 1 + c
+                    if 0 <= i < rf.shape[0] and 0 <= j < rf.shape[1] and mf[i, j] == POISSON_FLUID:
+                        wx = 0.75 if ti.static(a == 1 or a == 2) else 0.25
+                        wy = 0.75 if ti.static(c == 1 or c == 2) else 0.25
+                        w = wx * wy
+                        if ti.static((a == 1 or a == 2) and (c == 1 or c == 2)):
+                            w += self._redirected(mc, i, j)
+                        elif mc[i // 2, j // 2] != POISSON_FLUID:
+                            w = 0.0
+                        s += w * rf[i, j]
+            bc[I, J] = s
+
+    @ti.kernel
+    def _prolong(self, xc: ti.template(), mc: ti.template(), mf: ti.template(), xf: ti.template()):
+        # Bilinear, fine cell i lies between coarse cells i // 2 (3/4) and its neighbor on the
+        # side of i (1/4). Fine fluid cells of a Dirichlet coarse cell get no correction
+        for i, j in xf:
+            I = i // 2
+            J = j // 2
+            if mf[i, j] == POISSON_FLUID and mc[I, J] == POISSON_FLUID:
+                I2 = I + (1 if i % 2 == 1 else -1)
+                J2 = J + (1 if j % 2 == 1 else -1)
+                xf[i, j] += (
+                    0.5625 * xc[I, J]
+                    + 0.1875 * self._coarse_value(xc, mc, I2, J, I, J)
+                    + 0.1875 * self._coarse_value(xc, mc, I, J2, I, J)
+                    + 0.0625 * self._coarse_value(xc, mc, I2, J2, I, J)
+                )
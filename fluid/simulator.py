@@ -0,0 +1,273 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import taichi as ti
+
+from fluid.boundary import create_boundary_condition
+from fluid.multigrid import MultigridPressureUpdater
+from fluid.pcg import PcgPressureUpdater
+from fluid.pressure import JacobiPressureUpdater, RedBlackSorPressureUpdater
+from fluid.solvers import CipMacSolver, MacSolver, VorticityConfinement
+from fluid.stencils import advect_kk_scheme, visualize_norm, visualize_pressure, visualize_vorticity
+
+# - Simple fluid simulator, after https://github.com/takah29/2d-fluid-simulator
+#
+# - Pressure with Jacobi Iterations, the Red-Black SOR Method, or multigrid and preconditioned
+#   conjugate gradients to a tolerance
+# - Vorticity confinement
+# - Advection with the Kawamura-Kuwabara or the CIP method
+#
+# The driver feeds update() with impulses : MouseDataGen in the GUI below, InflowDataGen
+# for scripted runs without a window (benchmarks/bench_fluid.py).
+
+# - External actions
+
+class MouseDataGen:
+    def __init__(self, res):
+        self.res = res
+        self.prev_mouse = None
+        self.prev_color = None
+
+    def __call__(self, gui):
+        # [0:2]: normalized delta direction
+        # [2:4]: current mouse xy
+        # [4:7]: color
+        mouse_data = np.zeros(8, dtype=np.float32)
+        if gui.is_pressed(ti.GUI.LMB):
+            mxy = np.array(gui.get_cursor_pos(), dtype=np.float32) * self.res
+            if self.prev_mouse is None:
+                self.prev_mouse = mxy
+                # Set lower bound to 0.3 to prevent too dark colors
+                self.prev_color = (np.random.rand(3) * 0.7) + 0.3
+            else:
+                mdir = mxy - self.prev_mouse
+                mdir = mdir / (np.linalg.norm(mdir) + 1e-5)
+                mouse_data[0], mouse_data[1] = mdir[0], mdir[1]
+                mouse_data[2], mouse_data[3] = mxy[0], mxy[1]
+                mouse_data[4:7] = self.prev_color
+                self.prev_mouse = mxy
+        else:
+            self.prev_mouse = None
+            self.prev_color = None
+        return mouse_data
+
+class InflowDataGen:
+    """Synthetic stand-in for the mouse : a jet pushing along +x behind the inflow,
+    sweeping up and down the channel, the same at every run."""
+
+    def __init__(self, res, period=400, amplitude=0.25, x=0.1):
+        self.res = res
+        self.period = period        # steps per sweep
+        self.amplitude = amplitude  # fraction of the channel height
+        self.x = x                  # fraction of the channel length
+
+    def __call__(self, step):
+        data = np.zeros(8, dtype=np.float32)
+        data[0] = 1.0
+        data[2] = self.x * self.res
+        data[3] = self.res * (0.5 + self.amplitude * np.sin(2.0 * np.pi * step / self.period))
+        data[4:7] = 1.0
+        return data
+
+# - Fluid Simulator
+
+@ti.data_oriented
+class FluidSimulator:
+    def __init__(self, solver):
+        self._solver = solver
+        self.rgb_buf = ti.Vector.field(3, ti.f32, shape=solver._resolution)  # image buffer
+        self._wall_color = ti.Vector([0.5, 0.7, 0.5])
+
+    def step(self, impulse=None):
+        self._solver.update(impulse)
+
+    def get_norm_field(self):
+        self._to_norm(self.rgb_buf, *self._solver.get_fields()[:2])
+        return self.rgb_buf
+
+    def get_pressure_field(self):
+        self._to_pressure(self.rgb_buf, self._solver.get_fields()[1])
+        return self.rgb_buf
+
+    def get_vorticity_field(self):
+        self._to_vorticity(self.rgb_buf, self._solver.get_fields()[0])
+        return self.rgb_buf
+
+    def field_to_numpy(self):
+        fields = self._solver.get_fields()
+        return {"v": fields[0].to_numpy(), "p": fields[1].to_numpy()}
+
+    @ti.kernel
+    def _to_norm(self, rgb_buf: ti.template(), vc: ti.template(), pc: ti.template()):
+        for i, j in rgb_buf:
+            rgb_buf[i, j] = 0.2 * visualize_norm(vc[i, j])
+            rgb_buf[i, j] += 0.002 * visualize_pressure(pc[i, j])
+            if self._solver.is_wall(i, j):
+                rgb_buf[i, j] = self._wall_color
+
+    @ti.kernel
+    def _to_pressure(self, rgb_buf: ti.template(), pc: ti.template()):
+        for i, j in rgb_buf:
+            rgb_buf[i, j] = 0.04 * visualize_pressure(pc[i, j])
+            if self._solver.is_wall(i, j):
+                rgb_buf[i, j] = self._wall_color
+
+    @ti.kernel
+    def _to_vorticity(self, rgb_buf: ti.template(), vc: ti.template()):
+        for i, j in rgb_buf:
+            rgb_buf[i, j] = 0.005 * visualize_vorticity(vc, i, j, self._solver.dx)
+            if self._solver.is_wall(i, j):
+                rgb_buf[i, j] = self._wall_color
+
+    @staticmethod
+    def create(num, resolution, dt, dx, re, vor_eps, inflow, outflow,
+               solver="cip", pressure="sor", n_iter=2, relaxation_factor=1.3, tol=None, max_iter=None,
+               preconditioner="mic0", check_every=4, adapt=False):
+        """
+        Args:
+            solver: "cip" (CipMacSolver) or "mac" (MacSolver, Kawamura-Kuwabara advection)
+            pressure: "sor" (RedBlackSorPressureUpdater), "jacobi" (JacobiPressureUpdater)
+                "multigrid" (MultigridPressureUpdater) or "pcg" (PcgPressureUpdater)
+            n_iter: Iterations of the sor and jacobi pressure updaters per step at most
+            tol: Relative residual ending the pressure solve, None for the default of the
+                updater : 1e-4 for multigrid and pcg, always n_iter iterations for sor and jacobi
+            max_iter: Iterations of the multigrid and pcg solves at most, None for their default
+            preconditioner: "mic0" or "jacobi", for pcg
+            check_every: Iterations between two residual checks of sor and jacobi, with tol
+            adapt: Tune the sor relaxation factor from the convergence rate, with tol
+        """
+        boundary_condition = create_boundary_condition(resolution, inflow, outflow)
+        vorticity_confinement = (
+            VorticityConfinement(boundary_condition, dt, dx, vor_eps)
+            if vor_eps is not None
+            else None
+        )
+
+        limit = {} if max_iter is None else {"max_iter": max_iter}
+        if tol is not None:
+            limit["tol"] = tol
+        if pressure == "sor":
+            pressure_updater = RedBlackSorPressureUpdater(
+                boundary_condition, dt, dx, relaxation_factor=relaxation_factor, n_iter=n_iter,
+                tol=tol, check_every=check_every, adapt=adapt
+            )
+        elif pressure == "jacobi":
+            pressure_updater = JacobiPressureUpdater(
+                boundary_condition, dt, dx, n_iter=n_iter, tol=tol, check_every=check_every
+            )
+        elif pressure == "multigrid":
+            pressure_updater = MultigridPressureUpdater(boundary_condition, dt, dx, **limit)
+        elif pressure == "pcg":
+            pressure_updater = PcgPressureUpdater(
+                boundary_condition, dt, dx, preconditioner=preconditioner, **limit
+            )
+        else:
+            raise ValueError("Unknown pressure updater : " + str(pressure))
+
+        if solver == "mac":
+            fluid_solver = MacSolver(
+                boundary_condition,
+                pressure_updater,
+                advect_kk_scheme,
+                dt,
+                dx,
+                re,
+                vorticity_confinement,
+            )
+        elif solver == "cip":
+            fluid_solver = CipMacSolver(
+                boundary_condition,
+                pressure_updater,
+                dt,
+                dx,
+                re,
+                vorticity_confinement,
+            )
+        else:
+            raise ValueError("Unknown solver : " + str(solver))
+
+        return FluidSimulator(fluid_solver)
+
+# - Main function
+
+res = 400
+dt = 0.0005
+Re = 1000
+dx = 1 / res
+
+def main():
+
+    ti.init(arch=ti.gpu, kernel_profiler=True)
+
+    n_bc = 1     # Boundary condition
+    vor_eps = 50.0  # Weight of the vorticity
+    n_vis = 3
+    vis_num = 2    # Visualisation parameter
+    inflow = 10.0
+    outflow = 10.0
+
+    window = ti.GUI("Fluid Simulation", (res, res))
+
+    print("Generation of the simulator")
+    fluid_sim = FluidSimulator.create(n_bc, res, dt, dx, Re, vor_eps, inflow, outflow)
+
+    output_path = Path(os.getcwd()).resolve() / "output"
+
+    md_gen = MouseDataGen(res)
+
+    step = 0
+    ss_count = 0
+    paused = False
+    print("Loop started")
+
+    while window.running:
+
+        ti.profiler.clear_kernel_profiler_info()
+
+        if step % 5 == 0:
+            if vis_num == 0:
+                img = fluid_sim.get_norm_field()
+            elif vis_num == 1:
+                img = fluid_sim.get_pressure_field()
+            elif vis_num == 2:
+                img = fluid_sim.get_vorticity_field()
+            else:
+                raise NotImplementedError()
+
+            window.set_image(img)
+            window.show()
+
+        if not paused:
+            mouse_data = md_gen(window)
+            fluid_sim.step(mouse_data)
+
+        if window.get_event(ti.GUI.PRESS):
+            e = window.event
+            if e.key == ti.GUI.ESCAPE:
+                break
+            elif e.key == "p":
+                print("paused")
+                paused = not paused
+            elif e.key == "v":
+                vis_num = (vis_num + 1) % n_vis
+            elif e.key == "s":
+                print("saved")
+                output_path.mkdir(exist_ok=True)
+                ti.tools.imwrite(img, str(output_path / f"{ss_count:04}.png"))
+                ss_count += 1
+            elif e.key == "d":
+                output_path.mkdir(exist_ok=True)
+                fields = fluid_sim.field_to_numpy()
+                np.savez(str(output_path / f"step_{step:06}.npz"), **fields)
+
+        step += 1
+
+    window.close()
+
+    ti.profiler.print_kernel_profiler_info('trace')
+
+
+if __name__ == "__main__":
+
+    main()
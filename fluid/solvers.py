@@ -0,0 +1,457 @@
+import time
+from abc import ABCMeta, abstractmethod
+
+import taichi as ti
+
+from datastructs.fields import DoubleBuffers
+from fluid.stencils import diff2_x, diff2_y, diff_x, diff_y, sample, sign
+
+VELOCITY_LIMIT = 10
+
+# - Vorticity confinement
+
+@ti.data_oriented
+class VorticityConfinement:
+    """
+    Class implementing vorticity confinement technique to preserve fluid vortices
+    that might be lost due to numerical dissipation in fluid simulations.
+    """
+    def __init__(self, boundary_condition, dt, dx, weight):
+        """
+        Initialize the vorticity confinement solver.
+
+        Args:
+            boundary_condition: Object defining the fluid domain boundaries
+            dt: Time step size
+            dx: Grid cell size
+            weight: Strength of the vorticity confinement effect
+        """
+        self._bc = boundary_condition
+        self.dt = dt
+        self.dx = dx
+        self.weight = weight
+
+        self._resolution = boundary_condition.get_resolution()
+
+        # Fields to store vorticity and its absolute value
+        self.vorticity = ti.field(ti.f32, shape=self._resolution)
+        self.vorticity_abs = ti.field(ti.f32, shape=self._resolution)
+
+    @ti.kernel
+    def _calc_vorticity(self, vc: ti.template()):
+        """
+        Calculate the vorticity field from the velocity field.
+
+        Args:
+            vc: Current velocity field
+        """
+        for i, j in self.vorticity:
+            if self._bc.is_fluid_domain(i, j):
+                # Vorticity is defined as the curl of velocity (∇ × v)
+                # In 2D, this is just (∂v_y/∂x - ∂v_x/∂y)
+                self.vorticity[i, j] = diff_x(vc, i, j, self.dx).y - diff_y(vc, i, j, self.dx).x
+                self.vorticity_abs[i, j] = ti.abs(self.vorticity[i, j])
+
+    @ti.kernel
+    def _add_vorticity(
+        self,
+        vn: ti.template(),
+        vc: ti.template(),
+    ):
+        """
+        Apply vorticity confinement forces to the velocity field.
+
+        Args:
+            vn: Next velocity field (output)
+            vc: Current velocity field (input)
+        """
+        for i, j in vn:
+            if self._bc.is_fluid_domain(i, j):
+                # Add vorticity confinement force to the current velocity
+                vn[i, j] = vc[i, j] + self.dt * self.weight * self._vorticity_vec(i, j)
+
+    @ti.func
+    def _vorticity_vec(self, i, j):
+        """
+        Calculate the vorticity confinement force vector at position (i,j).
+
+        Args:
+            i, j: Grid position
+
+        Returns:
+            Vector representing the vorticity confinement force
+        """
+        # Calculate gradient of vorticity magnitude
+        vorticity_grad_vec = ti.Vector(
+            [diff_x(self.vorticity_abs, i, j, self.dx), diff_y(self.vorticity_abs, i, j, self.dx)]
+        )
+        # Normalize the gradient vector
+        vorticity_grad_vec = vorticity_grad_vec / vorticity_grad_vec.norm()
+
+        # Calculate force vector: N × ω where N is the normalized gradient and ω is vorticity
+        # The cross product in 2D becomes (N.y, -N.x) * vorticity
+        vorticity_vec = (
+            ti.Vector([vorticity_grad_vec.y, -vorticity_grad_vec.x]) * self.vorticity[i, j]
+        )
+
+        # Clamp the force vector to prevent numerical instability
+        return ti.max(ti.min(vorticity_vec, 0.1), -0.1)
+
+    def apply(self, v):
+        """
+        Apply vorticity confinement to the velocity field.
+
+        Args:
+            v: Velocity field object with current and next states
+        """
+        self._calc_vorticity(v.current)
+        self._add_vorticity(v.next, v.current)  # Only update v.next
+
+# - External actions
+
+@ti.kernel
+def apply_impulse(vf: ti.template(), imp_data: ti.types.ndarray(), dt: ti.f32):
+    """Add a gaussian push around imp_data[2:4] in the direction imp_data[0:2]
+
+    imp_data is the 8 floats of MouseDataGen or InflowDataGen.
+    """
+
+    force_radius = 20.0
+    f_strength = 10.0
+
+    for i, j in vf:
+        omx, omy = imp_data[2], imp_data[3]
+        mdir = ti.Vector([imp_data[0], imp_data[1]])
+        dx, dy = (i + 0.5 - omx), (j + 0.5 - omy)
+        d2 = dx * dx + dy * dy
+        # dv = F * dt
+        factor = ti.exp(-d2 / force_radius)
+
+        momentum = (mdir * f_strength * factor) * dt
+
+        v = vf[i, j]
+        vf[i, j] = v + momentum
+
+@ti.kernel
+def limit_field(field: ti.template(), limit: ti.f32):
+    for i, j in field:
+        norm = field[i, j].norm()
+        if norm > limit:
+            field[i, j] = limit * (field[i, j] / norm)
+
+
+@ti.kernel
+def clamp_field(field: ti.template(), low: ti.f32, high: ti.f32):
+    for i, j in field:
+        field[i, j] = ti.min(ti.max(field[i, j], low), high)
+
+# - Solvers
+#
+# update(impulse) advances one step, impulse is None or the 8 floats of apply_impulse.
+# With profile set, the wall time of each step is charged to timings :
+#   advection : velocity update, vorticity confinement, impulse and velocity limit
+#   pressure  : the pressure updater, without its boundary condition calls
+#   bc        : every boundary condition kernel
+
+@ti.data_oriented
+class Solver(metaclass=ABCMeta):
+    def __init__(self, boundary_condition):
+        self._bc = boundary_condition
+        self._resolution = boundary_condition.get_resolution()
+
+        self.profile = False
+        self.timings = {"advection": 0.0, "pressure": 0.0, "bc": 0.0}
+        self.nsteps = 0
+        self._t0 = 0.0
+        self._bc0 = 0.0
+
+    @abstractmethod
+    def update(self, impulse=None):
+        pass
+
+    @abstractmethod
+    def get_fields(self):
+        pass
+
+    @ti.func
+    def is_wall(self, i, j):
+        return self._bc.is_wall(i, j)
+
+    @ti.func
+    def is_fluid_domain(self, i, j):
+        return self._bc.is_fluid_domain(i, j)
+
+    def reset_timings(self):
+        for name in self.timings:
+            self.timings[name] = 0.0
+        self.nsteps = 0
+
+    def _start(self):
+        self._bc.profile = self.profile
+        if self.profile:
+            ti.sync()
+            self._t0 = time.perf_counter()
+            self._bc0 = self._bc.elapsed
+
+    def _tick(self, stage): # Charge the time since the last tick to stage, the boundary kernels to bc
+        if self.profile:
+            ti.sync()
+            now = time.perf_counter()
+            bc = self._bc.elapsed - self._bc0
+            self.timings[stage] += now - self._t0 - bc
+            self.timings["bc"] += bc
+            self._t0 = now
+            self._bc0 = self._bc.elapsed
+
+@ti.data_oriented
+class MacSolver(Solver):
+    """Maker And Cell method"""
+
+    def __init__(
+        self,
+        boundary_condition,
+        pressure_updater,
+        advect_function,
+        dt,
+        dx,
+        Re,
+        vorticity_confinement=None,
+    ):
+        super().__init__(boundary_condition)
+
+        self._advect = advect_function
+        self.dt = dt
+        self.dx = dx
+        self.Re = Re
+
+        self.pressure_updater = pressure_updater
+        self.vorticity_confinement = vorticity_confinement
+
+        self.v = DoubleBuffers(self._resolution, 2)  # velocity
+        self.p = DoubleBuffers(self._resolution, 1)  # pressure
+
+    def update(self, impulse=None):
+
+        self._start()
+        self._bc.set_velocity_boundary_condition(self.v.current)
+        self._update_velocities(self.v.next, self.v.current, self.p.current)
+
+        self.v.swap()
+
+        if self.vorticity_confinement is not None:
+            self.vorticity_confinement.apply(self.v)
+            self.v.swap()
+        if impulse is not None:
+            apply_impulse(self.v.current, impulse, self.dt)
+        self._tick("advection")
+
+        self.pressure_updater.update(self.p, self.v.current)
+        self._tick("pressure")
+
+        limit_field(self.v.current, VELOCITY_LIMIT)
+        self._tick("advection")
+        self.nsteps += 1
+
+    def get_fields(self):
+        return self.v.current, self.p.current
+
+    # Application of the Navier-Stoke Equation
+    @ti.kernel
+    def _update_velocities(self, vn: ti.template(), vc: ti.template(), pc: ti.template()):
+        for i, j in vn:
+            if self.is_fluid_domain(i, j):
+                vn[i, j] = vc[i, j] + self.dt * (
+                    -self._advect(vc, vc, i, j, self.dx)
+                    - ti.Vector(
+                        [
+                            diff_x(pc, i, j, self.dx),
+                            diff_y(pc, i, j, self.dx),
+                        ]
+                    )
+                    + (diff2_x(vc, i, j, self.dx) + diff2_y(vc, i, j, self.dx)) / self.Re
+                )
+
+# CipMac Solver
+#
+# We calculate for each point of the grid :
+#   K1 = F[i,j] - F[im,j] - F[i,jm] + F[im,jm]
+#   K2 = F[im,j] - F[i,j]
+#   K3 = F[i,jm] - F[i,j]
+# and the coefficients a .. g of the cubic interpolation polynomial, see _cip_advect.
+
+@ti.data_oriented
+class CipMacSolver(Solver):
+    """Maker And Cell method"""
+
+    def __init__(
+        self, boundary_condition, pressure_updater, dt, dx, Re, vorticity_confinement=None
+    ):
+        super().__init__(boundary_condition)
+        self.dt = dt
+        self.dx = dx
+        self.Re = Re
+
+        self.pressure_updater = pressure_updater
+        self.vorticity_confinement = vorticity_confinement
+
+        self.v = DoubleBuffers(self._resolution, 2)  # velocity
+        self.vx = DoubleBuffers(self._resolution, 2)  # velocity gradient x
+        self.vy = DoubleBuffers(self._resolution, 2)  # velocity gradient y
+        self.p = DoubleBuffers(self._resolution, 1)  # pressure
+
+        self._set_grad(self.vx.current, self.vy.current, self.v.current)
+
+    def update(self, impulse=None):
+
+        self._start()
+        if impulse is not None:
+            apply_impulse(self.v.current, impulse, self.dt)
+        self._bc.set_velocity_boundary_condition(self.v.current)
+        self._update_velocities(self.v, self.vx, self.vy, self.p)
+
+        if self.vorticity_confinement is not None:
+            self.vorticity_confinement.apply(self.v)
+            self.v.swap()
+        self._tick("advection")
+
+        self.pressure_updater.update(self.p, self.v.current)
+        self._tick("pressure")
+
+        limit_field(self.v.current, VELOCITY_LIMIT)
+        self._tick("advection")
+        self.nsteps += 1
+
+    def get_fields(self):
+        return self.v.current, self.p.current
+
+    @ti.kernel
+    def _set_grad(self, fx: ti.template(), fy: ti.template(), f: ti.template()):
+        for i, j in fx:
+            fx[i, j] = diff_x(f, i, j, self.dx)
+            fy[i, j] = diff_y(f, i, j, self.dx)
+
+    def _update_velocities(self, v, vx, vy, p):
+        self._non_advection_phase(v.next, v.current, p.current)
+        self._non_advection_phase_grad(vx.next, vy.next, vx.current, vy.current, v.current, v.next)
+        v.swap()
+        vx.swap()
+        vy.swap()
+
+        self._advection_phase(
+            v.next, vx.next, vy.next, v.current, vx.current, vy.current, v.current
+        )
+        v.swap()
+        vx.swap()
+        vy.swap()
+
+    @ti.kernel
+    def _non_advection_phase(
+        self,
+        fn: ti.template(),
+        fc: ti.template(),
+        pc: ti.template(),
+    ):
+        """中間量の計算"""
+        for i, j in fn:
+            if not self.is_wall(i, j):
+                G = -ti.Vector(
+                    [
+                        diff_x(pc, i, j, self.dx),
+                        diff_y(pc, i, j, self.dx),
+                    ]
+                ) + self._calc_diffusion(fc, i, j)
+                fn[i, j] = fc[i, j] + G * self.dt
+
+    @ti.kernel
+    def _non_advection_phase_grad(
+        self,
+        fxn: ti.template(),
+        fyn: ti.template(),
+        fxc: ti.template(),
+        fyc: ti.template(),
+        fc: ti.template(),
+        fn: ti.template(),
+    ):
+        """中間量の勾配の計算"""
+        for i, j in fn:
+            if not self.is_wall(i, j):
+                # 勾配の更新
+                fxn[i, j] = fxc[i, j] + (
+                    sample(fn, i + 1, j) - sample(fc, i + 1, j) - sample(fn, i - 1, j) + sample(fc, i - 1, j)
+                ) / (2.0 * self.dx)
+                fyn[i, j] = fyc[i, j] + (
+                    sample(fn, i, j + 1) - sample(fc, i, j + 1) - sample(fn, i, j - 1) + sample(fc, i, j - 1)
+                ) / (2.0 * self.dx)
+
+    @ti.func
+    def _calc_diffusion(self, fc, i, j):
+        return (diff2_x(fc, i, j, self.dx) + diff2_y(fc, i, j, self.dx)) / self.Re
+
+    @ti.kernel
+    def _advection_phase(
+        self,
+        fn: ti.template(),  # Output field after advection
+        fxn: ti.template(), # Output x-gradient field after advection
+        fyn: ti.template(), # Output y-gradient field after advection
+        fc: ti.template(),  # Current field values
+        fxc: ti.template(), # Current x-gradient field values
+        fyc: ti.template(), # Current y-gradient field values
+        v: ti.template(),   # Velocity field
+    ):
+        # Iterate through all cells in the field
+        for i, j in fn:
+            # Only process fluid cells
+            if self.is_fluid_domain(i, j):
+                self._cip_advect(fn, fxn, fyn, fc, fxc, fyc, v, i, j)
+
+    @ti.func
+    def _cip_advect(self, fn, fxn, fyn, fc, fxc, fyc, v, i, j):
+        # Determine direction of flow (positive or negative in x and y)
+        i_s = int(sign(v[i, j].x))  # Sign of x velocity component
+        j_s = int(sign(v[i, j].y))  # Sign of y velocity component
+        i_m = i - i_s  # Upwind cell index in x direction
+        j_m = j - j_s  # Upwind cell index in y direction
+
+        # Calculate intermediate values for CIP coefficients
+        tmp1 = fc[i, j] - fc[i, j_m] - fc[i_m, j] + fc[i_m, j_m]  # Mixed second derivative approximation
+        tmp2 = fc[i_m, j] - fc[i, j]  # First derivative in x direction
+        tmp3 = fc[i, j_m] - fc[i, j]  # First derivative in y direction
+
+        # Denominators for coefficient calculations
+        i_s_denom = i_s * self.dx**3
+        j_s_denom = j_s * self.dx**3
+
+        # Calculate CIP interpolation coefficients (a through g)
+        # These coefficients define the cubic interpolation polynomial
+        a = (i_s * (fxc[i_m, j] + fxc[i, j]) * self.dx - 2.0 * (-tmp2)) / i_s_denom
+        b = (j_s * (fyc[i, j_m] + fyc[i, j]) * self.dx - 2.0 * (-tmp3)) / j_s_denom
+        c = (-tmp1 - i_s * (fxc[i, j_m] - fxc[i, j]) * self.dx) / j_s_denom
+        d = (-tmp1 - j_s * (fyc[i_m, j] - fyc[i, j]) * self.dx) / i_s_denom
+        e = (3.0 * tmp2 + i_s * (fxc[i_m, j] + 2.0 * fxc[i, j]) * self.dx) / self.dx**2
+        f = (3.0 * tmp3 + j_s * (fyc[i, j_m] + 2.0 * fyc[i, j]) * self.dx) / self.dx**2
+        g = (-(fyc[i_m, j] - fyc[i, j]) + c * self.dx**2) / (i_s * self.dx)
+
+        # Calculate displacement based on velocity and timestep
+        X = -v[i, j].x * self.dt  # Displacement in x direction
+        Y = -v[i, j].y * self.dt  # Displacement in y direction
+
+        # Update field value using CIP interpolation
+        # This evaluates the cubic polynomial at position (X,Y)
+        fn[i, j] = (
+            ((a * X + c * Y + e) * X + g * Y + fxc[i, j]) * X
+            + ((b * Y + d * X + f) * Y + fyc[i, j]) * Y
+            + fc[i, j]
+        )
+
+        # Update gradient values
+        # Calculate derivatives of the interpolation polynomial at (X,Y)
+        Fx = (3.0 * a * X + 2.0 * c * Y + 2.0 * e) * X + (d * Y + g) * Y + fxc[i, j]
+        Fy = (3.0 * b * Y + 2.0 * d * X + 2.0 * f) * Y + (c * X + g) * X + fyc[i, j]
+
+        # Calculate velocity gradients
+        dx = diff_x(v, i, j, self.dx)  # Velocity gradient in x direction
+        dy = diff_y(v, i, j, self.dx)  # Velocity gradient in y direction
+
+        # Apply correction for gradient advection (accounts for deformation of the flow)
+        fxn[i, j] = Fx - self.dt * (Fx * dx.x + Fy * dx.y) / 2.0
+        fyn[i, j] = Fy - self.dt * (Fx * dy.x + Fy * dy.y) / 2.0
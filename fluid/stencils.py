@@ -0,0 +1,179 @@
+from math import e, pi
+
+import taichi as ti
+
+# - Finite differences on the grid of the fluid solvers, and visualisation functions
+#
+# Advection equation : v.phi = v_x * dphi/dx + v_y * dphi/dy
+
+# Give the value of a cell from a position
+@ti.func
+def sample(field, i, j):
+    i = ti.max(0, ti.min(field.shape[0] - 1, i))
+    j = ti.max(0, ti.min(field.shape[1] - 1, j))
+    idx = ti.Vector([int(i), int(j)])
+    return field[idx]
+
+@ti.func
+def sign(x):
+    return -1.0 if x < 0.0 else 1.0
+
+@ti.func
+def diff_x(field, i, j, dx):
+    """Central Difference x"""
+    return 0.5 * (sample(field, i + 1, j) - sample(field, i - 1, j)) / dx
+
+@ti.func
+def diff_y(field, i, j, dx):
+    """Central Difference y"""
+    return 0.5 * (sample(field, i, j + 1) - sample(field, i, j - 1)) / dx
+
+@ti.func
+def diff2_x(field, i, j, dx):
+    return (sample(field, i + 1, j) - 2.0 * sample(field, i, j) + sample(field, i - 1, j)) / dx**2
+
+
+@ti.func
+def diff2_y(field, i, j, dx):
+    return (sample(field, i, j + 1) - 2.0 * sample(field, i, j) + sample(field, i, j - 1)) / dx**2
+
+@ti.func
+def advect(vc, phi, i, j, dx):
+    """Central Differencing"""
+    return vc[i, j].x * diff_x(phi, i, j, dx) + vc[i, j].y * diff_y(phi, i, j, dx)
+
+@ti.func
+def advect_kk_scheme(vc, phi, i, j, dx):
+    """Kawamura-Kuwabara Scheme
+
+    http://www.slis.tsukuba.ac.jp/~fujisawa.makoto.fu/cgi-bin/wiki/index.php?%B0%DC%CE%AE%CB%A1#y2dbc484
+    """
+    coef = [-2, 10, -9, 2, -1]
+    v = ti.Vector([0.0, 0.0, 0.0, 0.0, 0.0])
+
+    if vc[i, j].x < 0:
+        v = ti.Vector(coef)
+    else:
+        v = -ti.Vector(coef[::-1])
+
+    mx = ti.Matrix.cols(
+        [
+            sample(phi, i + 2, j),
+            sample(phi, i + 1, j),
+            sample(phi, i, j),
+            sample(phi, i - 1, j),
+            sample(phi, i - 2, j),
+        ]
+    )
+    a = mx @ v / (6 * dx)
+
+    if vc[i, j].y < 0:
+        v = ti.Vector(coef)
+    else:
+        v = -ti.Vector(coef[::-1])
+
+    my = ti.Matrix.cols(
+        [
+            sample(phi, i, j + 2),
+            sample(phi, i, j + 1),
+            sample(phi, i, j),
+            sample(phi, i, j - 1),
+            sample(phi, i, j - 2),
+        ]
+    )
+    b = my @ v / (6 * dx)
+
+    return vc[i, j].x * a + vc[i, j].y * b
+
+# Visualisation functions
+
+@ti.func
+def visualize_norm(vec):
+    c = vec.norm()
+    return ti.Vector([c, c, c])
+
+
+@ti.func
+def visualize_pressure(val):
+    return ti.Vector([ti.max(val, 0.0), 0.0, ti.max(-val, 0.0)])
+
+
+@ti.func
+def visualize_vorticity(v, i, j, dx):
+    val = diff_x(v, i, j, dx).y - diff_y(v, i, j, dx).x
+    return ti.Vector([ti.max(val, 0.0), 0.0, ti.max(-val, 0.0)])
+
+
+@ti.func
+def visualize_hue(vec):
+    h = ti.atan2(vec.y, vec.x)
+
+    while h < 0:
+        h += 2 * pi
+    h /= 2 * pi
+
+    m = ti.sqrt(vec.x**2 + vec.y**2)
+    ranges = 0.0
+    rangee = 10.0
+
+    while m > rangee:
+        ranges = rangee
+        rangee *= e
+
+    k = (m - ranges) / (rangee - ranges)
+    s = k * 2 if k < 0.5 else 1 - (k - 0.5) * 2
+    s = 1 - pow(1 - s, 3)
+    s = 0.4 + s * 0.6
+
+    v = k * 2 if k < 0.5 else 1 - (k - 0.5) * 2
+    v = 1 - v
+    v = 1 - pow(1 - v, 3)
+    v = 0.6 + v * 0.4
+
+    return _hsv_to_rgb(h, s, v)
+
+
+@ti.func
+def visualize_xy(vec):
+    return ti.Vector([vec.y, 0.0, vec.x])
+
+
+@ti.func
+def _hsv_to_rgb(h: float, s: float, v: float):
+    if h == 1:
+        h = 0
+    z = ti.floor(h * 6)
+    i = int(z)
+    f = float(h * 6 - z)
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+
+    r = g = b = 1.0
+
+    if i == 0:
+        r = v
+        g = t
+        b = p
+    elif i == 1:
+        r = q
+        g = v
+        b = p
+    elif i == 2:
+        r = p
+        g = v
+        b = t
+    elif i == 3:
+        r = p
+        g = q
+        b = v
+    elif i == 4:
+        r = t
+        g = p
+        b = v
+    elif i == 5:
+        r = v
+        g = p
+        b = q
+
+    return ti.Vector([r, g, b])
@@ -2,7 +2,14 @@ import taichi as ti
 import numpy as np
 import time
 
-ti.init(arch=ti.gpu)
+from concepts.bonded import Bonded_forces, sort_range
+from concepts.pairs import Pair_forces
+from concepts.periodic_bound import wrap, min_image, wrap_cell
+from concepts.potentials import Pair_table, make_potential
+from concepts.scan import exclusive_scan
+from datastructs.cell_reg import Cell_reg, hashToCell2d_ti, cellToHash2d_ti
+from datastructs.checkpoint import save_checkpoint, load_checkpoint
+from datastructs.trajectory import Trajectory_writer
 
 # - Screen parameters
 
@@ -19,7 +26,7 @@ boundary_color = 0xEBACA2
 particle_radius = 5.0
 particle_radius_in_world = particle_radius / screen_to_world_ratio
 
-# - Simulations primal parameters
+# - Simulations primal parameters, defaults of Mdsystem_2D
 
 nparticles = 4000
 ntriangles = 1
@@ -31,365 +38,1029 @@ l0_spring = 10
 sigma = 1.0
 e0 = 1.0
 rad = -2.0
-rlim_lj = 100
+rlim_lj = 5.0           # cutoff, 3 sigma past the shifted core r = -rad
 epsilon = 1
 
-ncells = 10
+potential = "lj"        # "lj" (sigma, e0, rad above), "softcore", "morse" or any object with a ti.func force(r)
+table = None            # None : analytic force, "linear" / "cubic" : lookup table of table_size intervals
+table_size = 2048
+
+periodic = False        # periodic box with minimum-image distances, else reflecting walls
+
+pair_mode = "half"      # "full", "half" (each pair once, reproducible) or "atomic"
+use_nlist = False       # Verlet list instead of the cell stencil for lj_force
+skin = 2.0              # Verlet list built up to rlim_lj + skin
+
+reorder = None          # None, "cell" or "morton" : sort particle storage spatially
+reorder_every = 1       # ... every reorder_every cell list rebuilds
+
+nreplicas = 1           # independent copies of the system advanced by the same kernel launches
+
+fused = True            # one kernel for the per-particle stages of step(), else one kernel per stage
+
+integrator = "euler"    # "euler" : overdamped with noise, as always. "verlet" : velocity Verlet (NVE),
+                        # "baoab" : Langevin at rep_T with friction gamma, "respa" : velocity Verlet with
+                        # the fast forces (springs, center force) sub-stepped respa_steps times per step
+mass = 1.0
+gamma = 1.0
+respa_steps = 4
+k_center = 1.0          # stiffness of the pull to the center of the box, 0 : none
+
+adaptive = False        # dt of each replica chosen every step so that no particle moves more than max_disp
+max_disp = 0.05
+dt_min = 1e-6           # when even dt_min moves too far, the moves of the step are capped to max_disp
+dt_max = 0.1
+dt_history = 4096       # last chosen dts kept on device, see Mdsystem_2D.dt_history()
+lj_cap = 100.0          # "lj" forces beyond +-lj_cap are set to -10, float("inf") with adaptive dt
 
 dim = 2
-boundary_x = (0,screen_res[0])
-boundary_y = (0,screen_res[1])
-redcell_x = ( dim - 2 ) / (screen_res[0]  * 2)
-redcell_y = ( dim - 2 ) / (screen_res[1]  * 2)
-maxhash = (dim+2)**2
 
-# - Initialisation of datas
+@ti.data_oriented
+class Neighbor_list: # - Verlet list in CSR form, built from a Cell_reg
+
+    def __init__(self, reg, rcut, skin, max_neighbors=64):
+
+        self.reg = reg
+        self.nparticles = reg.nparticles
+        self.rcut = rcut
+        self.skin = skin
+        self.rlist = rcut + skin        # pairs kept in the list
+
+        if min(reg.cell_size) < self.rlist:
+            raise ValueError("Cell_reg cells are smaller than rcut + skin : " + str(reg.cell_size))
+
+        self.capacity = self.nparticles * max_neighbors     # grown when a build overflows
+
+        self.nb_count = ti.field( shape=self.nparticles, dtype=ti.i32)   # neighbors of each particle
+        self.nb_start = ti.field( shape=self.nparticles, dtype=ti.i32)   # first neighbor slot of each particle
+        self.nb_end = ti.field( shape=self.nparticles, dtype=ti.i32)     # one past the last neighbor slot
+        self.neighbors = ti.field( shape=self.capacity, dtype=ti.i32)    # flat neighbor indices
+
+        self.scan_block = 64
+        self.block_sum = ti.field( shape=(self.nparticles + self.scan_block - 1) // self.scan_block, dtype=ti.i32)
+
+        self.pos_ref = ti.Vector.field(reg.pos.n, float, shape=self.nparticles)   # positions at the last build
+        self.max_disp = ti.field(float, shape=())
+
+        self.nbuilds = 0
+        self.ncalls = 0
+
+    @ti.kernel
+    def list_pass(self, plist: ti.template(), neighbors: ti.template(), fill: ti.template()):
+
+        # fill == False : count the neighbors, fill == True : write them from nb_start
+
+        for k in range(self.nparticles):
+
+            xp, yp = hashToCell2d_ti(self.reg.particle_hash[k], self.reg.ny)
+            count = 0
 
-	# -- Particletype 1
+            for i in range(xp-1,xp+2):
+                for j in range(yp-1,yp+2):
 
-p_pos = ti.Vector.field(dim, float)
-p_vel = ti.Vector.field(dim, float)
-p_force = ti.Vector.field(dim, float)
+                    hash_part = self.reg.cell_at(i, j)
+                    if hash_part != -1:
 
-p_idx = ti.field(ti.i32)
-p_hashlist = ti.field(ti.i32)
-p_start_idx = ti.field(ti.i32)
+                        for pos in range(self.reg.start_idx[hash_part], self.reg.end_idx[hash_part]):
 
-	# -- Particletype 2
+                            q = self.reg.idx[pos]
+                            if q != k:
 
-t_link_0 = ti.field(int)
-t_link_1 = ti.field(int)
+                                r, r2, drx, dry = self.reg.dist(plist[q], plist[k])
+                                if r < self.rlist:
 
-t_pos = ti.Vector.field(dim, float)
-t_vel = ti.Vector.field(dim, float)
-t_force = ti.Vector.field(dim, float)
+                                    if ti.static(fill):
+                                        neighbors[self.nb_start[k] + count] = q
+                                    count += 1
 
-t_idx = ti.field(ti.i32)
-t_hashlist = ti.field(ti.i32)
-t_start_idx = ti.field(ti.i32)
+            if ti.static(not fill):
+                self.nb_count[k] = count
 
-# - Allocation of memory
+    @ti.kernel
+    def save_ref(self, plist: ti.template()):
 
-ti.root.dense(ti.i, nparticles).place(p_pos, p_vel, p_force)
-ti.root.dense(ti.j, ntriangles*3).place(t_pos, t_vel, t_force)
-ti.root.dense(ti.j, ntriangles*3).place(t_link_0, t_link_1)
+        self.max_disp[None] = 0.0
+        for k in range(self.nparticles):
+            self.pos_ref[k] = plist[k]
 
-ti.root.dense(ti.i, nparticles).place(p_idx, p_hashlist)
-ti.root.dense(ti.i, nparticles).place(t_idx, t_hashlist)
-ti.root.dense(ti.i, maxhash).place(p_start_idx, t_start_idx)
+    @ti.kernel
+    def displacement(self, plist: ti.template()):
 
-# - Utility functions
+        self.max_disp[None] = 0.0
+        for k in range(self.nparticles):
+            r, r2, drx, dry = self.reg.dist(plist[k], self.pos_ref[k])
+            ti.atomic_max(self.max_disp[None], r)
+
+    def build(self, parts):
+
+        self.reg.update(parts)
+        self.list_pass(parts, self.neighbors, False)
+        exclusive_scan(self.nb_count, self.nb_start, self.nb_end, self.block_sum, self.scan_block)
+
+        total = self.nb_end[self.nparticles - 1]
+        if total > self.capacity:   # new field, passed as template so the kernels see it
+            self.capacity = int(total * 1.25) + 1
+            self.neighbors = ti.field( shape=self.capacity, dtype=ti.i32)
+
+        self.list_pass(parts, self.neighbors, True)
+        self.save_ref(parts)
+        self.nbuilds += 1
+
+    def restore_shapes(self, shapes): # Checkpoint of a grown list
+        if "neighbors" in shapes:
+            self.capacity = shapes["neighbors"][0]
+            self.neighbors = ti.field( shape=self.capacity, dtype=ti.i32)
+
+    def update(self, parts): # Rebuild only once a particle moved more than skin/2
+
+        self.ncalls += 1
+        if self.nbuilds > 0:
+            self.displacement(parts)
+            if self.max_disp[None] < 0.5 * self.skin:
+                return False
+
+        self.build(parts)
+        return True
+
+def scratch_like(f): # Field with the same element type and shape as f
+    if isinstance(f, ti.MatrixField):
+        if f.ndim == 1:
+            return ti.Vector.field(f.n, f.dtype, shape=f.shape)
+        return ti.Matrix.field(f.n, f.m, f.dtype, shape=f.shape)
+    return ti.field(f.dtype, shape=f.shape)
+
+def morton2d(x, y): # Interleave the bits of two integer arrays
+    code = np.zeros_like(x, dtype=np.int64)
+    for b in range(16):
+        code |= ((x >> b) & 1) << (2 * b)
+        code |= ((y >> b) & 1) << (2 * b + 1)
+    return code
 
 @ti.data_oriented
-class Cell_reg: # - useful for a particlesystem object
+class Spatial_order: # - Keep particle storage sorted by cell, ids stay valid through ids / slot_of
+
+    def __init__(self, reg, fields, order="cell", every=1):
+
+        self.reg = reg
+        self.nparticles = reg.nparticles
+        self.order = order          # "cell" : row-major cell order, "morton" : cells in Z-order
+        self.every = every          # reorder once every `every` calls of due()
+        self.ncalls = 0
 
-    def __init__(self, parts, dim, spacedim):  # Necessary for cell listing
+        self.fields = []
+        self.scratch = []
+        for f in fields:
+            self.attach(f)
 
-        self.pos = parts
-        self.nparticles = self.pos.shape[0]
-        self.spacedim = spacedim
-        self.dim = dim + 2  # particles should not be in the extremities
+        self.perm = ti.field( shape=self.nparticles, dtype=ti.i32)      # old index of the particle in each new slot
+        self.inv = ti.field( shape=self.nparticles, dtype=ti.i32)       # new slot of each old index
+        self.tmp = ti.field( shape=self.nparticles, dtype=ti.i32)
 
-        self.padded_size = 1 << (self.nparticles - 1).bit_length()  # Prochaine puissance de 2
-        self.logsize = np.log2(self.padded_size)
+        self.ids = ti.field( shape=self.nparticles, dtype=ti.i32)       # external id of the particle in each slot
+        self.slot_of = ti.field( shape=self.nparticles, dtype=ti.i32)   # current slot of each external id
 
-        self.idx = ti.field( shape=self.nparticles, dtype=ti.i32)
-        self.hashlist = ti.field( shape=self.nparticles, dtype=ti.i32)
-        self.start_idx = ti.field( shape=(self.dim)**3, dtype=ti.i32)
+        if self.order == "morton":
 
-        self.n2idx = ti.field(dtype=ti.f32, shape=self.padded_size)
-        self.n2hash = ti.field(dtype=ti.f32, shape=self.padded_size)
+            cells = np.arange(reg.ncells)
+            gx = cells // reg.ny     # replica first, so that each replica keeps its own slots
+            zcells = np.lexsort((morton2d(gx % reg.nx_rep, cells % reg.ny), gx // reg.nx_rep))
 
-        self.max_hash = self.dim**3 + 1
-        self.redcell_x = ( dim ) / ( self.spacedim[0] ) # use of dim to keep particles inside
-        self.redcell_y = ( dim ) / ( self.spacedim[1] )
+            self.zcells = ti.field( shape=reg.ncells, dtype=ti.i32)     # cell hashes in Z-order
+            self.zcount = ti.field( shape=reg.ncells, dtype=ti.i32)
+            self.zstart = ti.field( shape=reg.ncells, dtype=ti.i32)
+            self.zend = ti.field( shape=reg.ncells, dtype=ti.i32)
+            self.block_sum = ti.field( shape=reg.nblocks, dtype=ti.i32)
+            self.zcells.from_numpy(zcells.astype(np.int32))
 
-        for k in range(self.idx.shape[0]): self.idx[k] = k
+        elif self.order != "cell":
+            raise ValueError("Unknown particle order : " + str(order))
 
+        self.init_ids()
+
+    def attach(self, f): # Any per-particle field to be permuted with the positions
+        self.fields.append(f)
+        self.scratch.append(scratch_like(f))
+
+    def due(self):
+        self.ncalls += 1
+        return self.every > 0 and self.ncalls % self.every == 0
+
+    @ti.kernel
+    def init_ids(self):
+        for k in range(self.nparticles):
+            self.ids[k] = k
+            self.slot_of[k] = k
 
     @ti.kernel
-    def bitonic_sort_hash(self, up: ti.i32, Nl: ti.i32):
-        k = 2
-        while k <= Nl:
-            j = k // 2
-            while j > 0:
-                ti.loop_config(parallelize=int(self.logsize))
-                for i in range(Nl):
-                    ixj = i ^ j
-                    if ixj > i:
-                        if ((i & k) == 0 and up == 1) or ((i & k) != 0 and up == 0):
-                            if (self.n2hash[i] > self.n2hash[ixj]):
-
-                                self.n2hash[i], self.n2hash[ixj] = self.n2hash[ixj], self.n2hash[i]
-                                self.n2idx[i], self.n2idx[ixj] = self.n2idx[ixj], self.n2idx[i]
-
-                        else:
-                            if (self.n2hash[i] < self.n2hash[ixj]):
-
-                                self.n2hash[i], self.n2hash[ixj] = self.n2hash[ixj], self.n2hash[i]
-                                self.n2idx[i], self.n2idx[ixj] = self.n2idx[ixj], self.n2idx[i]
-
-                j = j // 2
-            k = k * 2
+    def cell_perm(self):
+        for s in range(self.nparticles):
+            self.perm[s] = self.reg.idx[s]
 
     @ti.kernel
-    def fill_start_idx(self):
+    def morton_count(self):
+        for m in range(self.reg.ncells):
+            self.zcount[m] = self.reg.cell_count[ self.zcells[m] ]
 
-        for k in range(self.start_idx.shape[0]):
+    @ti.kernel
+    def morton_perm(self):
+        for m in range(self.reg.ncells):
+            c = self.zcells[m]
+            for t in range(self.zend[m] - self.zstart[m]):
+                self.perm[ self.zstart[m] + t ] = self.reg.idx[ self.reg.start_idx[c] + t ]
 
-            self.start_idx[k] = -1 #self.max_hash
+    @ti.kernel
+    def permute(self, f: ti.template(), tmp: ti.template()):
+        for s in range(self.nparticles):
+            tmp[s] = f[ self.perm[s] ]
+        for s in range(self.nparticles):
+            f[s] = tmp[s]
 
     @ti.kernel
-    def solve_start_idx(self):
+    def remap(self):
 
-        for k in range(self.idx.shape[0]):
+        for s in range(self.nparticles):   # Inverse permutation
+            self.inv[ self.perm[s] ] = s
 
-            if k <= self.start_idx[ int(self.hashlist[k]) ] or self.start_idx[ int(self.hashlist[k]) ] == -1:
+        for s in range(self.nparticles):   # Cell list of the new storage, slots are unchanged
+            self.reg.idx[s] = self.inv[ self.reg.idx[s] ]
+            self.tmp[s] = self.reg.particle_hash[ self.perm[s] ]
+        for s in range(self.nparticles):
+            self.reg.particle_hash[s] = self.tmp[s]
 
-                self.start_idx[ int(self.hashlist[k]) ] = k
+        for s in range(self.nparticles):   # External ids
+            self.tmp[s] = self.ids[ self.perm[s] ]
+        for s in range(self.nparticles):
+            self.ids[s] = self.tmp[s]
+            self.slot_of[ self.tmp[s] ] = s
 
-    @ti.kernel
-    def copy_to_n2(self):
+    def apply(self): # To be called right after reg.update, the register is kept valid
+
+        if self.order == "cell":
+            self.cell_perm()
+        else:
+            self.morton_count()
+            exclusive_scan(self.zcount, self.zstart, self.zend, self.block_sum, self.reg.scan_block)
+            self.morton_perm()
+
+        for f, tmp in zip(self.fields, self.scratch):
+            self.permute(f, tmp)
+
+        self.remap()
+
+@ti.data_oriented
+class Segment_reg: # - Segments binned into the cells of a Cell_reg, for particle - segment interactions
+
+    def __init__(self, reg, max_segments, rcut=None, stable=True, entries_per_segment=4):
+
+        # Segment s joins spos[link0[s]] and spos[link1[s]]. It is listed in every cell its
+        # bounding box overlaps : a particle then finds every segment closer than rcut in
+        # the 3x3 stencil of its own cell, as long as rcut is under the cell size.
+
+        if reg.periodic:
+            raise ValueError("Segment_reg needs a non periodic Cell_reg")
 
-        for i in range(self.nparticles):
-            self.n2idx[i] = self.idx[i]
-            self.n2hash[i] = self.hashlist[i]
+        self.reg = reg
+        self.max_segments = max_segments
+        self.rcut = reg.rcut if rcut is None else rcut
+        self.stable = stable    # order each cell by segment index, for reproducible sums
 
-        for i in range(self.nparticles, self.padded_size):
-            self.n2idx[i] = self.max_hash + 1
-            self.n2hash[i] = self.max_hash + 1
+        if min(reg.cell_size) < self.rcut:
+            raise ValueError("Cell_reg cells are smaller than rcut : " + str(reg.cell_size))
+
+        self.nseg = ti.field( shape=(), dtype=ti.i32)                       # segments listed
+        self.seg_per_rep = max(1, max_segments // reg.nreplicas)            # replica of segment s : s // seg_per_rep
+        self.box = ti.Vector.field(4, ti.i32, shape=max_segments)          # cell range x0, y0, x1, y1 of each segment
+
+        self.cell_count = ti.field( shape=reg.ncells, dtype=ti.i32)
+        self.start_idx = ti.field( shape=reg.ncells, dtype=ti.i32)
+        self.end_idx = ti.field( shape=reg.ncells, dtype=ti.i32)
+        self.block_sum = ti.field( shape=reg.nblocks, dtype=ti.i32)
+
+        self.capacity = max_segments * entries_per_segment                  # grown when a build overflows
+        self.entries = ti.field( shape=self.capacity, dtype=ti.i32)         # segment indices sorted by cell
+
+    def set_count(self, n): # int or 0-d field
+        if isinstance(n, ti.Field):
+            self.copy_count(n)
+        else:
+            self.nseg[None] = n
+
+    @ti.kernel
+    def copy_count(self, n: ti.template()):
+        self.nseg[None] = n[None]
 
     @ti.kernel
-    def copy_from_n2(self):
+    def count_segments(self, spos: ti.template(), link0: ti.template(), link1: ti.template()):
 
-        for i in range(self.nparticles):
-            self.idx[i] = int(self.n2idx[i])
-            self.hashlist[i] = int(self.n2hash[i])
+        for c in range(self.reg.ncells):
+            self.cell_count[c] = 0
+
+        for s in range(self.nseg[None]):
+
+            replica = s // self.seg_per_rep
+            xa, ya = hashToCell2d_ti(self.reg.hash_pos(spos[ link0[s] ], replica), self.reg.ny)
+            xb, yb = hashToCell2d_ti(self.reg.hash_pos(spos[ link1[s] ], replica), self.reg.ny)
+            b = ti.Vector([ti.min(xa, xb), ti.min(ya, yb), ti.max(xa, xb), ti.max(ya, yb)])
+            self.box[s] = b
+
+            for i, j in ti.ndrange((b[0], b[2] + 1), (b[1], b[3] + 1)):
+                ti.atomic_add(self.cell_count[ cellToHash2d_ti(i, j, self.reg.ny) ], 1)
 
     @ti.kernel
-    def cell_list2d(self):
+    def fill_segments(self, entries: ti.template()):
 
-        for k in range(self.nparticles):
+        for c in range(self.reg.ncells):
+            self.cell_count[c] = 0
+
+        for s in range(self.nseg[None]):
 
-            part = self.pos[k]
+            b = self.box[s]
+            for i, j in ti.ndrange((b[0], b[2] + 1), (b[1], b[3] + 1)):
+                c = cellToHash2d_ti(i, j, self.reg.ny)
+                entries[ self.start_idx[c] + ti.atomic_add(self.cell_count[c], 1) ] = s
 
-            xred = int((part[0] + 0.0) * self.redcell_x) + 1
-            yred = int((part[1] + 0.0) * self.redcell_y) + 1
+        if ti.static(self.stable):  # the atomic ranks leave each cell in scheduling order
+            for c in range(self.reg.ncells):
+                sort_range(entries, self.start_idx[c], self.end_idx[c])
 
-            hashcode = xred * self.dim + yred
-            self.hashlist[k] = hashcode
+    def update(self, spos, link0, link1, nseg): # nseg : int or 0-d field, segments 0 .. nseg - 1 are listed
 
-        return
+        self.set_count(nseg)
+        self.count_segments(spos, link0, link1)
+        exclusive_scan(self.cell_count, self.start_idx, self.end_idx, self.block_sum, self.reg.scan_block)
 
-    def update(self, parts): # Main calling for the Register
-        self.pos = parts
-        self.cell_list2d()
-        self.copy_to_n2()
-        self.bitonic_sort_hash( 1 , self.padded_size )  # 1 pour trier en ordre croissant
-        self.copy_from_n2()
-        self.fill_start_idx()
-        self.solve_start_idx()
+        total = self.end_idx[self.reg.ncells - 1]
+        if total > self.capacity:   # new field, passed as template so the kernels see it
+            self.capacity = int(total * 1.25) + 1
+            self.entries = ti.field( shape=self.capacity, dtype=ti.i32)
 
-            # Necessary for Mesh-Particle interaction
+        self.fill_segments(self.entries)
 
-p_reg = Cell_reg(p_pos, ncells, boundary)
-t_reg = Cell_reg(t_pos, ncells, boundary)
+    def restore_shapes(self, shapes): # Checkpoint of a grown register
+        if "entries" in shapes:
+            self.capacity = shapes["entries"][0]
+            self.entries = ti.field( shape=self.capacity, dtype=ti.i32)
 
-# - Utility ti functions
+    @ti.func
+    def closest(self, p, a, b): # Parameter t in [0, 1] of the point of a - b closest to p
 
-@ti.func
-def dist(pos1, pos2):
+        ab = b - a
+        l2 = ab.dot(ab)
+        t = 0.0
+        if l2 > 0.0:
+            t = ti.min(ti.max((p - a).dot(ab) / l2, 0.0), 1.0)
+        return t
 
-    drx = pos1[0] - pos2[0]
-    dry = pos1[1] - pos2[1]
+    @ti.kernel
+    def segment_forces(self, plist: ti.template(), forces: ti.template(), spos: ti.template(), sforces: ti.template(),
+                       link0: ti.template(), link1: ti.template(), entries: ti.template(), pot: ti.template()):
+
+        # Each particle meets a segment once : in the first cell of its stencil that the
+        # bounding box of the segment overlaps. The particle gets pot.force at the closest
+        # point, the segment ends share the reaction by the closest point parameter.
+
+        for k in range(self.reg.nlive()):
 
-    r2 = drx*drx + dry*dry
-    r = ti.sqrt(r2)
+            xp, yp = hashToCell2d_ti(self.reg.particle_hash[k], self.reg.ny)
+            p = plist[k]
+            fk = ti.Vector.zero(float, dim)
 
-    return r, r2, drx, dry
+            for i in range(xp-1,xp+2):
+                for j in range(yp-1,yp+2):
 
-@ti.func
-def lj_f(r, rad, sigma, e0):
-	r += rad
-	intensity = - e0 * ( 48*(sigma/r)**12 - 24*(sigma/r)**6 )
-	return intensity
+                    hash_part = self.reg.cell_at(i, j)
+                    if hash_part != -1:
 
-@ti.func
-def hashToCell2d_ti(hashcode, dim):
+                        for e in range(self.start_idx[hash_part], self.end_idx[hash_part]):
 
-    xpos = hashcode//dim
-    ypos = hashcode%dim
+                            s = entries[e]
+                            b = self.box[s]
+                            if i == ti.max(b[0], xp - 1) and j == ti.max(b[1], yp - 1):
 
-    return xpos, ypos
+                                a0 = spos[ link0[s] ]
+                                a1 = spos[ link1[s] ]
+                                t = self.closest(p, a0, a1)
+                                c = a0 + t * (a1 - a0)
+                                r, r2, drx, dry = self.reg.dist(c, p)
 
-@ti.func
-def cellToHash2d_ti(xpos, ypos, dim):
+                                if r < self.rcut and r > 0.0:
 
-    hashcode = xpos*dim + ypos
+                                    f = pot.force(r) * ti.Vector([drx, dry]) / r
+                                    fk += f
+                                    ti.atomic_sub(sforces[ link0[s] ], (1.0 - t) * f)
+                                    ti.atomic_sub(sforces[ link1[s] ], t * f)
 
-    return ti.cast(hashcode, int)
+            forces[k] += fk
 
-# - Kernel functions
+    def forces(self, plist, forces, spos, sforces, link0, link1, pot): # Adds the particle - segment forces, after update
+        self.segment_forces(plist, forces, spos, sforces, link0, link1, self.entries, pot)
+
+# - Simulation object
+
+@ti.data_oriented
+class Mdsystem_2D: # - LJ particles (p_) and spring triangles (t_) with the whole step() pipeline
+
+    def __init__(self, nparticles=nparticles, ntriangles=ntriangles, boundary=boundary, arch=None,
+                 dt=dt, T=T, k_spring=k_spring, l0_spring=l0_spring, sigma=sigma, e0=e0, rad=rad,
+                 rlim_lj=rlim_lj, epsilon=epsilon, periodic=periodic, pair_mode=pair_mode,
+                 use_nlist=use_nlist, skin=skin, reorder=reorder, reorder_every=reorder_every,
+                 nreplicas=nreplicas, fused=fused, potential=potential, table=table, table_size=table_size,
+                 integrator=integrator, mass=mass, gamma=gamma, respa_steps=respa_steps, k_center=k_center,
+                 adaptive=adaptive, max_disp=max_disp, dt_min=dt_min, dt_max=dt_max, dt_history=dt_history, lj_cap=lj_cap):
+
+        # Parameters are compiled into the kernels, they are fixed once the object is built.
+        # arch : if given, ti.init(arch) is called first, which frees every field of the previous runtime.
+        # nreplicas : the fields hold nreplicas systems of nparticles one after the other, replica r
+        # in [r * nparticles, (r + 1) * nparticles). T and dt may be one value per replica, they are
+        # kept in the fields rep_T / rep_dt which can be changed between steps.
+
+        if arch is not None:
+            ti.init(arch=arch)
+
+        self.nparticles = nparticles    # per replica
+        self.ntriangles = ntriangles
+        self.nreplicas = nreplicas
+        self.ntotal = nparticles * nreplicas
+        self.boundary = tuple(boundary)
+
+        self.dt = dt
+        self.T = T
+        self.k_spring = k_spring
+        self.l0_spring = l0_spring
+        self.sigma = sigma
+        self.e0 = e0
+        self.rad = rad
+        self.rlim_lj = rlim_lj
+        self.epsilon = epsilon
+        self.periodic = periodic
+        self.pair_mode = pair_mode
+        self.use_nlist = use_nlist
+        self.fused = fused
+        self.forces_clear = False   # p_force / t_force already zeroed by fused_update
+
+        if integrator not in ("euler", "verlet", "baoab", "respa"):
+            raise ValueError("Unknown integrator : " + str(integrator))
+
+        self.integrator = integrator
+        self.mass = mass
+        self.gamma = gamma
+        self.respa_steps = respa_steps
+        self.k_center = k_center
+        self.forces_valid = False   # p_force / t_force hold the forces of the current positions, to be reset
+                                    # when positions are changed by hand with a velocity integrator
+
+        # -- Per replica parameters
+
+        self.rep_T = ti.field(float, shape=nreplicas)
+        self.rep_dt = ti.field(float, shape=nreplicas)
+        self.rep_T.from_numpy(np.broadcast_to(np.asarray(T, dtype=np.float32), (nreplicas,)).copy())
+        self.rep_dt.from_numpy(np.broadcast_to(np.asarray(dt, dtype=np.float32), (nreplicas,)).copy())
+
+        # -- Adaptive dt : per replica max |F| and max |v| reduced on device, chosen dts in a ring
+
+        self.adaptive = adaptive
+        self.max_disp = max_disp
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        if adaptive:
+            self.rep_fmax = ti.field(float, shape=nreplicas)
+            self.rep_vmax = ti.field(float, shape=nreplicas)
+            self.rep_limit = ti.field(ti.i32, shape=nreplicas)     # 1 : dt_min moves too far, displacements are capped
+            self.dt_ring = ti.field(float, shape=(dt_history, nreplicas))
+            self.dt_count = ti.field(ti.i32, shape=())
+
+        # -- Particletype 1
+
+        self.p_pos = ti.Vector.field(dim, float, shape=self.ntotal)
+        self.p_vel = ti.Vector.field(dim, float, shape=self.ntotal)
+        self.p_force = ti.Vector.field(dim, float, shape=self.ntotal)
+
+        # -- Particletype 2
+
+        self.t_link_0 = ti.field(int, shape=ntriangles*3*nreplicas)
+        self.t_link_1 = ti.field(int, shape=ntriangles*3*nreplicas)
+
+        self.t_pos = ti.Vector.field(dim, float, shape=ntriangles*3*nreplicas)
+        self.t_vel = ti.Vector.field(dim, float, shape=ntriangles*3*nreplicas)
+        self.t_force = ti.Vector.field(dim, float, shape=ntriangles*3*nreplicas)
+
+        # -- Slow forces of respa, p_force / t_force then hold the fast ones
+
+        if integrator == "respa":
+            self.p_fslow = ti.Vector.field(dim, float, shape=self.ntotal)
+            self.t_fslow = ti.Vector.field(dim, float, shape=ntriangles*3*nreplicas)
+
+        # -- Pair potential, a template argument of the pair kernels
+
+        if isinstance(potential, str):
+            params = dict(sigma=sigma, e0=e0, rad=rad, cap=lj_cap) if potential == "lj" else {}
+            potential = make_potential(potential, **params)
+        if table is not None:
+            potential = Pair_table(potential, 0.0, rlim_lj, table_size, table)
+        self.p_pot = potential
+        self.p_pairs = Pair_forces(rlim_lj, self.p_pot, dim)              # Cell stencil and Verlet list traversals
+
+        # -- Registers
+
+        self.p_reg = Cell_reg(self.p_pos, rlim_lj + skin if use_nlist else rlim_lj, self.boundary, periodic, nreplicas=nreplicas)
+        self.p_nlist = Neighbor_list(self.p_reg, rlim_lj, skin) if use_nlist else None
+        self.p_order = Spatial_order(self.p_reg, [self.p_pos, self.p_vel, self.p_force], reorder, reorder_every) if reorder else None
+        self.t_reg = Cell_reg(self.t_pos, rlim_lj, self.boundary, periodic, nreplicas=nreplicas)     # Necessary for Mesh-Particle interaction
+        self.t_segs = None if periodic else Segment_reg(self.p_reg, ntriangles*3*nreplicas, rlim_lj)     # Triangle edges on the grid of p_reg
+
+        # -- Triangle edges as bonds, per bond k / l0 can be changed in t_bonds
+
+        self.init_links()
+        self.t_bonds = Bonded_forces(ntriangles*3*nreplicas, ntriangles*3*nreplicas, 1, box=self.boundary if periodic else None)
+        self.t_bonds.from_links(self.t_link_0, self.t_link_1, ntriangles*3*nreplicas, k_spring, l0_spring)
+
+        # -- Wall time of each stage of step(), filled when profile is set
+
+        self.profile = False
+        self.timings = {"cell_list": 0.0, "lj_force": 0.0, "integrate": 0.0}
+        self.nsteps = 0
+        self._t0 = 0.0
+
+    # - Pair interactions
+
+    def pair_forces(self, plist, forces, reg, mode, pot=None): # Pair forces from a Cell_reg with the chosen traversal, p_pot by default
+        self.p_pairs.compute(plist, forces, reg, mode, pot)
+
+    # - Kernel functions
+
+    @ti.kernel
+    def reinit_forces(self):
 
-@ti.kernel
-def reinit_forces():
+        self.p_force.fill(0.0)
+        self.t_force.fill(0.0)
 
-	p_force.fill(0.0)
-	t_force.fill(0.0)
+    def springs(self, forces=None): # Triangle edges, added to t_force by default
+        self.t_bonds.compute(self.t_pos, self.t_force if forces is None else forces)
 
+    def mesh_forces(self): # p_pot between the particles and the closest point of the triangle edges, p_reg must be up to date
+        self.t_segs.update(self.t_pos, self.t_link_0, self.t_link_1, self.ntriangles*3*self.nreplicas)
+        self.t_segs.forces(self.p_pos, self.p_force, self.t_pos, self.t_force, self.t_link_0, self.t_link_1, self.p_pot)
 
-@ti.kernel
-def springs():
+    @ti.kernel
+    def integrate(self):
 
-	for k in t_link_0:
+        for k in range(self.ntotal):
+            r = k // self.nparticles
+            self.p_pos[k] += self.limit_disp(self.p_force[k] * self.rep_dt[r], r, self.max_disp)
 
-		r, r2, drx, dry = dist( t_pos[ t_link_0[k] ] , t_pos[ t_link_1[k] ] )
-		intensity = - (r - l0_spring) * k_spring
+        for k in range(self.ntriangles*3*self.nreplicas):
+            r = k // (self.ntriangles*3)
+            self.t_pos[k] += self.limit_disp(self.t_force[k] * self.rep_dt[r], r, self.max_disp)
 
-		t_force[ t_link_0[k] ][0] += intensity * (drx/r)
-		t_force[ t_link_0[k] ][1] += intensity * (dry/r)
+    @ti.kernel
+    def add_noise(self):
 
-		t_force[ t_link_1[k] ][0] -= intensity * (drx/r)
-		t_force[ t_link_1[k] ][1] -= intensity * (dry/r)
+        for k in self.p_force:
+            T = self.rep_T[k // self.nparticles]
+            self.p_force[k][0] += (ti.random()-0.5)*T
+            self.p_force[k][1] += (ti.random()-0.5)*T
+        for k in self.t_force:
+            T = self.rep_T[k // (self.ntriangles*3)]
+            self.t_force[k][0] += (ti.random()-0.5)*T
+            self.t_force[k][1] += (ti.random()-0.5)*T
 
-@ti.kernel
-def integrate():
+    @ti.kernel
+    def add_gravity(self):
+        for k in self.p_force:
+            self.p_force[k][1] += -10
 
-	for k in range(nparticles):
-		p_pos[k] += p_force[k] * dt
+    def add_centerforce(self, x, y):
+        self.center_force(self.p_force, x, y)
 
-	for k in range(ntriangles*3):
-		t_pos[k] += t_force[k] * dt
+    @ti.kernel
+    def center_force(self, forces: ti.template(), x: float, y: float):
+        for k in range(forces.shape[0]):
+            forces[k][0] -= self.k_center * (self.p_pos[k][0] - x)
+            forces[k][1] -= self.k_center * (self.p_pos[k][1] - y)
 
-@ti.kernel
-def add_noise():
+    @ti.func
+    def boundary_pos(self, p):
 
-	for k in p_force:
-		p_force[k][0] += (ti.random()-0.5)*T
-		p_force[k][1] += (ti.random()-0.5)*T
-	for k in t_force:
-		t_force[k][0] += (ti.random()-0.5)*T
-		t_force[k][1] += (ti.random()-0.5)*T
+        if ti.static(self.periodic):      # wrap into [0, boundary)
 
-@ti.kernel
-def add_gravity():
-	for k in p_force:
-		p_force[k][1] += -10
+            for c in ti.static(range(dim)):
+                p[c] = wrap(p[c], 0.0, self.boundary[c])
 
+        else:
 
-@ti.kernel
-def add_centerforce(x: float,y: float):
-	for k in range(p_force.shape[0]):
-		p_force[k][0] -= p_pos[k][0] - x
-		p_force[k][1] -= p_pos[k][1] - y
+            if p[0] <= 0.0:
+                p[0] += self.epsilon * ti.random()
 
-@ti.kernel
-def lj_force(n: int, plist: ti.template(), forces: ti.template(), reg: ti.template()):
+            if p[0] >= self.boundary[0]:
+                p[0] -= self.boundary[0] + self.epsilon * ti.random()
 
-    #ti.loop_config(serialize=True)
-    for k in range(n):  # Loop for all particles
+            if p[1] <= 0.0:
+                p[1] += self.epsilon * ti.random()
 
-        xp, yp = hashToCell2d_ti(reg.hashlist[k], ncells+2)
-        #print("original cell = ",end=" ")
-        #print(xp,yp)
+            if p[1] >= self.boundary[1]:
+                p[1] -= self.boundary[1] - self.epsilon * ti.random()
 
-        for i in range(xp-1,xp+2):
-            for j in range(yp-1,yp+2):
+        return p
 
-                hash_part = cellToHash2d_ti(i,j,ncells+2)
+    @ti.kernel
+    def apply_boundary(self):
 
-                #print("target cell = ",end=" ")
-                #print(i,j,reg.start_idx[hash_part])
+        for k in range(self.ntotal):
+            self.p_pos[k] = self.boundary_pos(self.p_pos[k])
 
-                if(i>=0 and j>=0 and i<ncells+2 and j<ncells+2 and reg.start_idx[hash_part]!=-1):
+    @ti.kernel
+    def fused_update(self, x: float, y: float):
 
-                    pos = int( reg.start_idx[hash_part] ) # index in the hashlist corresponding
-                    hashcode_init = reg.hashlist[ pos ]
-                    #print("condition passed",end=" ")
-                    #print(pos)
+        # add_centerforce, add_noise, integrate and apply_boundary in one pass : each particle
+        # reads its force and position once and writes its position once. The forces are
+        # zeroed on the way for the pair kernels of the next step, which replaces reinit_forces.
 
-                    while pos < nparticles and reg.hashlist[pos] == hashcode_init:
+        for k in range(self.ntotal):
 
-                        if(k!=reg.idx[pos]):
+            r = k // self.nparticles
+            p = self.p_pos[k]
+            f = self.p_force[k]
 
-                    # -----------------------------------------------
+            f[0] -= self.k_center * (p[0] - x)
+            f[1] -= self.k_center * (p[1] - y)
+            f[0] += (ti.random()-0.5)*self.rep_T[r]
+            f[1] += (ti.random()-0.5)*self.rep_T[r]
 
-                            r, r2, drx, dry = dist(plist[ reg.idx[pos] ],plist[k])
+            self.p_pos[k] = self.boundary_pos(p + self.limit_disp(f * self.rep_dt[r], r, self.max_disp))
+            self.p_force[k] = ti.Vector.zero(float, dim)
 
-                            #print("r = ")
-                            #print(r)
-                            #print(k,pos)
-                            if(r<rlim_lj):
+        for k in range(self.ntriangles*3*self.nreplicas):
 
-                            	intensity = lj_f(r, rad, sigma, e0)
-                            	if intensity > 100 or intensity < -100 :
-                            		intensity = -10
-                            	#print(r,intensity)
+            r = k // (self.ntriangles*3)
+            f = self.t_force[k]
 
-                            	forces[p_idx[pos]][0] -= intensity * (drx/r)
-                            	forces[p_idx[pos]][1] -= intensity * (dry/r)
+            f[0] += (ti.random()-0.5)*self.rep_T[r]
+            f[1] += (ti.random()-0.5)*self.rep_T[r]
 
-                            	forces[k][0] += intensity * (drx/r)
-                            	forces[k][1] += intensity * (dry/r)
+            self.t_pos[k] += self.limit_disp(f * self.rep_dt[r], r, self.max_disp)
+            self.t_force[k] = ti.Vector.zero(float, dim)
 
-                    # -----------------------------------------------
+    @ti.kernel
+    def init_rdparticles(self):
 
-                        pos += 1 # go to the next particle
-                        if(pos == n): break
-                        hashcode_current = reg.hashlist[ pos ]
+        for k in range(self.ntotal):
+            for c in ti.static(range(dim)):
+                self.p_pos[k][c] = (ti.random()) * self.boundary[c]
 
+        for k in range(self.ntriangles*3*self.nreplicas):
+            for c in ti.static(range(dim)):
+                self.t_pos[k][c] = (ti.random()) * self.boundary[c]
 
-@ti.kernel
-def apply_boundary():
+    @ti.kernel
+    def init_links(self):
+
+        for k in range(self.ntriangles*self.nreplicas):   # triangles never link across replicas
+            self.t_link_0[3*k] = k*3
+            self.t_link_1[3*k] = k*3 + 1
+            self.t_link_0[3*k+1] = k*3 + 1
+            self.t_link_1[3*k+1] = k*3 + 2
+            self.t_link_0[3*k+2] = k*3 + 2
+            self.t_link_1[3*k+2] = k*3
+
+    def trajectory(self, path, fields=("p_pos", "p_vel"), **kwargs): # Trajectory_writer of the named fields, stored by particle id
+
+        order = self.p_order.slot_of if self.p_order is not None else None
+        return Trajectory_writer(path, {name: getattr(self, name) for name in fields}, order=order, **kwargs)
+
+    def checkpoint(self, path): # Every field and counter into one file, see datastructs.checkpoint
+        return save_checkpoint(self, path)
+
+    def restore(self, path): # State of checkpoint(path), into a system built with the same parameters
+        load_checkpoint(self, path)
+
+    # - Step pipeline
+
+    def reset_timings(self):
+        for name in self.timings:
+            self.timings[name] = 0.0
+        self.nsteps = 0
+
+    def _tick(self, stage): # Charge the time since the last tick to stage
+        if self.profile:
+            ti.sync()
+            now = time.perf_counter()
+            self.timings[stage] += now - self._t0
+            self._t0 = now
+
+    def update_neighbors(self):
+
+        if self.use_nlist:
+            if self.p_nlist.update(self.p_pos) and self.p_order is not None and self.p_order.due():
+                self.p_order.apply()
+                self.p_nlist.build(self.p_pos)      # the list holds the old indices
+        else:
+            self.p_reg.update(self.p_pos)
+            if self.p_order is not None and self.p_order.due():
+                self.p_order.apply()
+
+    def compute_lj(self, forces=None): # Pair forces of the particles, added to p_force by default
+
+        forces = self.p_force if forces is None else forces
+        if self.use_nlist:
+            nl = self.p_nlist
+            self.p_pairs.from_list(self.p_pos, forces, self.p_reg, nl.nb_start, nl.nb_end, nl.neighbors, self.p_pot)
+        else:
+            self.pair_forces(self.p_pos, forces, self.p_reg, self.pair_mode)
+
+    def step(self):
+
+        if self.profile:
+            ti.sync()
+            self._t0 = time.perf_counter()
+
+        if self.integrator == "euler":
+            self.step_euler()
+        elif self.integrator == "respa":
+            self.step_respa()
+        else:
+            self.step_verlet()
+        self.nsteps += 1
+
+    def step_euler(self): # Overdamped : x += (F + noise) dt
+
+        if not self.forces_clear:
+            self.reinit_forces()
+        self._tick("integrate")
+        #self.t_reg.update(self.t_pos)
+        #self.springs()
+        self.update_neighbors()
+        self._tick("cell_list")
+        self.compute_lj()
+        #self.mesh_forces()
+        self._tick("lj_force")
+        #self.add_gravity()
+        if self.adaptive:
+            self.adapt_dt(self.p_force, self.t_force, self.p_force, self.t_force, False, 0.5 * self.boundary[0], 0.5 * self.boundary[1])
+        if self.fused:      # p_force is left at zero
+            self.fused_update(0.5 * self.boundary[0], 0.5 * self.boundary[1])
+        else:
+            self.add_centerforce(0.5 * self.boundary[0], 0.5 * self.boundary[1])
+            self.add_noise()
+            self.integrate()
+            self.apply_boundary()
+        self.forces_clear = self.fused
+        self._tick("integrate")
+
+    # - Velocity integrators, p_vel / t_vel in use. The slow forces are the pair forces, the
+    # - fast ones the springs of the triangles and the center force.
+
+    def slow_forces(self, pf, tf):
+
+        pf.fill(0.0)
+        tf.fill(0.0)
+        self._tick("integrate")
+        self.update_neighbors()
+        self._tick("cell_list")
+        self.compute_lj(pf)
+        self._tick("lj_force")
+
+    def fast_forces(self, pf, tf):
+
+        pf.fill(0.0)
+        tf.fill(0.0)
+        self.springs(tf)
+        if self.k_center != 0.0:
+            self.center_force(pf, 0.5 * self.boundary[0], 0.5 * self.boundary[1])
 
-	for k in range(nparticles):
+    @ti.kernel
+    def kick(self, vel: ti.template(), forces: ti.template(), nper: int, h: float): # v += h dt F / m
 
-		if p_pos[k][0] <= boundary_x[0]:
-			p_pos[k][0] += boundary_x[0] + epsilon * ti.random()
+        for k in range(vel.shape[0]):
+            vel[k] += h * self.rep_dt[k // nper] / self.mass * forces[k]
 
-		if p_pos[k][0] >= boundary_x[1]:
-			p_pos[k][0] -= boundary_x[1] + epsilon * ti.random()
+    @ti.kernel
+    def drift(self, pos: ti.template(), vel: ti.template(), nper: int, h: float, bounded: ti.template()): # x += h dt v
+
+        for k in range(pos.shape[0]):
+            r = k // nper
+            d = h * self.rep_dt[r] * vel[k]
+            if ti.static(self.adaptive):
+                if self.rep_limit[r] == 1:      # velocity of the capped move
+                    d = self.limit_disp(d, r, h * self.max_disp)
+                    vel[k] = d / (h * self.rep_dt[r])
+            p = pos[k] + d
+            if ti.static(bounded):
+                p = self.boundary_pos(p)
+            pos[k] = p
 
-		if p_pos[k][1] <= boundary_y[0]:
-			p_pos[k][1] += boundary_y[0] + epsilon * ti.random()
+    @ti.kernel
+    def thermostat(self, vel: ti.template(), nper: int, h: float): # O step : exact Ornstein-Uhlenbeck over h dt at rep_T
+
+        for k in range(vel.shape[0]):
+            r = k // nper
+            c1 = ti.exp(-self.gamma * h * self.rep_dt[r])
+            c2 = ti.sqrt((1.0 - c1 * c1) * self.rep_T[r] / self.mass)
+            vel[k] = c1 * vel[k] + c2 * ti.Vector([ti.randn() for _ in range(dim)])
+
+    def kicks(self, pf, tf, h):
+        self.kick(self.p_vel, pf, self.nparticles, h)
+        self.kick(self.t_vel, tf, self.ntriangles*3, h)
+
+    def drifts(self, h):
+        self.drift(self.p_pos, self.p_vel, self.nparticles, h, True)
+        self.drift(self.t_pos, self.t_vel, self.ntriangles*3, h, False)
+
+    def step_verlet(self): # Velocity Verlet, with the Langevin O step in the middle for baoab
+
+        if not self.forces_valid:
+            self.verlet_forces()
+        if self.adaptive:
+            self.adapt_dt(self.p_force, self.t_force, self.p_force, self.t_force, False, 0.0, 0.0)
+
+        self.kicks(self.p_force, self.t_force, 0.5)
+        if self.integrator == "baoab":
+            self.drifts(0.5)
+            self.thermostat(self.p_vel, self.nparticles, 1.0)
+            self.thermostat(self.t_vel, self.ntriangles*3, 1.0)
+            self.drifts(0.5)
+        else:
+            self.drifts(1.0)
+        self.verlet_forces()
+        self.kicks(self.p_force, self.t_force, 0.5)
+        self._tick("integrate")
+
+    def verlet_forces(self):
+
+        self.slow_forces(self.p_force, self.t_force)
+        self.springs(self.t_force)
+        if self.k_center != 0.0:
+            self.center_force(self.p_force, 0.5 * self.boundary[0], 0.5 * self.boundary[1])
+        self.forces_valid = True
+
+    def step_respa(self): # Slow kicks of dt / 2 around respa_steps velocity Verlet steps of dt / respa_steps on the fast forces
+
+        if not self.forces_valid:
+            self.slow_forces(self.p_fslow, self.t_fslow)
+            self.fast_forces(self.p_force, self.t_force)
+            self.forces_valid = True
+        if self.adaptive:   # on the total force, the fast forces are then sub-stepped on dt / respa_steps
+            self.adapt_dt(self.p_force, self.t_force, self.p_fslow, self.t_fslow, True, 0.0, 0.0)
+
+        h = 1.0 / self.respa_steps
+        self.kicks(self.p_fslow, self.t_fslow, 0.5)
+        for _ in range(self.respa_steps):
+            self.kicks(self.p_force, self.t_force, 0.5 * h)
+            self.drifts(h)
+            self.fast_forces(self.p_force, self.t_force)
+            self.kicks(self.p_force, self.t_force, 0.5 * h)
+        self._tick("integrate")
+        self.slow_forces(self.p_fslow, self.t_fslow)
+        self.kicks(self.p_fslow, self.t_fslow, 0.5)
+        self._tick("integrate")
+
+    # - Adaptive dt
+
+    @ti.func
+    def bounded_dt(self, fmax, vmax): # Largest dt up to dt_max moving no particle by more than max_disp, may be under dt_min
+
+        dt = self.dt_max
+        if ti.static(self.integrator == "euler"):       # x += F dt
+            if fmax > 0.0:
+                dt = self.max_disp / fmax
+        else:                                           # x += v dt + F / m dt^2 / 2
+            a = fmax / self.mass
+            if a > 0.0:
+                dt = (ti.sqrt(vmax * vmax + 2.0 * a * self.max_disp) - vmax) / a
+            elif vmax > 0.0:
+                dt = self.max_disp / vmax
+        return ti.min(dt, self.dt_max)
+
+    @ti.func
+    def limit_disp(self, d, r, cap):
+
+        # Displacement d of a particle of replica r, brought back to a length of cap when dt_min
+        # was still too long for that replica. An infinite component sets the direction alone, a
+        # NaN one does not move.
+
+        if ti.static(self.adaptive):
+            if self.rep_limit[r] == 1:
+
+                inf = False
+                for c in ti.static(range(dim)):
+                    if ti.math.isinf(d[c]):
+                        inf = True
+                for c in ti.static(range(dim)):
+                    if ti.math.isnan(d[c]) or (inf and not ti.math.isinf(d[c])):
+                        d[c] = 0.0
+                    elif ti.math.isinf(d[c]):
+                        d[c] = 1.0 if d[c] > 0.0 else -1.0
+
+                m = 0.0                                     # scaled first, the norm of huge components overflows
+                for c in ti.static(range(dim)):
+                    m = ti.max(m, ti.abs(d[c]))
+                if m > 0.0:
+                    d = d / m
+                    n = d.norm()
+                    if m * n > cap:
+                        d = d * (cap / n)
+                    else:
+                        d = d * m
+        return d
 
-		if p_pos[k][1] >= boundary_y[1]:
-			p_pos[k][1] -= boundary_y[1] - epsilon * ti.random()
+    @ti.kernel
+    def adapt_dt(self, pf: ti.template(), tf: ti.template(), pslow: ti.template(), tslow: ti.template(), slow: ti.template(), x: float, y: float):
+
+        # rep_dt from the forces about to be integrated : pf / tf, plus pslow / tslow when slow,
+        # plus the center force for euler which adds it later. Nothing is read back by the host.
+        # When even dt_min moves a particle further than max_disp, or a force or velocity is not
+        # finite, the replica steps dt_min with its displacements capped to max_disp (rep_limit).
+
+        for r in range(self.nreplicas):
+            self.rep_fmax[r] = 0.0
+            self.rep_vmax[r] = 0.0
+            self.rep_limit[r] = 0
+
+        for k in range(self.ntotal):
+
+            r = k // self.nparticles
+            f = pf[k]
+            if ti.static(slow):
+                f += pslow[k]
+            if ti.static(self.integrator == "euler"):
+                f -= self.k_center * (self.p_pos[k] - ti.Vector([x, y]))
+            else:
+                self.reduce_max(self.rep_vmax, r, self.p_vel[k].norm())
+            self.reduce_max(self.rep_fmax, r, f.norm())
+
+        for k in range(self.ntriangles*3*self.nreplicas):
+
+            r = k // (self.ntriangles*3)
+            f = tf[k]
+            if ti.static(slow):
+                f += tslow[k]
+            if ti.static(self.integrator != "euler"):
+                self.reduce_max(self.rep_vmax, r, self.t_vel[k].norm())
+            self.reduce_max(self.rep_fmax, r, f.norm())
+
+        row = self.dt_count[None] % self.dt_ring.shape[0]
+        for r in range(self.nreplicas):
+            dt = self.bounded_dt(self.rep_fmax[r], self.rep_vmax[r])
+            if dt < self.dt_min:
+                self.rep_limit[r] = 1
+                dt = self.dt_min
+            self.rep_dt[r] = dt
+            self.dt_ring[row, r] = dt
+
+        self.dt_count[None] += 1
+
+    @ti.func
+    def reduce_max(self, fmax, r, x): # Max of x into fmax[r], a non-finite x flags the replica instead
+        if ti.math.isnan(x) or ti.math.isinf(x):
+            self.rep_limit[r] = 1
+        else:
+            ti.atomic_max(fmax[r], x)
+
+    def dt_history(self): # Chosen dts, oldest first, (steps, nreplicas) : the last dt_history steps at most
+
+        n = self.dt_count[None]
+        ring = self.dt_ring.to_numpy()
+        if n <= ring.shape[0]:
+            return ring[:n]
+        return np.roll(ring, -(n % ring.shape[0]), axis=0)
+
+    # - Energies, for the potentials with an energy(r) : pair energies come from p_pairs, shifted to 0 at rlim_lj
 
-@ti.kernel
-def init_rdparticles():
+    @ti.kernel
+    def kinetic_energy(self, vel: ti.template()) -> float:
+        e = 0.0
+        for k in range(vel.shape[0]):
+            e += 0.5 * self.mass * vel[k].dot(vel[k])
+        return e
 
-	for k in range(nparticles):
-		for c in ti.static(range(dim)):
-			p_pos[k][c] = (ti.random()) * boundary[0]
+    @ti.kernel
+    def center_energy(self, x: float, y: float) -> float:
+        e = 0.0
+        for k in range(self.ntotal):
+            e += 0.5 * self.k_center * ((self.p_pos[k][0] - x)**2 + (self.p_pos[k][1] - y)**2)
+        return e
 
-	for k in range(ntriangles*3):
-		for c in ti.static(range(dim)):
-			t_pos[k][c] = (ti.random()) * boundary[0]
+    def energy(self): # Total energy of every replica, kinetic + pairs + springs + center
 
-	for k in range(ntriangles):
-		t_link_0[3*k] = k*3
-		t_link_1[3*k] = k*3 + 1
-		t_link_0[3*k+1] = k*3 + 1
-		t_link_1[3*k+1] = k*3 + 2
-		t_link_0[3*k+2] = k*3 + 2
-		t_link_1[3*k+2] = k*3
+        self.p_reg.update(self.p_pos)
+        return (self.kinetic_energy(self.p_vel) + self.kinetic_energy(self.t_vel)
+                + self.p_pairs.energy(self.p_pos, self.p_reg, self.p_pot) + self.t_bonds.energy(self.t_pos)
+                + self.center_energy(0.5 * self.boundary[0], 0.5 * self.boundary[1]))
 
 # -  Rendering function
 
-def render(gui):
+def render(gui, sim):
 
     gui.clear(bg_color)
-    p_pos_np = p_pos.to_numpy()
-    t_pos_np = t_pos.to_numpy()
-    t_lines_0 = t_link_0.to_numpy()
-    t_lines_1 = t_link_1.to_numpy()
+    p_pos_np = sim.p_pos.to_numpy()[:sim.nparticles]       # replica 0
+    t_pos_np = sim.t_pos.to_numpy()[:sim.ntriangles*3]
+    t_lines_0 = sim.t_link_0.to_numpy()[:sim.ntriangles*3]
+    t_lines_1 = sim.t_link_1.to_numpy()[:sim.ntriangles*3]
 
-    gui.rect(topleft=(boundary_x[0],boundary_y[1]), bottomright=(boundary_x[1],boundary_y[0]), color=0xFFFFFF)
+    gui.rect(topleft=(0, 1), bottomright=(1, 0), color=0xFFFFFF)
 
     for j in range(dim):
-        p_pos_np[:, j] *= screen_to_world_ratio / screen_res[j]
-        t_pos_np[:, j] *= screen_to_world_ratio / screen_res[j]
+        p_pos_np[:, j] /= sim.boundary[j]
+        t_pos_np[:, j] /= sim.boundary[j]
 
     for j in range(len(t_lines_0)):
         coord0 = t_pos_np[t_lines_0[j]]
@@ -400,62 +1071,27 @@ def render(gui):
     gui.circles(t_pos_np, radius=particle_radius, color=boundary_color)
     gui.show()
 
-# - logs functions
-
-logfile = open("logfile.txt", "w")
-
-def print_logs(logfile):
-
-    log_hashlist = p_reg.hashlist.to_numpy()
-    logfile.write("Hashlist \n")
-    logfile.write(str(log_hashlist) + "\n")
-
-    log_idx = p_reg.idx.to_numpy()
-    logfile.write("Idx \n")
-    logfile.write(str(log_idx) + "\n")
-
-    log_pos = p_pos.to_numpy()
-    logfile.write("Pos \n")
-    #logfile.write(str(log_pos) + "\n")
-
-    log_start_idx = p_reg.start_idx.to_numpy()
-    logfile.write("Start_Idx \n")
-    for k in range( len(log_start_idx) ):
-        logfile.write(str(log_start_idx[k])+" ")
-        if(k%20==0):
-            logfile.write("\n")
-    logfile.write("\n")
-
 # --- Main function --- #
 
 def main():
     print("main starting")
-    init_rdparticles()
-    p_reg.update(p_pos)
-    t_reg.update(t_pos)
+    sim = Mdsystem_2D(arch=ti.gpu)
+    traj = sim.trajectory("trajectory")
+    sim.init_rdparticles()
+    sim.p_reg.update(sim.p_pos)
+    sim.t_reg.update(sim.t_pos)
 
     gui = ti.GUI("Particles system", screen_res)
     print("timeloop starting")
     #for t in range(100):
     while gui.running and not gui.get_event(gui.ESCAPE):
-        step()
+        sim.step()
         if gui.frame % 20 == 1:
-            print_logs(logfile)
-
-        render(gui)
-    logfile.close()
+            traj.write(sim.nsteps)
 
-def step():
+        render(gui, sim)
+    traj.close()
 
-	reinit_forces()
-	p_reg.update(p_pos)
-	#t_reg.update(t_pos)
-	#springs()
-	lj_force(nparticles, p_pos, p_force, p_reg)
-	#add_gravity()
-	add_centerforce(40.0,40.0)
-	add_noise()
-	integrate()
-	apply_boundary()
+if __name__ == "__main__":
 
-main()
+    main()
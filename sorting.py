@@ -1,27 +1,44 @@
 @ti.data_oriented
 class Cell_reg:
 
-    def __init__(self, parts, dim, spacedim):  # Necessary for cell listing
+    def __init__(self, parts, dim, spacedim, method="counting"):  # Necessary for cell listing
 
         self.particlesystem = parts
         self.nparticles = parts.nparticles
+        self.method = method  # "counting" : prefix-sum binning, "bitonic" : legacy sort
 
-        self.padded_size = 1 << (self.nparticles - 1).bit_length()  # Prochaine puissance de 2
-        self.logsize = np.log2(self.padded_size)
+        self.dim = dim + 2  # particles should not be in the extremities
+        self.ncells = self.dim**3
 
-        self.idx = ti.field( shape=self.nparticles, dtype=ti.i32)
-        self.hashlist = ti.field( shape=self.nparticles, dtype=ti.i32)
+        self.idx = ti.field( shape=self.nparticles, dtype=ti.i32)         # particle indices sorted by cell
+        self.hashlist = ti.field( shape=self.nparticles, dtype=ti.i32)    # cell of each sorted slot
         self.select_neighbors = ti.field( shape=self.nparticles, dtype=ti.i32)
-        self.start_idx = ti.field( shape=(dim+2)**3, dtype=ti.i32)
+        self.start_idx = ti.field( shape=self.ncells, dtype=ti.i32)       # first slot of each cell
+        self.end_idx = ti.field( shape=self.ncells, dtype=ti.i32)         # one past the last slot of each cell
+        self.cell_count = ti.field( shape=self.ncells, dtype=ti.i32)      # number of particles in each cell
 
-        self.n2idx = ti.field(dtype=ti.f32, shape=self.padded_size)
-        self.n2hash = ti.field(dtype=ti.f32, shape=self.padded_size)
+        self.particle_hash = ti.field( shape=self.nparticles, dtype=ti.i32)   # cell of each particle
+        self.rank = ti.field( shape=self.nparticles, dtype=ti.i32)            # position of the particle inside its cell
+
+        self.scan_block = 64                                                  # cells summed by one thread of the scan
+        self.nblocks = (self.ncells + self.scan_block - 1) // self.scan_block
+        self.block_sum = ti.field( shape=self.nblocks, dtype=ti.i32)
 
-        self.dim = dim + 2  # particles should not be in the extremities
         self.max_hash = self.dim**3 + 1
         self.spacedim = spacedim  
         self.redcell = ( dim - 2 ) / ( self.spacedim  * 2) # use of dim to keep particles inside
 
+        if self.method == "bitonic":
+
+            self.padded_size = 1 << (self.nparticles - 1).bit_length()  # Prochaine puissance de 2
+            self.logsize = np.log2(self.padded_size)
+
+            self.n2idx = ti.field(dtype=ti.f32, shape=self.padded_size)
+            self.n2hash = ti.field(dtype=ti.f32, shape=self.padded_size)
+
+        elif self.method != "counting":
+            raise ValueError("Unknown cell list method : " + str(method))
+
         for k in range(self.idx.shape[0]): self.idx[k] = k
 
 
@@ -54,39 +71,60 @@ class Cell_reg:
             k = k * 2
 
     @ti.kernel
-    def fill_start_idx(self):
+    def scan_cells(self): # Exclusive prefix sum of cell_count into start_idx / end_idx
 
-        for k in range(self.start_idx.shape[0]):
+        for b in range(self.nblocks):  # Sum of each block of cells
 
-            self.start_idx[k] = -1#self.max_hash
+            s = 0
+            for c in range(b * self.scan_block, ti.min((b + 1) * self.scan_block, self.ncells)):
+                s += self.cell_count[c]
+            self.block_sum[b] = s
 
+        for _ in range(1):  # Scan of the block sums, short enough to stay serial
 
-    @ti.kernel
-    def solve_start_idx(self):
+            acc = 0
+            for b in range(self.nblocks):
+                s = self.block_sum[b]
+                self.block_sum[b] = acc
+                acc += s
+
+        for b in range(self.nblocks):  # Scan inside each block from its offset
 
-        for k in range(self.idx.shape[0]):
+            acc = self.block_sum[b]
+            for c in range(b * self.scan_block, ti.min((b + 1) * self.scan_block, self.ncells)):
+                self.start_idx[c] = acc
+                acc += self.cell_count[c]
+                self.end_idx[c] = acc
 
-            if k <= self.start_idx[ int(self.n2hash[k]) ] or self.start_idx[ int(self.n2hash[k]) ] == -1:
+    @ti.kernel
+    def scatter_cells(self):
 
-                self.start_idx[ int(self.n2hash[k]) ] = k
+        for k in range(self.nparticles):
 
+            hashcode = self.particle_hash[k]
+            slot = self.start_idx[hashcode] + self.rank[k]
 
+            self.idx[slot] = k
+            self.hashlist[slot] = hashcode
 
     def update(self): # Main calling for the Register
         #print(self.nparticles)
         self.cell_list()
-        self.copy_to_n2()
-        self.bitonic_sort_hash( 1 , self.padded_size )  # 1 pour trier en ordre croissant
-        self.copy_from_n2()
-        self.fill_start_idx()
-        self.solve_start_idx()
+        if self.method == "counting":
+            self.scan_cells()
+            self.scatter_cells()
+        else:
+            self.copy_to_n2()
+            self.bitonic_sort_hash( 1 , self.padded_size )  # 1 pour trier en ordre croissant
+            self.copy_from_n2()
+            self.scan_cells()
 
     @ti.kernel
     def copy_to_n2(self):
 
         for i in range(self.nparticles):
-            self.n2idx[i] = self.idx[i]
-            self.n2hash[i] = self.hashlist[i]
+            self.n2idx[i] = i
+            self.n2hash[i] = self.particle_hash[i]
 
         for i in range(self.nparticles, self.padded_size):
             self.n2idx[i] = self.max_hash + 1
@@ -105,6 +143,9 @@ class Cell_reg:
 
         obj = self.particlesystem
 
+        for c in range(self.ncells):
+            self.cell_count[c] = 0
+
         for k in range(self.nparticles):
 
             part = obj.pos[k]
@@ -113,7 +154,12 @@ class Cell_reg:
             yred = int((part[1] + self.spacedim) * self.redcell) + 1
             zred = int((part[2] + self.spacedim) * self.redcell) + 1
 
+            xred = ti.max(1, ti.min(self.dim - 2, xred))    # stray particles go to the border cells
+            yred = ti.max(1, ti.min(self.dim - 2, yred))
+            zred = ti.max(1, ti.min(self.dim - 2, zred))
+
             hashcode = xred * self.dim * self.dim + yred * self.dim + zred
-            self.hashlist[k] = hashcode
+            self.particle_hash[k] = hashcode
+            self.rank[k] = ti.atomic_add(self.cell_count[hashcode], 1)
 
         return